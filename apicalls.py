@@ -4,23 +4,230 @@ Functionality to call the API
 NB For this code to execute the app MUST be running
 python app.py
 
+Usage
+    python apicalls.py
+        Call each endpoint once and write the responses to apireturns.txt
+    python apicalls.py load
+        Load test the app with a concurrent mix of endpoint calls and
+        write the throughput and latency percentiles to loadtest.json and
+        loadtest.csv
+
 Author: Christopher Bonham
 Date: 17th February 2023
 '''
 import requests
 import os
+import sys
+import json
+import time
 import logging
-from utils.io import read_config
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from utils.io import read_config, FEATURES
 
 # Domain of dev server
 domain_dev = "http://127.0.0.1:8000"
 
 
+# Latency histogram bin edges (ms)
+LATENCY_BINS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                float("inf")]
+
+
 # Create a logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
+def make_session(pool_size=10):
+    '''Get an HTTP session with a keep alive connection pool
+
+    Inputs:
+        pool_size (int default = 10)
+            Maximum number of pooled connections, at least the number of
+            threads sharing the session
+    Outputs:
+        requests.Session
+            Session
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def synthetic_payloads(batch_sizes, seed=0):
+    '''Get JSON batch prediction payloads of random records
+
+    Inputs:
+        batch_sizes (list)
+            Number of records of each payload
+        seed (int default = 0)
+            Random seed
+    Outputs:
+        list
+            JSON request bodies (bytes), lists of rows in feature order
+    '''
+    rng = np.random.default_rng(seed)
+    return [
+        json.dumps(rng.integers(0, 1000, size=(size, len(FEATURES)))
+                   .tolist()).encode("utf-8")
+        for size in batch_sizes
+    ]
+
+
+def call_endpoint(session, domain, endpoint, payload=None):
+    '''Call an endpoint and time it
+
+    Inputs:
+        session (requests.Session)
+            HTTP session
+        domain (string)
+            Domain of the app
+        endpoint (string)
+            One of prediction, scoring, summarystats or diagnostics
+        payload (bytes default = None)
+            Batch prediction request body
+    Outputs:
+        dict
+            Endpoint, status code (0 if the call failed), latency (ms)
+            and payload size
+    '''
+    start = time.perf_counter()
+    try:
+        if endpoint == "prediction":
+            rc = session.post(f"{domain}/prediction", data=payload,
+                              headers={"Content-Type": "application/json"})
+        else:
+            rc = session.get(f"{domain}/{endpoint}")
+        status = rc.status_code
+    except requests.RequestException:
+        status = 0
+    return {
+        "endpoint": endpoint,
+        "status": status,
+        "latency_ms": (time.perf_counter() - start) * 1000,
+        "payload_bytes": 0 if payload is None else len(payload),
+    }
+
+
+def run_load_test(domain, mix, n_requests, concurrency, payloads, seed=0):
+    '''Call the endpoints concurrently, the endpoint of each call is drawn
+    from the request mix and prediction calls use a random payload
+
+    Inputs:
+        domain (string)
+            Domain of the app
+        mix (dict)
+            Endpoint to relative weight e.g. {"prediction": 0.9,
+            "scoring": 0.1}
+        n_requests (int)
+            Total number of requests
+        concurrency (int)
+            Number of client threads sharing the session
+        payloads (list)
+            Batch prediction request bodies
+        seed (int default = 0)
+            Random seed
+    Outputs:
+        tuple
+            List of call results (see call_endpoint), elapsed seconds
+    '''
+    rng = np.random.default_rng(seed)
+    endpoints = list(mix)
+    weights = np.array([mix[e] for e in endpoints], dtype=float)
+    calls = [
+        (endpoints[e], payloads[p]) for e, p in zip(
+            rng.choice(len(endpoints), n_requests, p=weights / weights.sum()),
+            rng.integers(0, len(payloads), n_requests))
+    ]
+
+    session = make_session(concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(
+            lambda call: call_endpoint(session, domain, call[0], call[1]),
+            calls))
+    return results, time.perf_counter() - start
+
+
+def summarise_latencies(results, elapsed):
+    '''Get the throughput, latency percentiles and histogram of calls
+
+    Inputs:
+        results (list)
+            Call results (see call_endpoint)
+        elapsed (float)
+            Seconds taken by the calls
+    Outputs:
+        dict
+            Summary
+    '''
+    latencies = np.array([r["latency_ms"] for r in results])
+    counts, _ = np.histogram(latencies, bins=LATENCY_BINS)
+    return {
+        "requests": len(results),
+        "errors": sum(not 0 < r["status"] < 400 for r in results),
+        "rps": len(results) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "histogram": {
+            "edges_ms": LATENCY_BINS[:-1],
+            "counts": counts.tolist(),
+        },
+    }
+
+
+def load_test(config, out_path):
+    '''Load test the app and write the summary to loadtest.json and
+    loadtest.csv
+
+    Inputs:
+        config (Dict)
+            Configuration
+        out_path (string)
+            Path to write the results
+    Outputs:
+        dict
+            Summary of all calls and of each endpoint
+    '''
+    concurrency = config.get("load_concurrency", 8)
+    results, elapsed = run_load_test(
+        config.get("api_url", domain_dev),
+        config.get("load_mix", {"prediction": 1}),
+        config.get("load_requests", 1000),
+        concurrency,
+        synthetic_payloads(config.get("load_batch_sizes", [1, 10, 100]))
+    )
+
+    # Summarise all calls and the calls of each endpoint
+    summary = {"concurrency": concurrency, "elapsed_seconds": elapsed,
+               "all": summarise_latencies(results, elapsed)}
+    for endpoint in sorted({r["endpoint"] for r in results}):
+        summary[endpoint] = summarise_latencies(
+            [r for r in results if r["endpoint"] == endpoint], elapsed)
+    logger.info(f"apicalls.py: Load test {summary['all']}")
+
+    with open(os.path.join(out_path, "loadtest.json"), "w") as fp:
+        json.dump(summary, fp, indent=2)
+    columns = ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+               "max_ms"]
+    with open(os.path.join(out_path, "loadtest.csv"), "w") as fp:
+        fp.write(",".join(["endpoint"] + columns) + "\n")
+        for endpoint in ["all"] + sorted(set(summary) - {
+                "all", "concurrency", "elapsed_seconds"}):
+            fp.write(",".join([endpoint] + [str(summary[endpoint][c])
+                                            for c in columns]) + "\n")
+    logger.info(f"apicalls.py: Load test written to "
+                f"{os.path.join(out_path, 'loadtest.json')}")
+
+    return summary
+
+
 def main():
     '''Main functionality call
 
@@ -33,22 +240,28 @@ def main():
     # Read the configuration file
     config = read_config(r".\config.json")
     logger.info("apicalls.py: Configuration file read")
+    out_path = os.path.join(os.getcwd(), config["output_model_path"])
+
+    # Load test
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        load_test(config, out_path)
+        return
 
-    with open(os.path.join(os.getcwd(), config["output_model_path"],
-                           "apireturns.txt"), "w") as fp:
+    session = make_session()
+    with open(os.path.join(out_path, "apireturns.txt"), "w") as fp:
 
         # Call the prediction endpoint and write the status code and
         # response body to file
         pth = os.path.join(os.getcwd(), "testdata", "testdata.csv")
         url = f"{domain_dev}/prediction?fname={pth}"
-        rc = requests.get(url)
+        rc = session.get(url)
         fp.write("Prediction endpoint")
         fp.write(f"\nStatus code: {rc.status_code}")
         fp.write(f"\n{str(rc.content)}")
 
         # Call the scoring endpoint and print the status code and response body
         url = f"{domain_dev}/scoring"
-        rc = requests.get(url)
+        rc = session.get(url)
         fp.write("\n\nScoring endpoint")
         fp.write(f"\nStatus code: {rc.status_code}")
         fp.write(f"\n{str(rc.content)}")
@@ -56,7 +269,7 @@ def main():
         # Call the summarystats endpoint and print the status code
         # and response body
         url = f"{domain_dev}/summarystats"
-        rc = requests.get(url)
+        rc = session.get(url)
         fp.write("\n\nSummary stats endpoint")
         fp.write(f"\nStatus code: {rc.status_code}")
         fp.write(f"\n{str(rc.content)}")
@@ -64,7 +277,7 @@ def main():
         # Call the diagnostics endpoint and print the status code and
         # response body
         url = f"{domain_dev}/diagnostics"
-        rc = requests.get(url)
+        rc = session.get(url)
         fp.write("\n\nDiagnostics endpoint")
         fp.write(f"\nStatus code: {rc.status_code}")
         fp.write(f"\n{str(rc.content)}")
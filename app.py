@@ -5,21 +5,56 @@ Author: Christopher Bonham
 Date: 17th February 2023
 '''
 import os
-import pandas as pd
-from flask import Flask, request
-from utils.io import read_config
-from diagnostics import model_predictions, load_training_data, \
-                        dataframe_summary, missing_data, execution_time, \
-                        outdated_packages_list
+from flask import Flask, request, jsonify
+from utils.io import read_config, load_model, resolve_data_file, \
+                     resolve_deployment, DEPLOYMENT_MANIFEST, FEATURES, LABEL
+from utils.cache import ArtifactCache
+from utils.payload import predict_batch
+from utils.jobs import BackgroundJob
+from scoring import load_test_data, get_f1_score
+# NB diagnostics is imported by the endpoints that use it to keep the app
+# start up (and worker spawn) fast
 
 
 # Instantiate app instance
 app = Flask(__name__)
 
 
-# Read the configuration file
+# Read the configuration file next to this module and resolve the
+# artifact paths from the same folder, so the app can be imported by a
+# server started from any working directory
 global config
-config = read_config(r".\config.json")
+base_path = os.path.dirname(os.path.abspath(__file__))
+config = read_config(os.path.join(base_path, "config.json"))
+
+
+# Keep the production model resident, it is reloaded when a deploy
+# switches the live version
+prod_path = os.path.join(base_path, config["prod_deployment_path"])
+prod_model = ArtifactCache(
+    os.path.join(prod_path, DEPLOYMENT_MANIFEST),
+    lambda: load_model(resolve_deployment(prod_path))
+)
+prod_model.get()
+
+
+# Keep the model being scored (output_model_path) and the test data
+# resident for the scoring endpoint
+model_path = os.path.join(base_path, config["output_model_path"])
+scoring_model = ArtifactCache(
+    os.path.join(model_path, "trainedmodel.pkl"),
+    lambda: load_model(model_path)
+)
+test_path = os.path.join(base_path, config["test_data_path"])
+test_file, _ = resolve_data_file(test_path, "testdata",
+                                 config.get("data_format", "csv"))
+test_data = ArtifactCache(
+    test_file,
+    lambda: load_test_data(test_path, config.get("data_format", "csv"),
+                           FEATURES + [LABEL])
+)
+# NB loaded at import so a preforking server shares it with its workers
+test_data.get()
 
 
 @app.route("/prediction")
@@ -38,22 +73,55 @@ def prediction_ep():
         Str
             Model predictions
     '''
+    import pandas as pd
+    from diagnostics import model_predictions
+
     # Get the query parameter and load the coresponding data
     fname = request.args.get('fname')
     df = pd.read_csv(fname)
 
-    # Get model prediction using the production model
-    preds = model_predictions(df, config)
+    # Get model prediction using the resident production model
+    preds = model_predictions(df, config, prod_model.get())
 
     return str(preds)
 
 
+@app.route("/prediction", methods=["POST"])
+def prediction_batch_ep():
+    '''Batch prediction endpoint takes the records to score in the request
+    body and applies the production model to them in a single call
+
+    The body can be JSON records, an Arrow IPC stream or a packed float64
+    array (see utils.payload.decode_batch)
+
+    Example call
+    curl -X POST -H "Content-Type: application/json" \\
+        -d '[{"lastmonth_activity": 234, "lastyear_activity": 3,
+              "number_of_employees": 10}]' http://127.0.0.1:8000/prediction
+
+    Inputs:
+        None
+    Outputs:
+        json
+            {"predictions": [...], "probabilities": [...]}
+    '''
+    # Score the batch using the resident production model
+    body, status = predict_batch(request.get_data(), request.content_type,
+                                 prod_model.get)
+    return jsonify(body), status
+
+
 @app.route("/scoring")
 def scoring_ep():
-    '''Scoring endpoint that runs the scoring.py script and return the F1 score
+    '''Scoring endpoint that scores the model against the test data
+    in-process and returns the F1 score
+
+    The latestscore.txt file is only written if the persist query
+    parameter is set
 
     Example call
     http://127.0.0.1:8000/scoring
+    http://127.0.0.1:8000/scoring?persist=true
 
     Inputs:
         None
@@ -61,21 +129,20 @@ def scoring_ep():
         string
             F1 score
     '''
-    # Run the script
-    os.system("python scoring.py")
-
-    # Get the F1 score from the file and return it
-    with open(os.path.join(os.getcwd(),
-                           config["output_model_path"],
-                           "latestscore.txt")) as fp:
-        f1 = fp.read()
+    persist = request.args.get("persist", "false").lower() in \
+        ("1", "true", "yes")
+
+    # Score the resident model against the resident test data
+    f1 = get_f1_score(test_data.get(), scoring_model.get(), model_path,
+                      persist=persist)
     return str(f1)
 
 
 @app.route("/summarystats")
 def summarystats_ep():
-    '''Summary stats endpoint that runs the dataframe_summary
+    '''Summary stats endpoint that runs the summary_stats
     function from the diagnostics.py
+    NB the stats are only recomputed after new data has been ingested
 
     Example call
     http://127.0.0.1:8000/summarystats
@@ -83,54 +150,63 @@ def summarystats_ep():
     Inputs:
         None
     Outputs:
-        str
-            Summary statistics
+        json
+            Summary statistics per numeric field
     '''
-
-    # Load training data
-    df = load_training_data(
-        os.path.join(os.getcwd(), config["output_folder_path"])
+    from diagnostics import summary_stats
+
+    # Get summary statistics of the training data
+    return summary_stats(
+        os.path.join(base_path, config["output_folder_path"]),
+        config.get("data_format", "csv"),
+        config.get("fingerprint_hash", False),
+        config.get("summary_mode", "exact") == "streaming"
     )
 
-    # Get summary statistics
-    summary_stats = dataframe_summary(df)
-
-    return summary_stats
 
-
-@app.route("/diagnostics")
-def diagnostics_ep():
-    '''Summary stats endpoint that runs the following functions
-    from diagnostics.py
+def run_diagnostics():
+    '''Run the following functions from diagnostics.py
     missing_data
     execution_time
     outdated_packages_list
 
-    Example call
-    http://127.0.0.1:8000/diagnostics
-
     Inputs:
         None
     Outputs:
         str
-            Summary statistics
+            Diagnostics response body
     '''
-
-    # Load training data
-    df = load_training_data(
-        os.path.join(os.getcwd(), config["output_folder_path"])
+    from diagnostics import load_training_data, summary_accumulator, \
+                            missing_data, execution_time, format_profile, \
+                            outdated_packages_list, index_snapshot_path
+
+    # Get missing values, from the streaming summary stats if configured
+    in_path = os.path.join(base_path, config["output_folder_path"])
+    if config.get("summary_mode", "exact") == "streaming":
+        missing_values = summary_accumulator(
+            in_path, config.get("data_format", "csv")).missing()
+    else:
+        df = load_training_data(in_path, config.get("data_format", "csv"))
+        missing_values = missing_data(df)
+
+    # Profile the ingestion and training stages
+    timings = "<br>".join(
+        f"{stage}: {format_profile(stats)}"
+        for stage, stats in execution_time(
+            config, config.get("profile_repeats", 1),
+            config.get("profile_warmup", 0)).items()
     )
 
-    # Get missing values
-    missing_values = missing_data(df)
-
-    # Time the ingestion.py and training.py modules
-    timings = execution_time()
-
     # Get a table of all outdated packages
     # NB this string has \n characters as we are printing html
     # we need to replace with <br>
-    outdated_packages = outdated_packages_list()
+    outdated_packages = outdated_packages_list(
+        index_snapshot_path(config),
+        config.get("outdated_packages_ttl", 3600),
+        config.get("package_index_online", False),
+        config.get("package_index_max_age", 86400),
+        config.get("package_index_timeout", 60)
+    )
 
     # Create and return response body
     rb = f"Missing values:<br>{missing_values}" \
@@ -139,6 +215,65 @@ def diagnostics_ep():
     return rb
 
 
+# Run the diagnostics in the background, requests get the latest result
+diagnostics_job = BackgroundJob(run_diagnostics)
+
+
+@app.route("/diagnostics")
+def diagnostics_ep():
+    '''Diagnostics endpoint that returns the latest diagnostics result
+    (see run_diagnostics) immediately along with its age
+
+    The diagnostics are run as a background job, a run is triggered when
+    there is no result yet, the result is older than diagnostics_max_age
+    seconds or the refresh query parameter is set
+
+    Example call
+    http://127.0.0.1:8000/diagnostics
+    http://127.0.0.1:8000/diagnostics?refresh=true
+
+    Inputs:
+        None
+    Outputs:
+        str
+            Diagnostics
+    '''
+    refresh = request.args.get("refresh", "false").lower() in \
+        ("1", "true", "yes")
+
+    # Trigger a background run if required
+    snapshot = diagnostics_job.snapshot()
+    max_age = config.get("diagnostics_max_age", 3600)
+    if refresh or snapshot["result"] is None or \
+            snapshot["age_seconds"] > max_age:
+        diagnostics_job.trigger()
+
+    if snapshot["result"] is None:
+        return "Diagnostics are being computed, poll /diagnostics/status", 202
+
+    return f"Result age: {snapshot['age_seconds']:.1f} seconds<br><br>" \
+           f"{snapshot['result']}"
+
+
+@app.route("/diagnostics/status")
+def diagnostics_status_ep():
+    '''Diagnostics status endpoint used to poll a background diagnostics
+    run
+
+    Example call
+    http://127.0.0.1:8000/diagnostics/status
+
+    Inputs:
+        None
+    Outputs:
+        json
+            Job state, result age, run timestamps and last error
+    '''
+    snapshot = diagnostics_job.snapshot()
+    snapshot["has_result"] = snapshot.pop("result") is not None
+    return jsonify(snapshot)
+
+
 # Top level script entry point
 # Run the app on a local development server
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+'''
+Functionality to benchmark the production serving mode
+
+For each worker count a gunicorn server (see gunicorn.conf.py) is started
+on a scratch port, the batch prediction endpoint is loaded from a pool of
+client threads and the requests per second and latency percentiles are
+recorded to serving_benchmark.csv in the model folder. The micro-batching
+asynchronous server (see serve_async.py) is benchmarked the same way at
+several concurrency levels to async_benchmark.csv
+
+Usage
+    python benchmark.py
+    python benchmark.py async
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from utils.io import read_config, FEATURES
+
+
+# Create a logger
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def batch_payload(batch_size, seed=0):
+    '''Get a JSON payload of random records to score
+
+    Inputs:
+        batch_size (int)
+            Number of records
+        seed (int default = 0)
+            Random seed
+    Outputs:
+        bytes
+            JSON list of rows in feature order
+    '''
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, 1000, size=(batch_size, len(FEATURES)))
+    return json.dumps(rows.tolist()).encode("utf-8")
+
+
+def run_load(url, payload, n_requests, concurrency):
+    '''POST the payload n_requests times from a pool of client threads,
+    each with its own keep alive session
+
+    Inputs:
+        url (string)
+            Endpoint URL
+        payload (bytes)
+            JSON request body
+        n_requests (int)
+            Total number of requests
+        concurrency (int)
+            Number of client threads
+    Outputs:
+        dict
+            Requests per second, latency percentiles (ms) and errors
+    '''
+    local = threading.local()
+    headers = {"Content-Type": "application/json"}
+
+    def call(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        ok = local.session.post(url, data=payload, headers=headers).ok
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(call, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "rps": n_requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "errors": sum(not r[1] for r in results),
+    }
+
+
+def wait_until_ready(url, payload, server, timeout=60):
+    '''Wait until the server answers
+
+    Inputs:
+        url (string)
+            Endpoint URL
+        payload (bytes)
+            JSON request body
+        server (subprocess.Popen)
+            Server process
+        timeout (float default = 60)
+            Seconds to wait
+    Outputs:
+        None
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.post(url, data=payload,
+                          headers={"Content-Type": "application/json"})
+            return
+        except requests.ConnectionError:
+            if server.poll() is not None:
+                raise RuntimeError(f"benchmark.py: Server exited with "
+                                   f"status {server.returncode}")
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def benchmark_server(args, port, payload, n_requests, concurrency_levels):
+    '''Start a server and load it at several concurrency levels
+
+    Inputs:
+        args (list)
+            Server module and arguments, run with python -m. The server
+            must bind to 127.0.0.1:port
+        port (int)
+            Port the server binds to
+        payload (bytes)
+            JSON request body
+        n_requests (int)
+            Total number of requests per concurrency level
+        concurrency_levels (list)
+            Numbers of client threads
+    Outputs:
+        list
+            Load results (see run_load) of each concurrency level
+    '''
+    url = f"http://127.0.0.1:{port}/prediction"
+    server = subprocess.Popen([sys.executable, "-m"] + args)
+    try:
+        wait_until_ready(url, payload, server)
+        results = []
+        for concurrency in concurrency_levels:
+            results.append(run_load(url, payload, n_requests, concurrency))
+            logger.info(f"benchmark.py: {args[0]} {results[-1]}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    return results
+
+
+def write_results(results, columns, fpath):
+    '''Write benchmark results to csv
+
+    Inputs:
+        results (list)
+            Load results (see run_load)
+        columns (list)
+            Result fields to write
+        fpath (string)
+            Path to csv file
+    Outputs:
+        None
+    '''
+    with open(fpath, "w") as fp:
+        fp.write(",".join(columns) + "\n")
+        for result in results:
+            fp.write(",".join(str(result[c]) for c in columns) + "\n")
+    logger.info(f"benchmark.py: Benchmark written to {fpath}")
+
+
+def main():
+    '''Main functionality call
+
+    Usage
+        python benchmark.py
+            Benchmark gunicorn (serve.py) for each worker count
+        python benchmark.py async
+            Benchmark the micro-batching server (serve_async.py) at each
+            concurrency level
+
+    Inputs:
+        None
+    Outputs:
+        None
+    '''
+    # Read the configuration file
+    config = read_config(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "config.json"))
+    logger.info("benchmark.py: Configuration file read")
+
+    cores = multiprocessing.cpu_count()
+    port = config.get("benchmark_port", 8001)
+    n_requests = config.get("benchmark_requests", 2000)
+    out_path = os.path.join(os.getcwd(), config["output_model_path"])
+    # The core count is recorded as the results only compare on one host
+    columns = ["cores", "concurrency", "requests", "rps", "p50_ms",
+               "p95_ms", "p99_ms", "errors"]
+
+    # Many small requests at increasing concurrency against the batcher
+    if len(sys.argv) > 1 and sys.argv[1] == "async":
+        results = benchmark_server(
+            ["uvicorn", "serve_async:app", "--host", "127.0.0.1",
+             "--port", str(port), "--log-level", "warning"],
+            port, batch_payload(config.get("benchmark_async_batch_size", 1)),
+            n_requests,
+            config.get("benchmark_async_concurrency", [1, 8, 32, 128])
+        )
+        for result in results:
+            result["cores"] = cores
+        write_results(results, columns,
+                      os.path.join(out_path, "async_benchmark.csv"))
+        return
+
+    # Worker counts, by default doubling up to the core count
+    worker_counts = config.get("benchmark_workers") or sorted(
+        {min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    payload = batch_payload(config.get("benchmark_batch_size", 10))
+    concurrency = config.get("benchmark_concurrency", 2 * cores)
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for workers in worker_counts:
+            result, = benchmark_server(
+                ["gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers),
+                 "-b", f"127.0.0.1:{port}",
+                 "-p", os.path.join(scratch, "gunicorn.pid")],
+                port, payload, n_requests, [concurrency]
+            )
+            result["workers"] = workers
+            result["cores"] = cores
+            results.append(result)
+    write_results(results, ["workers"] + columns,
+                  os.path.join(out_path, "serving_benchmark.csv"))
+
+
+# Top level script entry point
+if __name__ == '__main__':
+    main()
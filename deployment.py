@@ -1,12 +1,30 @@
 '''
 Functionality to apply the model to new data
 
+Every deployed file is stored once, named by its sha256, in
+production_deployment/objects. A deployment is published as an immutable
+version directory named by a hash of its file names and contents
+(production_deployment/versions/<version>) whose files are hard links to
+the objects, so an unchanged file (e.g. the drift baseline) takes no
+extra space. The live version and its objects are recorded in the
+CURRENT.json manifest, which is switched with a single atomic rename, so
+a reader always sees one complete version. Rolling back only switches the
+manifest. A deployment made before versioning is published as the first
+version on the next deploy so it can be rolled back to. Only the last
+deployment_keep_versions versions are kept in the history, older versions
+and the objects no kept version uses are pruned after a deploy
+
 Author: Christopher Bonham
 Date: 16th February 2023
 '''
 import os
+import sys
+import json
+import time
+import hashlib
+import signal
 import logging
-from utils.io import read_config
+from utils.io import read_config, DEPLOYMENT_MANIFEST
 import shutil
 
 
@@ -15,11 +33,272 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def deploy_artifacts_to_prod(model_path, ingested_files_path, deploy_path):
-    '''Copy files to production
+# Files of a deployment, the last two are optional
+DEPLOYMENT_FILES = ["latestscore.txt", "ingestedfiles.txt", "trainedmodel.pkl",
+                    "drift_baseline.json", "trainedmodel.lrm"]
+
+# Object name of each file of a version, kept in its version directory
+VERSION_OBJECTS = "objects.json"
+
+
+def file_sha256(fpath):
+    '''Get the sha256 of a file
+
+    Inputs:
+        fpath (string)
+            Path to file
+    Outputs:
+        string
+            Hex digest
+    '''
+    sha = hashlib.sha256()
+    with open(fpath, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_manifest(deploy_path):
+    '''Read the deployment manifest
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+    Outputs:
+        dict
+            Manifest or None if nothing has been deployed as a version or
+            the manifest is corrupt (the next deploy replaces it)
+    '''
+    fpath = os.path.join(deploy_path, DEPLOYMENT_MANIFEST)
+    if not os.path.exists(fpath):
+        return None
+    try:
+        with open(fpath, "r") as fp:
+            manifest = json.load(fp)
+        if not isinstance(manifest.get("version"), str) or \
+                not isinstance(manifest.get("history"), list):
+            raise ValueError("missing version or history")
+    except (ValueError, AttributeError) as e:
+        logger.info(f"deployment.py: Manifest {fpath} is corrupt: {e}")
+        return None
+    return manifest
+
+
+def write_manifest(deploy_path, manifest):
+    '''Atomically write the deployment manifest, this is the pointer switch
+    that makes a version live
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        manifest (dict)
+            Manifest
+    Outputs:
+        None
+    '''
+    fpath = os.path.join(deploy_path, DEPLOYMENT_MANIFEST)
+    tmp = f"{fpath}.tmp{os.getpid()}"
+    with open(tmp, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp, fpath)
+
+
+def read_version_objects(deploy_path, version):
+    '''Read the object names of the files of a published version
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        version (string)
+            Version
+    Outputs:
+        dict
+            File name to object name, empty for versions published
+            before objects were stored
+    '''
+    fpath = os.path.join(deploy_path, "versions", version, VERSION_OBJECTS)
+    if not os.path.exists(fpath):
+        return {}
+    with open(fpath, "r") as fp:
+        return json.load(fp)
+
+
+def switch_version(deploy_path, version, history):
+    '''Make a version live
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        version (string)
+            Version to make live
+        history (list)
+            Previously live versions, most recent last
+    Outputs:
+        None
+    '''
+    write_manifest(deploy_path, {
+        "version": version,
+        "path": f"versions/{version}",
+        "files": {fname: f"objects/{sha}" for fname, sha in
+                  read_version_objects(deploy_path, version).items()},
+        "deployed_at": time.time(),
+        "history": history,
+    })
+    logger.info(f"deployment.py: Version {version} is live")
+
+
+def store_object(deploy_path, src):
+    '''Store a file in the object store unless an identical file already
+    is
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        src (string)
+            Path to file
+    Outputs:
+        string
+            Object name, the sha256 of the file
+    '''
+    sha = file_sha256(src)
+    obj_path = os.path.join(deploy_path, "objects", sha)
+    if not os.path.exists(obj_path):
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        tmp = f"{obj_path}.tmp{os.getpid()}"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, obj_path)
+    return sha
+
+
+def publish_version(deploy_path, files):
+    '''Publish files as a content addressed version
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        files (dict)
+            Deployed file name to path of the file to publish
+    Outputs:
+        string
+            Version
+    '''
+    # Store the files, the version is a hash of their names and contents
+    objects = {fname: store_object(deploy_path, src)
+               for fname, src in files.items()}
+    sha = hashlib.sha256()
+    for fname in sorted(objects):
+        sha.update(f"{fname}:{objects[fname]}\n".encode("utf-8"))
+    version = sha.hexdigest()[:16]
+
+    # Publish the version directory unless identical artifacts already are
+    # NB it is built under a temporary name and renamed into place
+    version_path = os.path.join(deploy_path, "versions", version)
+    if os.path.exists(version_path):
+        logger.info(f"deployment.py: Version {version} already published")
+        return version
+
+    tmp_path = os.path.join(deploy_path, "versions",
+                            f".tmp{os.getpid()}_{version}")
+    os.makedirs(tmp_path)
+    for fname, obj in objects.items():
+        obj_path = os.path.join(deploy_path, "objects", obj)
+        try:
+            os.link(obj_path, os.path.join(tmp_path, fname))
+        except OSError:
+            # File system without hard links
+            shutil.copyfile(obj_path, os.path.join(tmp_path, fname))
+    with open(os.path.join(tmp_path, VERSION_OBJECTS), "w") as fp:
+        json.dump(objects, fp, indent=2, sort_keys=True)
+    try:
+        os.replace(tmp_path, version_path)
+    except OSError:
+        # Published concurrently by another deploy
+        shutil.rmtree(tmp_path)
+        if not os.path.exists(version_path):
+            raise
+    logger.info(f"deployment.py: Version {version} published to "
+                f"{version_path}")
+
+    return version
+
+
+def register_legacy_deployment(deploy_path):
+    '''Publish a deployment made before versioning (files directly in
+    deploy_path) as a version so it can be rolled back to
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+    Outputs:
+        string
+            Version or None if there is no legacy deployment
+    '''
+    files = {fname: os.path.join(deploy_path, fname)
+             for fname in DEPLOYMENT_FILES
+             if os.path.exists(os.path.join(deploy_path, fname))}
+    if "trainedmodel.pkl" not in files:
+        return None
+    version = publish_version(deploy_path, files)
+    logger.info(f"deployment.py: Legacy deployment registered as version "
+                f"{version}")
+    return version
+
+
+def prune_versions(deploy_path, keep):
+    '''Drop all but the last keep versions from the history and delete
+    the pruned version directories and the objects no remaining version
+    uses
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        keep (int)
+            Number of previous versions kept for rollback
+    Outputs:
+        list
+            Pruned versions
+    '''
+    manifest = read_manifest(deploy_path)
+    if manifest is None:
+        return []
+
+    # Trim the history first so a rollback never targets a pruned version
+    history = manifest["history"][-keep:] if keep > 0 else []
+    if history != manifest["history"]:
+        manifest["history"] = history
+        write_manifest(deploy_path, manifest)
+    kept = set(history) | {manifest["version"]}
+
+    # NB temporary directories and objects belong to deploys in progress
+    versions_path = os.path.join(deploy_path, "versions")
+    pruned = sorted(v for v in os.listdir(versions_path)
+                    if v not in kept and not v.startswith(".tmp"))
+    for version in pruned:
+        shutil.rmtree(os.path.join(versions_path, version))
+
+    used = set()
+    for version in kept:
+        used.update(read_version_objects(deploy_path, version).values())
+    objects_path = os.path.join(deploy_path, "objects")
+    for obj in os.listdir(objects_path):
+        if obj not in used and ".tmp" not in obj:
+            os.remove(os.path.join(objects_path, obj))
+
+    if pruned:
+        logger.info(f"deployment.py: Pruned versions {pruned}")
+    return pruned
+
+
+def deploy_artifacts_to_prod(model_path, ingested_files_path, deploy_path,
+                             keep_versions=10):
+    '''Publish files to production as a content addressed version
     trainedmodel.pkl
     latestscore.txt
     ingestedfiles.txt
+    drift_baseline.json (if it exists)
+    trainedmodel.lrm (if it exists)
 
     Inputs:
         model_path (string)
@@ -28,36 +307,119 @@ def deploy_artifacts_to_prod(model_path, ingested_files_path, deploy_path):
             Path to model directory
         deploy_path (string)
             Path to deployment (prod) directory
+        keep_versions (int default = 10)
+            Number of previous versions kept for rollback, None keeps all
     Outputs:
-        None
+        string
+            Deployed version
     '''
     logger.info(f"deployment.py: Model path: {model_path}")
     logger.info(f"deployment.py: Ingested files path: {ingested_files_path}")
     logger.info(f"deployment.py: Deployment (prod) path: {deploy_path}")
 
-    # Create deployment directory if it doesnt exist
-    if not os.path.exists(deploy_path):
-        os.makedirs(deploy_path)
-
-    # Copy files to production
-    shutil.copyfile(
-        os.path.join(model_path, "latestscore.txt"),
-        os.path.join(deploy_path, "latestscore.txt"),
-    )
-    shutil.copyfile(
-        os.path.join(model_path, "trainedmodel.pkl"),
-        os.path.join(deploy_path, "trainedmodel.pkl"),
-    )
-    shutil.copyfile(
-        os.path.join(ingested_files_path, "ingestedfiles.txt"),
-        os.path.join(deploy_path, "ingestedfiles.txt"),
-    )
+    # Get the files to deploy
+    files = {
+        "latestscore.txt": os.path.join(model_path, "latestscore.txt"),
+        "ingestedfiles.txt": os.path.join(ingested_files_path,
+                                          "ingestedfiles.txt"),
+        "trainedmodel.pkl": os.path.join(model_path, "trainedmodel.pkl"),
+    }
+    for fname in ["drift_baseline.json", "trainedmodel.lrm"]:
+        if os.path.exists(os.path.join(model_path, fname)):
+            files[fname] = os.path.join(model_path, fname)
+
+    # The first versioned deploy keeps the legacy deployment as history
+    manifest = read_manifest(deploy_path)
+    if manifest is None:
+        legacy = register_legacy_deployment(deploy_path)
+        if legacy is not None:
+            manifest = {"version": legacy, "history": []}
+
+    # Publish and switch the live version
+    version = publish_version(deploy_path, files)
+    if manifest is not None and manifest["version"] == version:
+        logger.info(f"deployment.py: Version {version} is already live")
+    else:
+        history = [] if manifest is None \
+            else manifest["history"] + [manifest["version"]]
+        switch_version(deploy_path, version, history)
     logger.info("deployment.py: Model artifacts deployed to live")
 
+    if keep_versions is not None:
+        prune_versions(deploy_path, keep_versions)
+
+    return version
+
+
+def rollback(deploy_path, version=None):
+    '''Roll back to a previously published version
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        version (string default = None)
+            Version to make live, None rolls back to the previous version
+    Outputs:
+        string
+            Live version
+    '''
+    manifest = read_manifest(deploy_path)
+    if manifest is None:
+        raise ValueError("deployment.py: Nothing has been deployed")
+
+    history = list(manifest["history"])
+    if version is None:
+        if len(history) == 0:
+            raise ValueError("deployment.py: No previous version to roll "
+                             "back to")
+        version = history.pop()
+    else:
+        if not os.path.exists(os.path.join(deploy_path, "versions", version)):
+            raise ValueError(f"deployment.py: Unknown version {version}")
+        history.append(manifest["version"])
+
+    switch_version(deploy_path, version, history)
+    logger.info(f"deployment.py: Rolled back from {manifest['version']} "
+                f"to {version}")
+    return version
+
+
+def reload_serving(pidfile):
+    '''Gracefully recycle the workers of a running gunicorn server (see
+    gunicorn.conf.py) by sending its master SIGHUP. The new workers load
+    the live version, the old ones finish their requests first
+
+    Inputs:
+        pidfile (string)
+            Path to the gunicorn master pid file
+    Outputs:
+        boolean
+            True if the server was signalled
+    '''
+    if not os.path.exists(pidfile) or not hasattr(signal, "SIGHUP"):
+        logger.info("deployment.py: No serving process to reload")
+        return False
+
+    with open(pidfile, "r") as fp:
+        pid = int(fp.read().strip())
+    try:
+        os.kill(pid, signal.SIGHUP)
+    except ProcessLookupError:
+        logger.info(f"deployment.py: Stale serving pid file {pidfile}")
+        return False
+    logger.info(f"deployment.py: Serving workers of {pid} recycled")
+    return True
+
 
 def main():
     '''Main functionality call
 
+    Usage
+        python deployment.py
+            Deploy the model artifacts
+        python deployment.py rollback [version]
+            Roll back to the previous (or a given) version
+
     Inputs:
         None
     Outputs:
@@ -66,13 +428,26 @@ def main():
     # Read the configuration file
     config = read_config(r".\config.json")
     logger.info("deployment.py: Configuration file read")
+    deploy_path = os.path.join(os.getcwd(), config["prod_deployment_path"])
+
+    # Roll back
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        rollback(deploy_path, sys.argv[2] if len(sys.argv) > 2 else None)
 
     # Copy relevant files to production
-    deploy_artifacts_to_prod(
-        os.path.join(os.getcwd(), config["output_model_path"]),
-        os.path.join(os.getcwd(), config["output_folder_path"]),
-        os.path.join(os.getcwd(), config["prod_deployment_path"])
-    )
+    else:
+        deploy_artifacts_to_prod(
+            os.path.join(os.getcwd(), config["output_model_path"]),
+            os.path.join(os.getcwd(), config["output_folder_path"]),
+            deploy_path,
+            config.get("deployment_keep_versions", 10)
+        )
+
+    # Recycle the serving workers onto the live version
+    if config.get("serve_reload_on_deploy", False):
+        reload_serving(os.path.join(os.getcwd(),
+                                    config.get("serve_pidfile",
+                                               "gunicorn.pid")))
 
 
 # Top level script entry point
@@ -4,12 +4,25 @@ Functionality to execute data diagnostics
 Author: Christopher Bonham
 Date: 16th February 2023
 '''
-import pandas as pd
 import os
+import re
+import sys
+import json
+import time
 import timeit
 import logging
 import subprocess
-from utils.io import read_config, load_model, apply_model
+import importlib.metadata
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils.io import read_config, load_model, apply_model, read_data, \
+                     resolve_data_file, file_fingerprint, iter_data, \
+                     resolve_deployment, \
+                     FEATURES, LABEL
+from utils.stats import SummaryAccumulator
 
 
 # Create a logger
@@ -17,7 +30,7 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def model_predictions(df, config):
+def model_predictions(df, config, lr=None):
     '''Get predictions using the deployed production model
 
     Inputs:
@@ -25,14 +38,17 @@ def model_predictions(df, config):
             Data to score
         config (Dict)
             Configuration
+        lr (sklearn.linear_model._logistic.LogisticRegression default = None)
+            Resident production model, None loads it from disk
     Outputs:
         list
             Model scores
     '''
     # Load deployed model
-    lr = load_model(
-        os.path.join(os.getcwd(), config["prod_deployment_path"])
-    )
+    if lr is None:
+        lr = load_model(resolve_deployment(
+            os.path.join(os.getcwd(), config["prod_deployment_path"])
+        ))
 
     # Get predictions (this must be a list)
     preds = list(apply_model(df, lr))
@@ -40,11 +56,15 @@ def model_predictions(df, config):
     return preds
 
 
-def load_training_data(in_path):
+def load_training_data(in_path, data_format="csv", columns=None):
     '''Load training data to dataframe
     Inputs:
         in_path (string)
             Path to training data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        columns (list default = None)
+            Columns to load, None loads all of them
 
     Outputs:
         pandas.dataframe
@@ -53,36 +73,127 @@ def load_training_data(in_path):
     logger.info(f"diagnostics.py: Input folder path: {in_path}")
 
     # Load training data
-    df = pd.read_csv(os.path.join(in_path, "finaldata.csv"))
+    df = read_data(in_path, "finaldata", data_format, columns)
     logger.info(f"diagnostics.py: Training data shape: {df.shape}")
 
     return df
 
 
 def dataframe_summary(df):
-    '''Get summary stats (mean, media, stddev for numeric fields in dataframe
+    '''Get summary stats (mean, median, stddev) for numeric fields in
+    dataframe, computed in one vectorized call over all numeric fields
 
     Inputs:
         df (Pandas.datafrane)
             Dataframe to get statistics
     Outputs:
-        list
+        dict
             Dataframe statistics
-            Format is [mean, median, standard deviation] repeated for
+            Format is {field: {"mean": .., "median": .., "std": ..}} for
             every numeric field
     '''
-    # Get a list of all the numeric columns in the dataframe
-    numeric_vnames = list(df.select_dtypes(include='number').columns.values)
-    logger.info(f"diagnostics.py: Numeric fields are: {numeric_vnames}")
+    # Get all the numeric columns in the dataframe
+    numeric = df.select_dtypes(include='number')
+    logger.info(f"diagnostics.py: Numeric fields are: "
+                f"{list(numeric.columns.values)}")
+
+    # Get summary statistics
+    stats = numeric.agg(["mean", "median", "std"])
+    return {var: {stat: float(value) for stat, value in stats[var].items()}
+            for var in stats.columns}
+
+
+def streaming_summary(chunks, compression=100):
+    '''Get mergeable summary stats of data read chunk by chunk
+
+    Inputs:
+        chunks (iterable of pandas.DataFrame)
+            Data chunks
+        compression (int default = 100)
+            Compression of the quantile sketches
+    Outputs:
+        utils.stats.SummaryAccumulator
+            Summary stats accumulator
+    '''
+    acc = SummaryAccumulator(compression)
+    for chunk in chunks:
+        acc.update(chunk)
+    logger.info(f"diagnostics.py: Streaming summary rows: {acc.rows}")
+    return acc
+
+
+def summary_accumulator(in_path, data_format="csv", chunksize=100000):
+    '''Get the persisted summary stats accumulator of the ingested data,
+    building it chunk by chunk if ingestion has not written it
+
+    Inputs:
+        in_path (string)
+            Path to ingested data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        chunksize (int default = 100000)
+            Rows per chunk when building the accumulator
+    Outputs:
+        utils.stats.SummaryAccumulator
+            Summary stats accumulator
+    '''
+    fpath = os.path.join(in_path, "finaldata_stats.json")
+    if os.path.exists(fpath):
+        return SummaryAccumulator.load(fpath)
+
+    acc = streaming_summary(
+        iter_data(in_path, "finaldata", data_format, chunksize)
+    )
+    acc.save(fpath)
+    return acc
 
-    # Get summary statistics list
-    summary_stats = []
-    for var in numeric_vnames:
-        summary_stats.append(df[var].mean())
-        summary_stats.append(df[var].median())
-        summary_stats.append(df[var].std())
 
-    return summary_stats
+# Memoized summary statistics keyed on the data file path
+_summary_cache = {}
+
+
+def summary_stats(in_path, data_format="csv", hash_contents=False,
+                  streaming=False):
+    '''Get the summary stats of the ingested data, memoized against a
+    fingerprint of the ingested data file so they are only recomputed
+    after new data has been ingested
+
+    In streaming mode the stats come from the mergeable accumulator kept
+    up to date by ingestion (median is approximate) and the data itself
+    is never loaded
+
+    Inputs:
+        in_path (string)
+            Path to ingested data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        hash_contents (boolean default = False)
+            Include a hash of the file contents in the fingerprint
+        streaming (boolean default = False)
+            Use the streaming summary stats accumulator
+    Outputs:
+        dict
+            Dataframe statistics (see dataframe_summary)
+    '''
+    if streaming:
+        fpath = os.path.join(in_path, "finaldata_stats.json")
+        if not os.path.exists(fpath):
+            summary_accumulator(in_path, data_format)
+    else:
+        fpath, data_format = resolve_data_file(in_path, "finaldata",
+                                               data_format)
+    fingerprint = file_fingerprint(fpath, hash_contents)
+
+    cached = _summary_cache.get(fpath)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    if streaming:
+        stats = SummaryAccumulator.load(fpath).summary()
+    else:
+        stats = dataframe_summary(load_training_data(in_path, data_format))
+    _summary_cache[fpath] = (fingerprint, stats)
+    return stats
 
 
 def missing_data(df):
@@ -99,49 +210,447 @@ def missing_data(df):
     return list(df.isnull().sum() / df.shape[0])
 
 
-def execution_time():
-    '''Time the ingestion.py and training.py modules
+def profile_stage(fn, repeats=5, warmup=1):
+    '''Time repeated calls of a pipeline stage
+
+    The timed repetitions run without memory tracing, the peak memory is
+    taken from one extra traced call
 
     Inputs:
-        None
+        fn (callable)
+            Stage to profile, called with no arguments
+        repeats (int default = 5)
+            Number of timed calls, at least 1
+        warmup (int default = 1)
+            Number of untimed calls made first
     Outputs:
-        list
-            Training times in seconds
+        dict
+            min, median and p95 wall time in seconds and peak memory in MB
+    '''
+    if repeats < 1:
+        raise ValueError(f"repeats must be at least 1, got {repeats}")
+
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(repeats):
+        starttime = timeit.default_timer()
+        fn()
+        timings.append(timeit.default_timer() - starttime)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "min": float(np.min(timings)),
+        "median": float(np.median(timings)),
+        "p95": float(np.percentile(timings, 95)),
+        "peak_mem_mb": peak / 1024 ** 2,
+    }
+
+
+def _profile_pipeline(config, repeats, warmup):
+    '''Profile the ingestion and training stages against a scratch output
+    directory, see profile_pipeline
+
+    Inputs:
+        config (Dict)
+            Configuration
+        repeats (int)
+            Number of timed calls per stage
+        warmup (int)
+            Number of untimed calls per stage made first
+    Outputs:
+        dict
+            Stage name to profile (see profile_stage)
+    '''
+    # NB imported here as they pull in sklearn
+    import ingestion
+    import training
+
+    in_path = os.path.join(os.getcwd(), config["input_folder_path"])
+    data_format = config.get("data_format", "csv")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        ingested_path = os.path.join(scratch, "ingesteddata")
+        model_path = os.path.join(scratch, "models")
+
+        def run_ingestion():
+            ingestion.ingest_data(
+                in_path, ingested_path,
+                workers=config.get("ingestion_workers", 1),
+                executor=config.get("ingestion_executor", "thread"),
+                data_format=data_format,
+            )
+
+        def run_training():
+            df = training.load_training_data(ingested_path, data_format,
+                                             FEATURES + [LABEL])
+            training.train_model(df, model_path)
+
+        # Ingestion runs first as training reads its scratch output
+        profile = {
+            "ingestion": profile_stage(run_ingestion, repeats, warmup),
+            "training": profile_stage(run_training, repeats, warmup),
+        }
+
+    return profile
+
+
+def profile_pipeline(config, repeats=5, warmup=1):
+    '''Profile the ingestion and training stages against a scratch output
+    directory so production outputs are not touched
+
+    The stages run in a freshly spawned process, so the memory tracing,
+    the imports and the stage memory do not affect the calling process
+    (e.g. the app serving requests while a diagnostics job runs)
+
+    Inputs:
+        config (Dict)
+            Configuration
+        repeats (int default = 5)
+            Number of timed calls per stage, at least 1
+        warmup (int default = 1)
+            Number of untimed calls per stage made first
+    Outputs:
+        dict
+            Stage name to profile (see profile_stage)
+    '''
+    if repeats < 1:
+        raise ValueError(f"repeats must be at least 1, got {repeats}")
+
+    # NB spawned rather than forked as the caller may be multi-threaded
+    with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn")) as ex:
+        profile = ex.submit(_profile_pipeline, config, repeats,
+                            warmup).result()
+
+    for stage, stats in profile.items():
+        logger.info(f"diagnostics.py: {stage} profile: {stats}")
+
+    return profile
+
+
+def execution_time(config, repeats=1, warmup=0):
+    '''Profile the ingestion and training stages
+
+    Inputs:
+        config (Dict)
+            Configuration
+        repeats (int default = 1)
+            Number of timed calls per stage
+        warmup (int default = 0)
+            Number of untimed calls per stage made first
+    Outputs:
+        dict
+            Stage name to min, median and p95 wall time in seconds and
+            peak memory in MB (see profile_stage)
+    '''
+    return profile_pipeline(config, repeats, warmup)
+
+
+def format_profile(stats):
+    '''Format the profile of a stage for display
+
+    Inputs:
+        stats (dict)
+            Stage profile (see profile_stage)
+    Outputs:
+        string
+            Wall time min, median and p95 and peak memory
+    '''
+    return f"min {stats['min']:.3f}s, median {stats['median']:.3f}s, " \
+           f"p95 {stats['p95']:.3f}s, peak memory " \
+           f"{stats['peak_mem_mb']:.1f}MB"
+
+
+def import_time(module, repeats=3):
+    '''Time importing a module in a fresh interpreter with
+    python -X importtime
+
+    Inputs:
+        module (string)
+            Module name e.g. fullprocess
+        repeats (int default = 3)
+            Number of imports, the fastest is returned
+    Outputs:
+        float
+            Cumulative import time in seconds
     '''
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, check=True
+        )
+
+        # Lines are "import time: self [us] | cumulative | name"
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                timings.append(int(fields[1]) / 1e6)
+    return min(timings)
 
-    # Time the ingestion.py script
-    starttime = timeit.default_timer()
-    os.system("python ingestion.py")
-    runtime_ingestion = timeit.default_timer() - starttime
 
-    # Time the training.py script
-    starttime = timeit.default_timer()
-    os.system("python training.py")
-    runtime_training = timeit.default_timer() - starttime
+def check_import_budget(budgets, repeats=3):
+    '''Check the cold start import time of modules against a budget
 
-    return [runtime_ingestion, runtime_training]
+    Inputs:
+        budgets (dict)
+            Module name to maximum import time in seconds
+        repeats (int default = 3)
+            Number of imports of each module, the fastest is used
+    Outputs:
+        dict
+            Module name to {"seconds": .., "budget": .., "ok": ..}
+    '''
+    report = {}
+    for module, budget in budgets.items():
+        seconds = import_time(module, repeats)
+        report[module] = {"seconds": seconds, "budget": budget,
+                          "ok": seconds <= budget}
+        logger.info(f"diagnostics.py: Import time of {module} "
+                    f"{report[module]}")
+    return report
+
+
+def normalise_package_name(name):
+    '''Normalise a distribution name (PEP 503) so names from different
+    sources can be compared
+
+    Inputs:
+        name (string)
+            Distribution name
+    Outputs:
+        string
+            Normalised name
+    '''
+    return re.sub(r"[-_.]+", "-", name).lower()
 
 
-def outdated_packages_list():
-    '''Get a list of all outdated packages
+def installed_packages():
+    '''Get the installed distributions from their metadata
 
     Inputs:
         None
+    Outputs:
+        dict
+            Distribution name to installed version
+    '''
+    return {
+        dist.metadata["Name"]: dist.version
+        for dist in importlib.metadata.distributions()
+        if dist.metadata["Name"]
+    }
+
+
+def fetch_index_snapshot(timeout=60):
+    '''Build an index snapshot from pip (needs network access)
+
+    Inputs:
+        timeout (int default = 60)
+            Seconds pip is given before it is killed
+    Outputs:
+        dict
+            Normalised distribution name to latest version, None if pip
+            failed or timed out (e.g. the index is unreachable)
+    '''
+    try:
+        response = subprocess.run(
+            [sys.executable, "-m", "pip", "list", "--outdated",
+             "--format=json"],
+            capture_output=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        logger.info(f"diagnostics.py: pip list --outdated timed out after "
+                    f"{timeout} seconds")
+        return None
+    if response.returncode != 0:
+        logger.info(f"diagnostics.py: pip list --outdated failed with status "
+                    f"{response.returncode}: "
+                    f"{response.stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    try:
+        latest = {normalise_package_name(p["name"]): p["latest_version"]
+                  for p in json.loads(response.stdout.decode("utf-8"))}
+    except (ValueError, KeyError, TypeError):
+        logger.info("diagnostics.py: pip list --outdated returned invalid "
+                    "JSON")
+        return None
+
+    # Packages pip does not report are up to date
+    snapshot = {normalise_package_name(name): version
+                for name, version in installed_packages().items()}
+    snapshot.update(latest)
+    return snapshot
+
+
+def load_index_snapshot(snapshot_path=None, allow_online=False,
+                        max_age=86400, timeout=60):
+    '''Load the package index snapshot, a JSON file mapping distribution
+    names to their latest versions. If it does not exist or is older than
+    max_age (and network access is allowed) it is rebuilt from pip and
+    cached to snapshot_path. A failed rebuild is never cached, the stale
+    snapshot is used if there is one
+
+    Inputs:
+        snapshot_path (string default = None)
+            Path to index snapshot, None always builds it from pip
+        allow_online (boolean default = False)
+            Build the snapshot from pip if it does not exist or is stale
+        max_age (int default = 86400)
+            Seconds after which the snapshot is rebuilt
+        timeout (int default = 60)
+            Seconds pip is given to build the snapshot
+    Outputs:
+        dict
+            Normalised distribution name to latest version, None if no
+            snapshot is available
+    '''
+    cached = None
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        with open(snapshot_path, "r") as fp:
+            cached = {normalise_package_name(name): version
+                      for name, version in json.load(fp).items()}
+        age = time.time() - os.path.getmtime(snapshot_path)
+        if age < max_age or not allow_online:
+            return cached
+        logger.info(f"diagnostics.py: Package index snapshot is "
+                    f"{age / 3600:.1f} hours old, rebuilding")
+
+    if not allow_online:
+        logger.info("diagnostics.py: No package index snapshot available")
+        return None
+
+    snapshot = fetch_index_snapshot(timeout)
+    if snapshot is None:
+        if cached is not None:
+            logger.info("diagnostics.py: Using the stale package index "
+                        "snapshot")
+        return cached
+
+    if snapshot_path is not None:
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(snapshot, fp, indent=2, sort_keys=True)
+        os.replace(tmp_path, snapshot_path)
+        logger.info(f"diagnostics.py: Package index snapshot written to "
+                    f"{snapshot_path}")
+    return snapshot
+
+
+def is_newer(latest, installed):
+    '''Check if a version is newer than the installed version
+
+    Inputs:
+        latest (string)
+            Latest version
+        installed (string)
+            Installed version
+    Outputs:
+        boolean
+            True if latest is newer
+    '''
+    try:
+        from packaging.version import Version, InvalidVersion
+        try:
+            return Version(latest) > Version(installed)
+        except InvalidVersion:
+            pass
+    except ImportError:
+        pass
+    return latest != installed
+
+
+# Memoized outdated package tables keyed on the snapshot path
+_outdated_cache = {}
+
+
+def outdated_packages_list(snapshot_path=None, ttl=3600, allow_online=False,
+                           max_age=86400, timeout=60):
+    '''Get a list of all outdated packages by comparing the installed
+    distributions against a package index snapshot. Results, including
+    a missing snapshot, are memoized for ttl seconds so an offline host
+    does not retry pip on every call
+
+    Inputs:
+        snapshot_path (string default = None)
+            Path to index snapshot, None always builds it from pip
+        ttl (int default = 3600)
+            Seconds a result is reused for
+        allow_online (boolean default = False)
+            Build the snapshot from pip if it does not exist or is stale
+        max_age (int default = 86400)
+            Seconds after which the snapshot is rebuilt
+        timeout (int default = 60)
+            Seconds pip is given to build the snapshot
     Outputs:
         str
             Outdated packages
     '''
-    response = subprocess.run(["python", "-m", "pip", "list", "--outdated"],
-                              capture_output=True).stdout
+    cached = _outdated_cache.get(snapshot_path)
+    if cached is not None and time.time() - cached[0] < ttl:
+        return cached[1]
+
+    # Without a snapshot no package can be reported as current
+    snapshot = load_index_snapshot(snapshot_path, allow_online, max_age,
+                                   timeout)
+    if snapshot is None:
+        response = "Package index snapshot unavailable\n"
+        _outdated_cache[snapshot_path] = (time.time(), response)
+        return response
+
+    # Compare the installed versions against the snapshot
+    rows = []
+    for name, version in sorted(installed_packages().items(),
+                                key=lambda x: x[0].lower()):
+        latest = snapshot.get(normalise_package_name(name))
+        if latest is not None and is_newer(latest, version):
+            rows.append((name, version, latest))
+
+    # Format as a table in the style of pip list --outdated
+    header = ("Package", "Version", "Latest")
+    widths = [max(len(r[i]) for r in rows + [header]) for i in range(3)]
+    lines = [" ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+             for r in [header, tuple("-" * w for w in widths)] + rows]
+    response = "\n".join(lines) + "\n"
+    logger.info(f"diagnostics.py: Outdated dependencies are:\n{response}")
+
+    _outdated_cache[snapshot_path] = (time.time(), response)
+    return response
+
+
+def index_snapshot_path(config):
+    '''Get the path to the package index snapshot from the configuration
 
-    response = response.decode("utf-8")
-    return(response)
-    logger.info(f"diagnostics.py: Outdated dependencies are:\n{response_decoded}")
+    Inputs:
+        config (Dict)
+            Configuration
+    Outputs:
+        string
+            Path to index snapshot or None if not configured
+    '''
+    if not config.get("package_index_snapshot"):
+        return None
+    return os.path.join(os.getcwd(), config["package_index_snapshot"])
 
 
 def main():
     '''Main functionality call
 
+    Usage
+        python diagnostics.py
+            Run the diagnostics
+        python diagnostics.py importtime
+            Check the module import times against import_time_budget,
+            exits with status 1 if any is over budget
+
     Inputs:
         None
     Outputs:
@@ -151,28 +660,46 @@ def main():
     config = read_config(r".\config.json")
     logger.info("diagnostics.py: Configuration file read")
 
+    # Check the cold start import times
+    if len(sys.argv) > 1 and sys.argv[1] == "importtime":
+        report = check_import_budget(config.get("import_time_budget", {}))
+        if not all(module["ok"] for module in report.values()):
+            logger.info("diagnostics.py: Import time budget exceeded")
+            sys.exit(1)
+        return
+
     # Load training data
     df = load_training_data(
-        os.path.join(os.getcwd(), config["output_folder_path"])
+        os.path.join(os.getcwd(), config["output_folder_path"]),
+        config.get("data_format", "csv")
     )
 
     # Get summary statistics
-    summary_stats = dataframe_summary(df)
-    logger.info(f"diagnostics.py: Summary statistics [mean, medias, sd] are"
-                f" {summary_stats}")
+    summary = dataframe_summary(df)
+    logger.info(f"diagnostics.py: Summary statistics [mean, median, sd] are"
+                f" {summary}")
 
     # Get missing values
     missing_values = missing_data(df)
     logger.info(f"diagnostics.py: Missing value percentages are:"
                 f" {missing_values}")
 
-    # Time the ingestion.py and training.py modules
-    timings = execution_time()
-    logger.info(f"diagnostics.py: Runtime for ingestion and training "
-                f"modules are: {timings}")
+    # Profile the ingestion and training stages
+    timings = execution_time(config,
+                             config.get("profile_repeats", 1),
+                             config.get("profile_warmup", 0))
+    for stage, stats in timings.items():
+        logger.info(f"diagnostics.py: Runtime of {stage}: "
+                    f"{format_profile(stats)}")
 
     # Get a table of all outdated packages
-    outdated_packages = outdated_packages_list()
+    outdated_packages = outdated_packages_list(
+        index_snapshot_path(config),
+        config.get("outdated_packages_ttl", 3600),
+        config.get("package_index_online", False),
+        config.get("package_index_max_age", 86400),
+        config.get("package_index_timeout", 60)
+    )
 
 
 # Top level script entry point
@@ -0,0 +1,174 @@
+'''
+Functionality to monitor feature drift against the training baseline
+
+At training time the binned distribution of every feature is stored next
+to the model. New data is compared against it with the population
+stability index (PSI) and the Kolmogorov-Smirnov (KS) statistic, computed
+from the binned counts, so drift can be flagged before labels exist
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+import json
+import logging
+import numpy as np
+from utils.io import FEATURES
+
+
+# Create a logger
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def build_baseline(df, features=FEATURES, n_bins=10):
+    '''Get the binned baseline distribution of the features
+    Bin edges are the feature deciles (by default) of the training data,
+    the outer bins are open ended
+
+    Inputs:
+        df (pandas.DataFrame)
+            Training data
+        features (list default = FEATURES)
+            Features to bin
+        n_bins (int default = 10)
+            Maximum number of bins per feature
+    Outputs:
+        dict
+            Baseline, {"rows": .., "features": {name: {"edges": ..,
+            "counts": ..}}}
+    '''
+    baseline = {"format_version": 1, "rows": len(df), "features": {}}
+    for var in features:
+        x = df[var].to_numpy(dtype=float)
+        x = x[~np.isnan(x)]
+
+        # Interior edges at the quantiles, duplicates dropped
+        edges = np.unique(np.quantile(x, np.linspace(0, 1, n_bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, x, side="right"),
+                             minlength=len(edges) + 1)
+        baseline["features"][var] = {"edges": edges.tolist(),
+                                     "counts": counts.tolist()}
+    return baseline
+
+
+def update_baseline(baseline, df):
+    '''Add new training rows to the baseline counts, the bin edges are
+    kept so the baseline can be built up chunk by chunk
+
+    Inputs:
+        baseline (dict)
+            Baseline (see build_baseline)
+        df (pandas.DataFrame)
+            New training data
+    Outputs:
+        dict
+            Updated baseline
+    '''
+    baseline["rows"] += len(df)
+    for var, spec in baseline["features"].items():
+        x = df[var].to_numpy(dtype=float)
+        x = x[~np.isnan(x)]
+        counts = np.bincount(np.searchsorted(spec["edges"], x, side="right"),
+                             minlength=len(spec["counts"]))
+        spec["counts"] = (np.asarray(spec["counts"]) + counts).tolist()
+    return baseline
+
+
+def write_baseline(baseline, out_path):
+    '''Write the baseline to drift_baseline.json
+
+    Inputs:
+        baseline (dict)
+            Baseline (see build_baseline)
+        out_path (string)
+            Path to model directory
+    Outputs:
+        None
+    '''
+    with open(os.path.join(out_path, "drift_baseline.json"), "w") as fp:
+        json.dump(baseline, fp, indent=2)
+    logger.info(f"drift.py: Drift baseline written to "
+                f"{os.path.join(out_path, 'drift_baseline.json')}")
+
+
+def load_baseline(in_path):
+    '''Load the baseline from drift_baseline.json
+
+    Inputs:
+        in_path (string)
+            Path to model directory
+    Outputs:
+        dict
+            Baseline or None if it does not exist
+    '''
+    fpath = os.path.join(in_path, "drift_baseline.json")
+    if not os.path.exists(fpath):
+        return None
+    with open(fpath, "r") as fp:
+        return json.load(fp)
+
+
+def compute_drift(df, baseline, eps=1e-4):
+    '''Get the PSI and KS statistic of every baseline feature
+    All features are binned in one pass with a single bincount over the
+    concatenated bins of every feature
+
+    Inputs:
+        df (pandas.DataFrame)
+            New data
+        baseline (dict)
+            Baseline (see build_baseline)
+        eps (float default = 1e-4)
+            Floor applied to bin proportions in the PSI
+    Outputs:
+        dict
+            {feature: {"psi": .., "ks": ..}}
+    '''
+    features = list(baseline["features"])
+    specs = [baseline["features"][var] for var in features]
+    sizes = np.array([len(spec["counts"]) for spec in specs])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    # Global bin index of every value, missing values are dropped
+    X = df[features].to_numpy(dtype=float)
+    idx = np.column_stack([
+        np.searchsorted(spec["edges"], X[:, j], side="right") + offsets[j]
+        for j, spec in enumerate(specs)
+    ]) if len(X) else np.empty((0, len(specs)), dtype=np.int64)
+    actual = np.bincount(idx[~np.isnan(X)], minlength=sizes.sum())
+
+    drift = {}
+    for j, var in enumerate(features):
+        a = actual[offsets[j]:offsets[j] + sizes[j]].astype(float)
+        e = np.asarray(specs[j]["counts"], dtype=float)
+        if a.sum() == 0:
+            drift[var] = {"psi": float("nan"), "ks": float("nan")}
+            continue
+        a, e = a / a.sum(), e / e.sum()
+
+        # PSI on floored proportions, KS from the binned CDFs
+        af, ef = np.maximum(a, eps), np.maximum(e, eps)
+        psi = np.sum((af - ef) * np.log(af / ef))
+        ks = np.max(np.abs(np.cumsum(a) - np.cumsum(e)))
+        drift[var] = {"psi": float(psi), "ks": float(ks)}
+
+    return drift
+
+
+def is_drifted(drift, psi_threshold=0.2, ks_threshold=0.2):
+    '''Check if any feature has drifted
+
+    Inputs:
+        drift (dict)
+            Drift statistics (see compute_drift)
+        psi_threshold (float default = 0.2)
+            PSI above which a feature has drifted
+        ks_threshold (float default = 0.2)
+            KS statistic above which a feature has drifted
+    Outputs:
+        list
+            Names of the drifted features
+    '''
+    return [var for var, stats in drift.items()
+            if stats["psi"] > psi_threshold or stats["ks"] > ks_threshold]
@@ -7,103 +7,424 @@ Date: 18th February 2023
 import logging
 import ast
 import os
-import pandas as pd
-import ingestion
-from scoring import get_f1_score
-import training
-import deployment
-import reporting
-from utils.io import read_config, load_model
+import sys
+import threading
+from utils.io import read_config, load_model, read_data, apply_model, \
+                     resolve_deployment, resolve_data_file, data_file, \
+                     DEPLOYMENT_MANIFEST, FEATURES, LABEL
+from utils.cache import ArtifactCache
+from utils.dag import Stage, run_dag
 
 
+# NB the pipeline stage modules (ingestion, training etc.) are imported
+# in the stages that use them so the common "no new files" cycle does not
+# pay for importing pandas, sklearn and matplotlib
+
 # Create a logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def main():
-    '''Main functionality call
+def check_feature_drift(config, in_path, new_files):
+    '''Check each new file for feature drift against the baseline of the
+    deployed model
 
     Inputs:
-        None
+        config (Dict)
+            Configuration
+        in_path (string)
+            Path to the input folder
+        new_files (list)
+            Names of the new files
     Outputs:
-        None
+        list
+            Names of the files with drifted features
     '''
-    # Read the configuration file
-    config = read_config(r".\config.json")
-    logger.info("fullprocess.py: Configuration file read")
+    import drift
+    import ingestion
 
-    # Get the names of the previously ingested files from production
-    fpath = os.path.join(os.getcwd(),
-                         config["prod_deployment_path"],
-                         "ingestedfiles.txt")
-    with open(fpath, 'r') as fp:
-        prev_files = ast.literal_eval(fp.read())
-    logger.info(f"fullprocess.py: Previously ingested files were {prev_files}")
+    baseline = drift.load_baseline(resolve_deployment(
+        os.path.join(os.getcwd(), config["prod_deployment_path"])
+    ))
+    if baseline is None:
+        logger.info("fullprocess.py: No drift baseline deployed")
+        return []
 
-    # Get a list of files in the input folder
-    path = os.path.join(os.getcwd(), config["input_folder_path"])
-    input_files = os.listdir(path)
-    logger.info(f"fullprocess.py: Input files to ingest are {input_files}")
+    drifted_files = []
+    for fname in new_files:
+        df = ingestion.read_source_file(os.path.join(in_path, fname))
+        stats = drift.compute_drift(df, baseline)
+        drifted = drift.is_drifted(stats,
+                                   config.get("psi_threshold", 0.2),
+                                   config.get("ks_threshold", 0.2))
+        logger.info(f"fullprocess.py: Feature drift of {fname} {stats}")
+        if drifted:
+            logger.info(f"fullprocess.py: Features drifted in {fname}: "
+                        f"{drifted}")
+            drifted_files.append(fname)
 
-    # Get a list of new files
-    new_files = list(set(input_files) - set(prev_files))
-    logger.info(f"fullprocess.py: New files to ingest are {new_files}")
+    return drifted_files
 
-    # Run only if there are new files to export
-    if (len(new_files) > 0):
-        logger.info("fullprocess.py: There are new files to ingest")
 
-        # Ingest new data
-        ingestion.main()
+def build_pipeline(config, prod_model=None):
+    '''Build the pipeline stages
 
-        # Read in F1 score from deployed model
-        fpath = os.path.join(os.getcwd(),
-                             config["prod_deployment_path"],
-                             "latestscore.txt")
+    detect -> feature_drift, ingest -> score_live -> retrain
+    retrain -> deploy, test_data -> score_test -> report
+
+    The ingested data, scores and retrained model are passed between the
+    stages in memory
+
+    Inputs:
+        config (Dict)
+            Configuration
+        prod_model (utils.cache.ArtifactCache default = None)
+            Resident production model, None loads it from disk
+    Outputs:
+        list
+            Pipeline stages (utils.dag.Stage)
+    '''
+    in_path = os.path.join(os.getcwd(), config["input_folder_path"])
+    data_path = os.path.join(os.getcwd(), config["output_folder_path"])
+    model_path = os.path.join(os.getcwd(), config["output_model_path"])
+    test_path = os.path.join(os.getcwd(), config["test_data_path"])
+    prod_path = os.path.join(os.getcwd(), config["prod_deployment_path"])
+    data_format = config.get("data_format", "csv")
+
+    def detect():
+        # Get the names of the previously ingested files from production
+        fpath = os.path.join(resolve_deployment(prod_path),
+                             "ingestedfiles.txt")
         with open(fpath, 'r') as fp:
+            prev_files = ast.literal_eval(fp.read())
+        logger.info(f"fullprocess.py: Previously ingested files were "
+                    f"{prev_files}")
+
+        # Get a list of new files in the input folder
+        input_files = os.listdir(in_path)
+        logger.info(f"fullprocess.py: Input files to ingest are "
+                    f"{input_files}")
+        new_files = sorted(set(input_files) - set(prev_files))
+        logger.info(f"fullprocess.py: New files to ingest are {new_files}")
+        return new_files
+
+    def new_file_paths(new_files):
+        # The new files key the drift and ingest stages, only their stats
+        # are read
+        return [os.path.join(in_path, fname) for fname in new_files]
+
+    def feature_drift(new_files):
+        # Check the new files for feature drift against the live baseline
+        return check_feature_drift(config, in_path, new_files)
+
+    def load_ingested():
+        return read_data(data_path, "finaldata", data_format,
+                         FEATURES + [LABEL])
+
+    def ingest(new_files):
+        import pandas as pd
+        import ingestion
+
+        # Ingest new data, only reading new files in incremental mode
+        kwargs = {
+            "workers": config.get("ingestion_workers", 1),
+            "executor": config.get("ingestion_executor", "thread"),
+            "data_format": data_format,
+            "export_csv": config.get("export_csv", False),
+        }
+        if config.get("ingestion_mode", "full") != "incremental":
+            df = ingestion.ingest_data(in_path, data_path, **kwargs)
+            return df[FEATURES + [LABEL]].reset_index(drop=True)
+
+        # The new rows are kept in memory, only the previously ingested
+        # rows are read from disk
+        history = load_ingested() if os.path.exists(
+            data_file(data_path, "finaldata", data_format)) else None
+        df = ingestion.ingest_data_incremental(in_path, data_path, **kwargs)
+        return pd.concat([history, df[FEATURES + [LABEL]]],
+                         ignore_index=True)
+
+    def score_live(df):
+        from scoring import get_f1_score
+
+        # Read in F1 score from deployed model
+        live_path = resolve_deployment(prod_path)
+        with open(os.path.join(live_path, "latestscore.txt"), 'r') as fp:
             live_f1 = ast.literal_eval(fp.read())
         logger.info(f"fullprocess.py: F1 score of live model {live_f1}")
 
         # Get F1 score with the new data using deployment model
-        lr = load_model(
-            os.path.join(os.getcwd(), config["prod_deployment_path"])
-        )
-        df = pd.read_csv(os.path.join(os.getcwd(),
-                                      config["output_folder_path"],
-                                      "finaldata.csv"))
-
-        get_f1_score(
-            df, lr,
-            os.path.join(os.getcwd(), config["output_model_path"])
-        )
-
-        with open(os.path.join(os.getcwd(),
-                               config["output_model_path"],
-                               "latestscore.txt"), 'r') as fp:
-            new_f1 = ast.literal_eval(fp.read())
+        lr = load_model(live_path) if prod_model is None \
+            else prod_model.get()
+        new_f1 = get_f1_score(df, lr, model_path)
         logger.info(f"fullprocess.py: F1 score of new model {new_f1}")
+        return {"live_f1": live_f1, "new_f1": new_f1}
 
-        # Rebuild only if model drift has occured
-        if new_f1 < live_f1:
+    def drift_occurred(df, scores, drifted_files):
+        # Rebuild only if model drift has occured (or feature drift if
+        # configured)
+        if scores["new_f1"] < scores["live_f1"] or (
+                drifted_files and config.get("drift_triggers_retrain",
+                                             False)):
             logger.info("fullprocess.py: Model drift has occurred")
+            return True
+        logger.info("fullprocess.py: Model drift has NOT occurred")
+        return False
 
-            # Retrain
-            logger.info("Retrain model with new data")
-            training.main()
+    def retrain(df, scores, drifted_files):
+        import training
 
-            # Redeploy
-            logger.info("Deploy new model into live")
-            deployment.main()
+        logger.info("Retrain model with new data")
+        if config.get("training_mode", "full") == "incremental":
+            model = training.train_model_incremental(
+                data_path, model_path, data_format,
+                config.get("training_chunksize", 100000)
+            )
 
-            # Reporting
-            logger.info("Run reporting")
-            reporting.main()
+            # Report the validation F1 against a full refit on the
+            # ingested data already in memory
+            if model is not None and config.get("training_compare_full",
+                                                False):
+                training.compare_with_full_refit(model, df, load_test(),
+                                                 model_path)
+            return model
+        if config.get("training_mode", "full") == "search":
+            return training.search_model(
+                df, model_path, config["search_grid"],
+                config.get("search_type", "grid"),
+                config.get("search_iter", 10),
+                config.get("search_cv", 5),
+                config.get("search_workers", -1)
+            )
+        return training.train_model(df, model_path)
 
-        else:
-            logger.info("fullprocess.py: Model drift has NOT occurred")
-    else:
+    def trained(lr):
+        # Nothing is deployed or scored if there were no rows to train on
+        return lr is not None
+
+    def deploy(lr):
+        import deployment
+
+        logger.info("Deploy new model into live")
+        version = deployment.deploy_artifacts_to_prod(
+            model_path, data_path, prod_path,
+            config.get("deployment_keep_versions", 10))
+        if config.get("serve_reload_on_deploy", False):
+            deployment.reload_serving(os.path.join(
+                os.getcwd(), config.get("serve_pidfile", "gunicorn.pid")))
+        return version
+
+    def load_test():
+        from scoring import load_test_data
+
+        return load_test_data(test_path, data_format, FEATURES + [LABEL])
+
+    def score_test(lr, df):
+        from utils.metrics import confusion_counts, f1_from_counts
+
+        # Confusion counts of the retrained model, reused by reporting
+        cm = confusion_counts(df[LABEL], apply_model(df, lr))
+        f1 = f1_from_counts(cm)
+        logger.info(f"fullprocess.py: Test F1 score of retrained model {f1}")
+        return {"f1": f1, "cm": cm}
+
+    def report(scores):
+        import reporting
+
+        logger.info("Run reporting")
+        reporting.report_conf_mat(scores["cm"], model_path,
+                                  config.get("report_formats", ["png"]))
+
+    return [
+        Stage("detect", detect, cache=False),
+        Stage("feature_drift", feature_drift, ["detect"],
+              inputs=lambda new_files: new_file_paths(new_files) + [
+                  resolve_deployment(prod_path)],
+              when=bool),
+        Stage("ingest", ingest, ["detect"],
+              inputs=new_file_paths,
+              outputs=lambda: [
+                  resolve_data_file(data_path, "finaldata", data_format)[0],
+                  os.path.join(data_path, "ingestedfiles.txt")],
+              when=bool, load=load_ingested),
+        Stage("score_live", score_live, ["ingest"],
+              inputs=lambda df: [resolve_deployment(prod_path)],
+              outputs=lambda: [os.path.join(model_path, "latestscore.txt")]),
+        Stage("retrain", retrain, ["ingest", "score_live", "feature_drift"],
+              outputs=lambda: [os.path.join(model_path, "trainedmodel.pkl")],
+              when=drift_occurred, load=lambda: load_model(model_path)),
+        Stage("deploy", deploy, ["retrain"], cache=False,
+              when=trained),
+        Stage("test_data", lambda lr: load_test(), ["retrain"],
+              inputs=lambda lr: [test_path], when=trained, load=load_test),
+        Stage("score_test", score_test, ["retrain", "test_data"],
+              inputs=lambda lr, df: [test_path]),
+        Stage("report", report, ["score_test"],
+              outputs=lambda: [
+                  os.path.join(model_path, f"confusionmatrix.{fmt}")
+                  for fmt in config.get("report_formats", ["png"])]),
+    ]
+
+
+def run_pipeline(config, prod_model=None):
+    '''Ingest any new files and, if the model has drifted, retrain,
+    redeploy and report
+    Stages whose inputs are unchanged since the last run are skipped and
+    independent stages run concurrently (see utils.dag)
+
+    Inputs:
+        config (Dict)
+            Configuration
+        prod_model (utils.cache.ArtifactCache default = None)
+            Resident production model, None loads it from disk
+    Outputs:
+        dict
+            Stage name to result, None for stages that were not run
+    '''
+    results = run_dag(
+        build_pipeline(config, prod_model),
+        os.path.join(os.getcwd(), config.get("stage_cache_path",
+                                             "stagecache")),
+        config.get("pipeline_workers", 4)
+    )
+    if not results["detect"]:
         logger.info("fullprocess.py: No files to ingest")
+    return results
+
+
+def folder_signature(path):
+    '''Get a signature of the files in a folder that changes when a file
+    is added, removed or modified
+
+    Inputs:
+        path (string)
+            Path to folder
+    Outputs:
+        tuple
+            Sorted (name, size, mtime ns) of every file
+    '''
+    sig = []
+    for entry in os.scandir(path):
+        if entry.is_file():
+            st = entry.stat()
+            sig.append((entry.name, st.st_size, st.st_mtime_ns))
+    return tuple(sorted(sig))
+
+
+def watch(config, stop_event=None):
+    '''Long running orchestrator, runs the pipeline in-process whenever
+    the input folder changes
+
+    The folder is watched with watchdog (inotify etc.) if it is installed,
+    otherwise it is polled every watch_poll_interval seconds. Bursts of
+    arrivals are debounced, the pipeline only runs once the folder has
+    been unchanged for watch_debounce seconds. A failed run is retried
+    with exponential backoff (up to watch_max_backoff seconds) until it
+    succeeds
+
+    Inputs:
+        config (Dict)
+            Configuration
+        stop_event (threading.Event default = None)
+            Set to stop watching
+    Outputs:
+        None
+    '''
+    path = os.path.join(os.getcwd(), config["input_folder_path"])
+    poll_interval = config.get("watch_poll_interval", 5)
+    debounce = config.get("watch_debounce", 2)
+    max_backoff = config.get("watch_max_backoff", 300)
+    stop_event = stop_event or threading.Event()
+    wakeup = threading.Event()
+
+    # Keep the production model warm across cycles
+    prod_path = os.path.join(os.getcwd(), config["prod_deployment_path"])
+    prod_model = ArtifactCache(
+        os.path.join(prod_path, DEPLOYMENT_MANIFEST),
+        lambda: load_model(resolve_deployment(prod_path))
+    )
+
+    # Wake up on file system events if watchdog is available
+    observer = None
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        class WakeupHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        observer = Observer()
+        observer.schedule(WakeupHandler(), path)
+        observer.start()
+        logger.info(f"fullprocess.py: Watching {path} for events")
+    except ImportError:
+        logger.info(f"fullprocess.py: Polling {path} every "
+                    f"{poll_interval} seconds")
+
+    # NB the first cycle always runs to pick up files that arrived
+    # while the orchestrator was down
+    last_sig = None
+    failures = 0
+    try:
+        while not stop_event.is_set():
+            sig = folder_signature(path)
+            if sig != last_sig:
+
+                # Wait until the folder has settled
+                while not stop_event.wait(debounce):
+                    settled_sig = folder_signature(path)
+                    if settled_sig == sig:
+                        break
+                    sig = settled_sig
+                if stop_event.is_set():
+                    break
+
+                logger.info("fullprocess.py: Input folder changed")
+                try:
+                    run_pipeline(config, prod_model)
+                except Exception:
+                    # The folder is not marked as processed so the run is
+                    # retried
+                    failures += 1
+                    backoff = min(poll_interval * 2 ** failures, max_backoff)
+                    logger.exception(f"fullprocess.py: Pipeline run failed, "
+                                     f"retrying in {backoff} seconds")
+                    stop_event.wait(backoff)
+                    continue
+                failures = 0
+                last_sig = sig
+
+            wakeup.wait(poll_interval)
+            wakeup.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+def main():
+    '''Main functionality call
+
+    Usage
+        python fullprocess.py
+            Run the pipeline once
+        python fullprocess.py --watch
+            Run the pipeline whenever the input folder changes
+
+    Inputs:
+        None
+    Outputs:
+        None
+    '''
+    # Read the configuration file
+    config = read_config(r".\config.json")
+    logger.info("fullprocess.py: Configuration file read")
+
+    if "--watch" in sys.argv[1:]:
+        watch(config)
+    else:
+        run_pipeline(config)
 
 
 # Top level script entry point
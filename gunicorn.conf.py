@@ -0,0 +1,67 @@
+'''
+gunicorn configuration of the production serving mode, read from
+config.json
+
+The app is preloaded in the master so the resident production model (and,
+for app:app, the test data) is loaded once and shared copy-on-write by the
+forked workers. The model artifact is memory mapped so the workers also
+share its pages after a reload. Deploying sends the master SIGHUP (see
+deployment.reload_serving), the master reloads the preloaded artifacts
+once and then gracefully recycles the workers
+
+Usage
+    gunicorn -c gunicorn.conf.py
+    gunicorn -c gunicorn.conf.py -w 4 app:app
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+import gc
+import sys
+import multiprocessing
+from utils.io import read_config
+
+
+# Read the configuration file next to this one, so the server can be
+# started from any working directory
+# NB not named config as every module level name is read as a setting
+base_path = os.path.dirname(os.path.abspath(__file__))
+serving_config = read_config(os.path.join(base_path, "config.json"))
+
+
+# Application, bound address and worker pool
+# NB command line arguments override these settings
+wsgi_app = serving_config.get("serve_app", "serve:app")
+bind = serving_config.get("serve_bind", "0.0.0.0:8000")
+workers = serving_config.get("serve_workers") or multiprocessing.cpu_count()
+threads = serving_config.get("serve_threads", 1)
+timeout = serving_config.get("serve_timeout", 30)
+graceful_timeout = serving_config.get("serve_graceful_timeout", 30)
+max_requests = serving_config.get("serve_max_requests", 0)
+max_requests_jitter = max_requests // 10
+pidfile = os.path.join(base_path,
+                       serving_config.get("serve_pidfile", "gunicorn.pid"))
+preload_app = True
+
+
+def pre_fork(server, worker):
+    '''Move the preloaded objects to the permanent generation so garbage
+    collection in the workers does not write to (and so copy) their pages
+    '''
+    gc.freeze()
+
+
+def on_reload(server):
+    '''Refresh the artifacts of the preloaded app in the master before the
+    new workers are forked on SIGHUP, as gunicorn does not re-import a
+    preloaded app. Otherwise each new worker would fork the stale model
+    and reload the new one privately
+    '''
+    module = sys.modules.get(
+        (server.app.app_uri or server.cfg.wsgi_app).split(":")[0])
+    for name in ("prod_model", "test_data"):
+        cache = getattr(module, name, None)
+        if cache is not None:
+            cache.get()
+            server.log.info(f"gunicorn.conf.py: Refreshed {name}")
@@ -5,9 +5,14 @@ Author: Christopher Bonham
 Date: 16th February 2023
 '''
 import pandas as pd
+import numpy as np
 import os
+import ast
 import logging
-from utils.io import read_config
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.io import read_config, read_data, write_data, data_file, \
+                     iter_data, read_columns
+from utils.stats import SummaryAccumulator
 
 
 # Create a logger
@@ -15,17 +20,83 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def ingest_data(in_path, out_path):
-    '''Ingest training data, combine into a single dataset and write to csv
+# Explicit dtypes of the source data fields
+# NB the features are float so that missing values can be ingested
+DTYPES = {
+    "corporation": str,
+    "lastmonth_activity": "float64",
+    "lastyear_activity": "float64",
+    "number_of_employees": "float64",
+    "exited": "int64",
+}
+
+
+def read_source_file(fpath):
+    '''Read a single source csv file using the explicit field dtypes
+
+    Inputs:
+        fpath (string)
+            Path to csv file
+    Outputs:
+        pandas.DataFrame
+            File contents
+    '''
+    return pd.read_csv(fpath, dtype=DTYPES)
+
+
+def read_source_files(in_path, fnames, workers=1, executor="thread"):
+    '''Read source csv files across a worker pool and combine them with a
+    single concat
+
+    Inputs:
+        in_path (string)
+            Path to data to ingest
+        fnames (list)
+            Names of the files to read
+        workers (int default = 1)
+            Number of workers, 1 reads the files serially
+        executor (string default = "thread")
+            Worker pool type, "thread" or "process"
+    Outputs:
+        pandas.DataFrame
+            Combined file contents
+    '''
+    fpaths = [os.path.join(in_path, fname) for fname in fnames]
+
+    if workers <= 1 or len(fpaths) <= 1:
+        frames = [read_source_file(fpath) for fpath in fpaths]
+    else:
+        pool = ProcessPoolExecutor if executor == "process" \
+            else ThreadPoolExecutor
+        with pool(max_workers=workers) as ex:
+            frames = list(ex.map(read_source_file, fpaths))
+    logger.info(f"ingestion.py: Read {len(frames)} files using {workers} "
+                f"{executor} worker(s)")
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def ingest_data(in_path, out_path, workers=1, executor="thread",
+                data_format="csv", export_csv=False):
+    '''Ingest training data, combine into a single dataset and write to file
 
     Inputs:
         in_path (string)
             Path to data to ingest
         out_path (string)
             Path to write ingested data
+        workers (int default = 1)
+            Number of workers used to read the files
+        executor (string default = "thread")
+            Worker pool type, "thread" or "process"
+        data_format (string default = "csv")
+            Ingested data format, one of csv, parquet or feather
+        export_csv (boolean default = False)
+            Also write a csv copy when using a columnar format
 
     Outputs:
-        None
+        pandas.DataFrame
+            Ingested data
     '''
     logger.info(f"ingestion.py: Input folder path: {in_path}")
     logger.info(f"ingestion.py: Output folder path: {out_path}")
@@ -34,24 +105,24 @@ def ingest_data(in_path, out_path):
     fnames = os.listdir(in_path)
 
     # Read in the csv files, combine into a single dedupled dataframe
-    for idx, fname in enumerate(fnames):
-
-        # Use the first csv file to set the df metadata
-        if idx == 0:
-            df = pd.read_csv(os.path.join(in_path, fname))
-        else:
-            _ = pd.read_csv(os.path.join(in_path, fname))
-            df = pd.concat([df, _]).reset_index(drop=True)
+    df = read_source_files(in_path, fnames, workers, executor)
     df = df.drop_duplicates()
     logger.info(f"ingestion.py: Input data ingested, shape: {df.shape}")
 
-    # Write ingested df to csv
+    # Write ingested df to file
     # Create output directory if it doesnt exist
     if not os.path.exists(out_path):
         os.makedirs(out_path)
-    df.to_csv(os.path.join(out_path, "finaldata.csv"), index=False)
-    logger.info(f"ingestion.py: Ingested data written to "
-                f"{os.path.join(out_path, 'finaldata.csv')}")
+    fpath = write_data(df, out_path, "finaldata", data_format, export_csv)
+    logger.info(f"ingestion.py: Ingested data written to {fpath}")
+
+    # Write the row hash index used by incremental ingestion
+    np.save(os.path.join(out_path, "finaldata_rowhashes.npy"), hash_rows(df))
+
+    # Write the mergeable summary stats of the ingested data
+    acc = SummaryAccumulator()
+    acc.update(df)
+    acc.save(os.path.join(out_path, "finaldata_stats.json"))
 
     # Write names of ingested files
     with open(os.path.join(out_path, "ingestedfiles.txt"), "w") as fp:
@@ -59,6 +130,163 @@ def ingest_data(in_path, out_path):
     logger.info(f"ingestion.py: Ingested file list written to"
                 f" {os.path.join(out_path, 'ingestedfiles.txt')}")
 
+    return df
+
+
+def hash_rows(df):
+    '''Get a 64 bit hash of every row in a dataframe (index excluded)
+
+    Inputs:
+        df (pandas.DataFrame)
+            Dataframe to hash
+    Outputs:
+        numpy.array
+            Row hashes (uint64)
+    '''
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def read_ingested_files(out_path):
+    '''Read the names of the previously ingested files
+
+    Inputs:
+        out_path (string)
+            Path to the ingested data
+    Outputs:
+        list
+            Previously ingested file names, empty if nothing ingested yet
+    '''
+    fpath = os.path.join(out_path, "ingestedfiles.txt")
+    if not os.path.exists(fpath):
+        return []
+    with open(fpath, 'r') as fp:
+        return ast.literal_eval(fp.read())
+
+
+def load_row_index(out_path, data_format="csv"):
+    '''Load the persisted row hash index of the ingested data
+    If the index does not exist it is rebuilt (once) from the ingested data
+
+    Inputs:
+        out_path (string)
+            Path to the ingested data
+        data_format (string default = "csv")
+            Ingested data format, one of csv, parquet or feather
+    Outputs:
+        numpy.array
+            Row hashes (uint64) of the ingested data
+    '''
+    fpath = os.path.join(out_path, "finaldata_rowhashes.npy")
+    if os.path.exists(fpath):
+        return np.load(fpath)
+
+    logger.info("ingestion.py: Row hash index not found, rebuilding it")
+    hashes = hash_rows(
+        read_data(out_path, "finaldata", data_format, dtype=DTYPES)
+    )
+    np.save(fpath, hashes)
+    return hashes
+
+
+def update_summary_stats(out_path, df, data_format="csv"):
+    '''Update the persisted mergeable summary stats with newly ingested
+    rows. If they do not exist yet they are built from the ingested data
+    (which already includes the new rows)
+
+    Inputs:
+        out_path (string)
+            Path to the ingested data
+        df (pandas.DataFrame)
+            Newly ingested rows
+        data_format (string default = "csv")
+            Ingested data format, one of csv, parquet or feather
+    Outputs:
+        None
+    '''
+    fpath = os.path.join(out_path, "finaldata_stats.json")
+    if os.path.exists(fpath):
+        acc = SummaryAccumulator.load(fpath)
+        acc.update(df)
+    else:
+        acc = SummaryAccumulator()
+        for chunk in iter_data(out_path, "finaldata", data_format,
+                               columns=None):
+            acc.update(chunk)
+    acc.save(fpath)
+    logger.info(f"ingestion.py: Summary stats updated, rows: {acc.rows}")
+
+
+def ingest_data_incremental(in_path, out_path, workers=1, executor="thread",
+                            data_format="csv", export_csv=False):
+    '''Ingest only the files not yet recorded in ingestedfiles.txt,
+    dedupe them against the persisted row hash index and add them to the
+    ingested data. Falls back to a full ingest if nothing has been
+    ingested yet
+    NB csv is appended to in place, columnar formats get a new part file
+    so the previously ingested rows are neither read nor rewritten
+
+    Inputs:
+        in_path (string)
+            Path to data to ingest
+        out_path (string)
+            Path to write ingested data
+        workers (int default = 1)
+            Number of workers used to read the files
+        executor (string default = "thread")
+            Worker pool type, "thread" or "process"
+        data_format (string default = "csv")
+            Ingested data format, one of csv, parquet or feather
+        export_csv (boolean default = False)
+            Also write a csv copy when using a columnar format
+
+    Outputs:
+        pandas.DataFrame
+            Newly ingested rows (all rows if it fell back to a full ingest)
+    '''
+    logger.info(f"ingestion.py: Input folder path: {in_path}")
+    logger.info(f"ingestion.py: Output folder path: {out_path}")
+
+    # Nothing ingested yet so do a full ingest
+    data_path = data_file(out_path, "finaldata", data_format)
+    prev_files = read_ingested_files(out_path)
+    if not os.path.exists(data_path):
+        return ingest_data(in_path, out_path, workers, executor,
+                           data_format, export_csv)
+
+    # Get a list of the files that have not been ingested
+    columns = read_columns(out_path, "finaldata", data_format)
+    fnames = [f for f in os.listdir(in_path) if f not in prev_files]
+    logger.info(f"ingestion.py: New files to ingest are {fnames}")
+    if len(fnames) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # Read the new files, aligning the columns with the ingested data
+    df = read_source_files(in_path, fnames, workers, executor)[columns]
+
+    # Drop rows duplicated within the new data or already ingested
+    hashes = hash_rows(df)
+    row_index = load_row_index(out_path, data_format)
+    keep = ~pd.Series(hashes).duplicated().values & \
+        ~np.isin(hashes, row_index)
+    df = df[keep]
+    logger.info(f"ingestion.py: New rows to append, shape: {df.shape}")
+
+    # Append the new rows and update the row hash index
+    write_data(df, out_path, "finaldata", data_format, export_csv,
+               append=True)
+    np.save(os.path.join(out_path, "finaldata_rowhashes.npy"),
+            np.concatenate([row_index, hashes[keep]]))
+    update_summary_stats(out_path, df, data_format)
+    logger.info(f"ingestion.py: Ingested data appended to {data_path}")
+
+    # Write names of ingested files
+    with open(os.path.join(out_path, "ingestedfiles.txt"), "w") as fp:
+        fp.write(str(prev_files + fnames))
+    logger.info(f"ingestion.py: Ingested file list written to"
+                f" {os.path.join(out_path, 'ingestedfiles.txt')}")
+
+    return df
+
 
 def main():
     '''Main functionality call
@@ -72,10 +300,18 @@ def main():
     config = read_config(r".\config.json")
     logger.info("ingestion.py: Configuration file read")
 
-    # Ingest the data
-    ingest_data(
+    # Ingest the data, only reading new files in incremental mode
+    if config.get("ingestion_mode", "full") == "incremental":
+        ingest = ingest_data_incremental
+    else:
+        ingest = ingest_data
+    ingest(
         os.path.join(os.getcwd(), config["input_folder_path"]),
         os.path.join(os.getcwd(), config["output_folder_path"]),
+        workers=config.get("ingestion_workers", 1),
+        executor=config.get("ingestion_executor", "thread"),
+        data_format=config.get("data_format", "csv"),
+        export_csv=config.get("export_csv", False),
     )
 
 
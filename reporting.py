@@ -4,12 +4,13 @@ Functionality to plot performance
 Author: Christopher Bonham
 Date: 17th February 2023
 '''
-import pandas as pd
 import os
+import json
 import logging
-from utils.io import read_config, load_model, apply_model
-from sklearn.metrics import confusion_matrix
-from matplotlib import pyplot as plt
+import numpy as np
+from utils.io import read_config, load_model, apply_model, read_data, \
+                     iter_data, FEATURES, LABEL
+from utils.metrics import score_chunks, confusion_counts
 
 
 # Create a logger
@@ -17,11 +18,15 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def load_test_data(in_path):
+def load_test_data(in_path, data_format="csv", columns=None):
     '''Load test data to dataframe
     Inputs:
         in_path (string)
             Path to test data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        columns (list default = None)
+            Columns to load, None loads all of them
 
     Outputs:
         pandas.dataframe
@@ -30,14 +35,14 @@ def load_test_data(in_path):
     logger.info(f"scoring.py: Input folder path: {in_path}")
 
     # Load training data
-    df = pd.read_csv(os.path.join(in_path, "testdata.csv"))
+    df = read_data(in_path, "testdata", data_format, columns)
     logger.info(f"scoring.py: Test data shape: {df.shape}")
 
     return df
 
 
-def plot_conf_mat(df, lr, out_path):
-    '''Load test data to dataframe
+def plot_conf_mat(df, lr, out_path, y_pred=None, formats=("png",)):
+    '''Report the confusion matrix of a model on a dataframe
     Inputs:
         df (Pandas.datafrane)
             Data to score
@@ -45,33 +50,96 @@ def plot_conf_mat(df, lr, out_path):
             Logistic regression model
         out_path (string)
             Path to store confusion matrix plot
+        y_pred (array like default = None)
+            Precomputed predictions, None applies the model
+        formats (tuple default = ("png",))
+            Report formats (see report_conf_mat)
     Outputs:
-        None
+        numpy.array
+            2x2 confusion matrix counts
     '''
-    logger.info(f"scoring.py: Output folder path: {out_path}")
+    logger.info(f"reporting.py: Output folder path: {out_path}")
 
     # Get model scores
-    y_pred = apply_model(df, lr)
-
-    # Extract labels
-    y = df["exited"]
+    if y_pred is None:
+        y_pred = apply_model(df, lr)
 
     # Get confusion matrix
-    cm = confusion_matrix(y, y_pred)
-    print(y)
-    print(y_pred)
-    print(type(cm))
-    print(cm)
+    cm = confusion_counts(df[LABEL], y_pred)
+
+    # Report confusion matrix
+    report_conf_mat(cm, out_path, formats)
+
+    return cm
+
+
+def report_conf_mat(cm, out_path, formats=("png",)):
+    '''Report confusion matrix counts
+    Inputs:
+        cm (numpy.array)
+            Confusion matrix counts, rows are actual and columns are predicted
+        out_path (string)
+            Path to store the report
+        formats (tuple default = ("png",))
+            Any of "png" (confusionmatrix.png) and "json"
+            (confusionmatrix.json)
+    Outputs:
+        None
+    '''
+    if "png" in formats:
+        plot_conf_mat_counts(cm, out_path)
+    if "json" in formats:
+        write_conf_mat_json(cm, out_path)
+
+
+def plot_conf_mat_counts(cm, out_path):
+    '''Plot confusion matrix counts
+    NB this renders with Agg on its own figure rather than the global
+    pyplot state so it is safe to call repeatedly in a long lived process
+
+    Inputs:
+        cm (numpy.array)
+            Confusion matrix counts, rows are actual and columns are predicted
+        out_path (string)
+            Path to store confusion matrix plot
+    Outputs:
+        None
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
     # Plot confusion matrix
-    plt.matshow(cm, cmap=plt.cm.Greens)
-    plt.title("Confusion matrix")
-    plt.xlabel("Predicted")
-    plt.ylabel("Actual")
-    # plt.show()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.matshow(cm, cmap="Greens")
+    ax.set_title("Confusion matrix")
+    ax.set_xlabel("Predicted")
+    ax.set_ylabel("Actual")
 
     # Save plot to file
-    plt.savefig(os.path.join(out_path, 'confusionmatrix.png'))
+    fig.savefig(os.path.join(out_path, 'confusionmatrix.png'))
+    fig.clear()
+    logger.info(f"reporting.py: Confusion matrix plot written to "
+                f"{os.path.join(out_path, 'confusionmatrix.png')}")
+
+
+def write_conf_mat_json(cm, out_path):
+    '''Write confusion matrix counts to confusionmatrix.json
+    Inputs:
+        cm (numpy.array)
+            Confusion matrix counts, rows are actual and columns are predicted
+        out_path (string)
+            Path to store the confusion matrix
+    Outputs:
+        None
+    '''
+    fpath = os.path.join(out_path, "confusionmatrix.json")
+    with open(fpath, "w") as fp:
+        json.dump({"labels": [0, 1], "rows": "actual",
+                   "columns": "predicted",
+                   "counts": np.asarray(cm).tolist()}, fp, indent=2)
+    logger.info(f"reporting.py: Confusion matrix written to {fpath}")
 
 
 def main():
@@ -86,21 +154,37 @@ def main():
     config = read_config(r".\config.json")
     logger.info("scoring.py: Configuration file read")
 
-    # Load the test data
-    df = load_test_data(
-        os.path.join(os.getcwd(), config["test_data_path"])
-    )
-
     # Load the model
     lr = load_model(
         os.path.join(os.getcwd(), config["output_model_path"])
     )
 
-    # Get the confusion matrix plot
-    plot_conf_mat(
-        df, lr,
-        os.path.join(os.getcwd(), config["output_model_path"])
-    )
+    # Get the confusion matrix report, streaming the test data in chunks
+    # if configured
+    formats = config.get("report_formats", ["png"])
+    chunksize = config.get("scoring_chunksize")
+    if chunksize:
+        chunks = iter_data(
+            os.path.join(os.getcwd(), config["test_data_path"]),
+            "testdata", config.get("data_format", "csv"),
+            chunksize, FEATURES + [LABEL]
+        )
+        report_conf_mat(
+            score_chunks(chunks, lr),
+            os.path.join(os.getcwd(), config["output_model_path"]),
+            formats
+        )
+    else:
+        df = load_test_data(
+            os.path.join(os.getcwd(), config["test_data_path"]),
+            config.get("data_format", "csv"),
+            FEATURES + [LABEL]
+        )
+        plot_conf_mat(
+            df, lr,
+            os.path.join(os.getcwd(), config["output_model_path"]),
+            formats=formats
+        )
 
 
 # Top level script entry point
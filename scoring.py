@@ -4,11 +4,12 @@ Functionality to apply the model to new data and get F1 performance
 Author: Christopher Bonham
 Date: 16th February 2023
 '''
-import pandas as pd
 import os
 import logging
-from utils.io import read_config, load_model, apply_model
-from sklearn.metrics import f1_score
+import threading
+from utils.io import read_config, load_model, apply_model, read_data, \
+                     iter_data, FEATURES, LABEL
+from utils.metrics import score_chunks, confusion_counts, f1_from_counts
 
 
 # Create a logger
@@ -16,11 +17,15 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def load_test_data(in_path):
+def load_test_data(in_path, data_format="csv", columns=None):
     '''Load test data to dataframe
     Inputs:
         in_path (string)
             Path to test data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        columns (list default = None)
+            Columns to load, None loads all of them
 
     Outputs:
         pandas.dataframe
@@ -29,14 +34,15 @@ def load_test_data(in_path):
     logger.info(f"scoring.py: Input folder path: {in_path}")
 
     # Load training data
-    df = pd.read_csv(os.path.join(in_path, "testdata.csv"))
+    df = read_data(in_path, "testdata", data_format, columns)
     logger.info(f"scoring.py: Test data shape: {df.shape}")
 
     return df
 
 
-def get_f1_score(df, lr, out_path):
+def get_f1_score(df, lr, out_path, persist=True):
     '''Get f1 score
+    NB this is thread safe so can be called in-process by the app
     Inputs:
         df (Pandas.datafrane)
             Data to score
@@ -44,8 +50,11 @@ def get_f1_score(df, lr, out_path):
             Logistic regression model
         out_path (string)
             Path to store the F1 score
+        persist (boolean default = True)
+            Write the F1 score to latestscore.txt
     Outputs:
-        None
+        float
+            F1 score
     '''
     logger.info(f"scoring.py: Output folder path: {out_path}")
 
@@ -53,18 +62,68 @@ def get_f1_score(df, lr, out_path):
     y_pred = apply_model(df, lr)
 
     # Extract labels
-    y = df["exited"]
+    y = df[LABEL]
 
     # Get model F1 score
-    f1 = f1_score(y, y_pred)
+    f1 = f1_from_counts(confusion_counts(y, y_pred))
     logger.info(f"scoring.py: f1 score: {f1}")
 
     # Write f1 score to file
+    if persist:
+        write_f1_score(f1, out_path)
+
+    return f1
+
+
+def get_f1_score_streaming(chunks, lr, out_path):
+    '''Get f1 score scoring the data chunk by chunk so that it never has
+    to be held in memory
+
+    Inputs:
+        chunks (iterable of pandas.DataFrame)
+            Data chunks to score
+        lr (sklearn.linear_model._logistic.LogisticRegression)
+            Logistic regression model
+        out_path (string)
+            Path to store the F1 score
+    Outputs:
+        numpy.array
+            2x2 confusion matrix counts
+    '''
+    logger.info(f"scoring.py: Output folder path: {out_path}")
+
+    # Get running confusion matrix counts and the F1 score from them
+    cm = score_chunks(chunks, lr)
+    f1 = f1_from_counts(cm)
+    logger.info(f"scoring.py: Rows scored: {cm.sum()}, f1 score: {f1}")
+
+    # Write f1 score to file
+    write_f1_score(f1, out_path)
+
+    return cm
+
+
+def write_f1_score(f1, out_path):
+    '''Write f1 score to latestscore.txt
+    The file is written under a unique temporary name and renamed so that
+    concurrent writers never interleave
+
+    Inputs:
+        f1 (float)
+            F1 score
+        out_path (string)
+            Path to store the F1 score
+    Outputs:
+        None
+    '''
     # Create folder if it doesnt exists
     if not os.path.exists(out_path):
         os.makedirs(out_path)
-    with open(os.path.join(out_path, "latestscore.txt"), "w") as fp:
+    fpath = os.path.join(out_path, "latestscore.txt")
+    tmp = f"{fpath}.tmp{os.getpid()}_{threading.get_ident()}"
+    with open(tmp, "w") as fp:
         fp.write(str(f1))
+    os.replace(tmp, fpath)
     logger.info(f"scoring.py: f1 score written to"
                 f" {os.path.join(out_path, 'latestscore.txt')}")
 
@@ -81,21 +140,33 @@ def main():
     config = read_config(r".\config.json")
     logger.info("scoring.py: Configuration file read")
 
-    # Load the test data
-    df = load_test_data(
-        os.path.join(os.getcwd(), config["test_data_path"])
-    )
-
     # Load the model
     lr = load_model(
         os.path.join(os.getcwd(), config["output_model_path"])
     )
 
-    # Get F1 score
-    get_f1_score(
-        df, lr,
-        os.path.join(os.getcwd(), config["output_model_path"])
-    )
+    # Get F1 score, streaming the test data in chunks if configured
+    chunksize = config.get("scoring_chunksize")
+    if chunksize:
+        chunks = iter_data(
+            os.path.join(os.getcwd(), config["test_data_path"]),
+            "testdata", config.get("data_format", "csv"),
+            chunksize, FEATURES + [LABEL]
+        )
+        get_f1_score_streaming(
+            chunks, lr,
+            os.path.join(os.getcwd(), config["output_model_path"])
+        )
+    else:
+        df = load_test_data(
+            os.path.join(os.getcwd(), config["test_data_path"]),
+            config.get("data_format", "csv"),
+            FEATURES + [LABEL]
+        )
+        get_f1_score(
+            df, lr,
+            os.path.join(os.getcwd(), config["output_model_path"])
+        )
 
 
 # Top level script entry point
@@ -0,0 +1,61 @@
+'''
+Minimal serving entry point, only the batch prediction endpoint of app.py
+
+It imports nothing but Flask, the payload decoding and the resident
+production model so that it starts (and spawns workers) quickly. The model
+is scored from the NumPy artifact (trainedmodel.lrm) when it is deployed
+so sklearn is not imported either
+
+Usage
+    python serve.py
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+from flask import Flask, request, jsonify
+from utils.io import read_config, load_model, resolve_deployment, \
+                     DEPLOYMENT_MANIFEST
+from utils.cache import ArtifactCache
+from utils.payload import predict_batch
+
+
+# Instantiate app instance
+app = Flask(__name__)
+
+
+# Read the configuration file next to this module and resolve the
+# artifact paths from the same folder, so the app can be imported by a
+# server started from any working directory
+base_path = os.path.dirname(os.path.abspath(__file__))
+config = read_config(os.path.join(base_path, "config.json"))
+
+
+# Keep the production model resident, it is reloaded when a deploy
+# switches the live version
+prod_path = os.path.join(base_path, config["prod_deployment_path"])
+prod_model = ArtifactCache(
+    os.path.join(prod_path, DEPLOYMENT_MANIFEST),
+    lambda: load_model(resolve_deployment(prod_path))
+)
+prod_model.get()
+
+
+@app.route("/prediction", methods=["POST"])
+def prediction_batch_ep():
+    '''Batch prediction endpoint, see app.prediction_batch_ep
+
+    Inputs:
+        None
+    Outputs:
+        json
+            {"predictions": [...], "probabilities": [...]}
+    '''
+    # Score the batch using the resident production model
+    body, status = predict_batch(request.get_data(), request.content_type,
+                                 prod_model.get)
+    return jsonify(body), status
+
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=8000)
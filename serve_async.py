@@ -0,0 +1,163 @@
+'''
+Asynchronous serving entry point with micro-batching
+
+A plain ASGI application serving the batch prediction endpoint. The rows
+of concurrent requests are gathered by utils.batching.MicroBatcher, for up
+to batch_window_ms milliseconds or batch_max_size rows, and scored with a
+single vectorised call to the resident production model
+
+Usage
+    python serve_async.py
+    uvicorn serve_async:app --port 8000
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+import json
+import numpy as np
+from utils.io import read_config, load_model, resolve_deployment, \
+                     DEPLOYMENT_MANIFEST, FEATURES
+from utils.cache import ArtifactCache
+from utils.payload import decode_batch
+from utils.linear import LinearScorer
+from utils.batching import MicroBatcher
+
+
+# Read the configuration file next to this module and resolve the
+# artifact paths from the same folder, so the app can be imported by a
+# server started from any working directory
+base_path = os.path.dirname(os.path.abspath(__file__))
+config = read_config(os.path.join(base_path, "config.json"))
+
+
+# Keep the production model resident, it is reloaded when a deploy
+# switches the live version
+prod_path = os.path.join(base_path, config["prod_deployment_path"])
+prod_model = ArtifactCache(
+    os.path.join(prod_path, DEPLOYMENT_MANIFEST),
+    lambda: load_model(resolve_deployment(prod_path))
+)
+prod_model.get()
+
+
+def score(X):
+    '''Score a batch with the production model
+
+    Inputs:
+        X (numpy.array)
+            2D float array of features in model order
+    Outputs:
+        tuple
+            Predicted labels, positive class probabilities
+    '''
+    lr = prod_model.get()
+    if isinstance(lr, LinearScorer):
+        return lr.score(X)
+    return lr.predict(X), lr.predict_proba(X)[:, 1]
+
+
+batcher = MicroBatcher(score, config.get("batch_max_size", 256),
+                       config.get("batch_window_ms", 2) / 1000)
+
+
+async def send_json(send, status, body):
+    '''Send a JSON response
+
+    Inputs:
+        send (callable)
+            ASGI send
+        status (int)
+            HTTP status code
+        body (dict)
+            Response body
+    Outputs:
+        None
+    '''
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body",
+                "body": json.dumps(body).encode("utf-8")})
+
+
+async def read_body(receive):
+    '''Read the request body
+
+    Inputs:
+        receive (callable)
+            ASGI receive
+    Outputs:
+        bytes
+            Request body
+    '''
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def app(scope, receive, send):
+    '''ASGI application
+
+    POST /prediction takes the records to score in the request body, the
+    payload formats are those of app.prediction_batch_ep
+
+    Inputs:
+        scope (dict)
+            ASGI connection scope
+        receive (callable)
+            ASGI receive
+        send (callable)
+            ASGI send
+    Outputs:
+        None
+    '''
+    # Start and stop the batcher with the server
+    # NB without lifespan events it is started by the first request
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                batcher.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await batcher.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # Only HTTP is served, the server rejects other connections
+    # (e.g. websockets) the app does not accept
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] != "/prediction" or scope["method"] != "POST":
+        await send_json(send, 404, {"error": "Not found"})
+        return
+
+    # Decode the records to score
+    content_type = dict(scope["headers"]).get(b"content-type", b"")
+    try:
+        df = decode_batch(await read_body(receive),
+                          content_type.decode("latin-1"))
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    if len(df) == 0:
+        await send_json(send, 200, {"predictions": [], "probabilities": []})
+        return
+
+    # Score the rows with those of the concurrent requests
+    labels, proba = await batcher.submit(
+        df[FEATURES].to_numpy(dtype=np.float64))
+    await send_json(send, 200, {"predictions": labels.tolist(),
+                                "probabilities": proba.tolist()})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
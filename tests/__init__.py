@@ -0,0 +1,6 @@
+'''
+Unit tests, run from the repository root with python -m pytest
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
@@ -0,0 +1,92 @@
+'''
+Tests of the checksummed model artifact reader and writer
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+import numpy as np
+import pytest
+from utils.io import FEATURES
+from utils.linear import LinearScorer
+from utils.artifact import write_artifact, read_artifact, read_header, \
+                           ARTIFACT_NAME
+
+
+@pytest.fixture
+def scorer():
+    return LinearScorer([0.5, -1.25, 2.0], -0.75, FEATURES, ("stay", "exit"))
+
+
+def corrupt(fpath, old, new):
+    '''Replace bytes of a file in place
+
+    Inputs:
+        fpath (string)
+            Path to file
+        old (bytes)
+            Bytes to replace
+        new (bytes)
+            Replacement of the same length
+    Outputs:
+        None
+    '''
+    with open(fpath, "rb") as fp:
+        data = fp.read()
+    assert old in data and len(old) == len(new)
+    with open(fpath, "wb") as fp:
+        fp.write(data.replace(old, new, 1))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, scorer, mmap):
+    write_artifact(scorer, tmp_path, {"f1": 0.5, "rows": 10})
+    loaded = read_artifact(tmp_path, mmap=mmap)
+
+    X = np.random.default_rng(0).normal(size=(50, len(FEATURES)))
+    assert loaded.features == FEATURES
+    assert loaded.metadata == {"f1": 0.5, "rows": 10}
+    assert np.array_equal(loaded.predict(X), scorer.predict(X))
+    assert np.array_equal(loaded.predict_proba(X), scorer.predict_proba(X))
+
+
+def test_payload_is_aligned(tmp_path, scorer):
+    write_artifact(scorer, tmp_path)
+    _, offset = read_header(os.path.join(tmp_path, ARTIFACT_NAME))
+    assert offset % 64 == 0
+
+
+def test_detects_corrupt_payload(tmp_path, scorer):
+    fpath = write_artifact(scorer, tmp_path)
+    corrupt(fpath, np.float64(-1.25).tobytes(), np.float64(1.25).tobytes())
+    with pytest.raises(ValueError, match="Checksum"):
+        read_artifact(tmp_path)
+    read_artifact(tmp_path, verify=False)
+
+
+def test_detects_corrupt_header(tmp_path, scorer):
+    # Swapping the feature order keeps the header length
+    fpath = write_artifact(scorer, tmp_path)
+    corrupt(fpath, b'"lastmonth_activity", "lastyear_activity"',
+            b'"lastyear_activity", "lastmonth_activity"')
+    with pytest.raises(ValueError, match="Checksum"):
+        read_artifact(tmp_path)
+
+    fpath = write_artifact(scorer, tmp_path)
+    corrupt(fpath, b'"stay", "exit"', b'"exit", "stay"')
+    with pytest.raises(ValueError, match="Checksum"):
+        read_artifact(tmp_path)
+
+
+def test_rejects_other_files(tmp_path):
+    with open(os.path.join(tmp_path, ARTIFACT_NAME), "wb") as fp:
+        fp.write(b"not a model artifact")
+    with pytest.raises(ValueError, match="not a linear model artifact"):
+        read_artifact(tmp_path)
+
+
+def test_rejects_other_format_versions(tmp_path, scorer):
+    fpath = write_artifact(scorer, tmp_path)
+    corrupt(fpath, b'"format_version": 3', b'"format_version": 2')
+    with pytest.raises(ValueError, match="Unsupported"):
+        read_artifact(tmp_path)
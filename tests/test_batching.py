@@ -0,0 +1,100 @@
+'''
+Tests of the asyncio micro-batcher
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import asyncio
+import threading
+import numpy as np
+import pytest
+from utils.batching import MicroBatcher
+
+
+class RecordingScorer:
+    '''Scores rows by the sign of their sum and records every call'''
+
+    def __init__(self):
+        self.sizes = []
+        self.threads = []
+
+    def __call__(self, X):
+        self.sizes.append(len(X))
+        self.threads.append(threading.get_ident())
+        total = X.sum(axis=1)
+        return (total > 0).astype(int), total
+
+
+async def submit_all(batcher, requests):
+    '''Submit requests concurrently to a started batcher
+
+    Inputs:
+        batcher (utils.batching.MicroBatcher)
+            Batcher
+        requests (list)
+            2D float arrays to score
+    Outputs:
+        list
+            Results of each request
+    '''
+    batcher.start()
+    try:
+        return await asyncio.gather(*[batcher.submit(X) for X in requests])
+    finally:
+        await batcher.stop()
+
+
+def test_results_are_split_back_to_each_request():
+    rng = np.random.default_rng(0)
+    requests = [rng.normal(size=(int(n), 3))
+                for n in rng.integers(1, 10, size=40)]
+    scorer = RecordingScorer()
+    results = asyncio.run(submit_all(
+        MicroBatcher(scorer, max_batch_size=32, window=0.05), requests))
+
+    for X, (labels, proba) in zip(requests, results):
+        assert np.array_equal(proba, X.sum(axis=1))
+        assert np.array_equal(labels, (X.sum(axis=1) > 0).astype(int))
+    assert sum(scorer.sizes) == sum(len(X) for X in requests)
+    assert len(scorer.sizes) < len(requests)
+    assert max(scorer.sizes) <= 32
+
+
+def test_large_request_is_scored_alone():
+    requests = [np.ones((3, 3))] * 10 + [np.ones((100, 3))]
+    scorer = RecordingScorer()
+    asyncio.run(submit_all(
+        MicroBatcher(scorer, max_batch_size=64, window=0.05), requests))
+
+    assert 100 in scorer.sizes
+    assert all(size <= 64 for size in scorer.sizes if size != 100)
+    assert sum(scorer.sizes) == 130
+
+
+def test_scoring_runs_off_the_event_loop():
+    scorer = RecordingScorer()
+    asyncio.run(submit_all(MicroBatcher(scorer), [np.ones((2, 3))]))
+    assert threading.get_ident() not in scorer.threads
+
+
+def test_scoring_error_is_raised_in_every_request():
+    def fail(X):
+        raise RuntimeError("model failed")
+
+    with pytest.raises(RuntimeError, match="model failed"):
+        asyncio.run(submit_all(MicroBatcher(fail, window=0.05),
+                               [np.ones((2, 3))] * 5))
+
+
+def test_started_by_first_request():
+    async def run(batcher):
+        try:
+            return await batcher.submit(np.ones((2, 3)))
+        finally:
+            await batcher.stop()
+
+    batcher = MicroBatcher(RecordingScorer())
+    for _ in range(2):
+        labels, proba = asyncio.run(run(batcher))
+        assert labels.tolist() == [1, 1]
+        assert proba.tolist() == [3.0, 3.0]
@@ -0,0 +1,72 @@
+'''
+Tests of the resident artifact cache
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+from utils.cache import ArtifactCache
+
+
+def touch(fpath, text):
+    '''Rewrite a watched file so its signature changes
+
+    Inputs:
+        fpath (pathlib.Path)
+            Path to file
+        text (string)
+            New contents
+    Outputs:
+        None
+    '''
+    fpath.write_text(text)
+    st = os.stat(fpath)
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_reload_on_change(tmp_path):
+    fpath = tmp_path / "CURRENT.json"
+    fpath.write_text("1")
+    loads = []
+
+    def loader():
+        loads.append(fpath.read_text())
+        return int(fpath.read_text())
+
+    cache = ArtifactCache(str(fpath), loader)
+    assert cache.get() == 1
+    assert cache.get() == 1
+    touch(fpath, "2")
+    assert cache.get() == 2
+    assert loads == ["1", "2"]
+
+
+def test_failed_reload_keeps_artifact_and_backs_off(tmp_path, monkeypatch):
+    fpath = tmp_path / "CURRENT.json"
+    fpath.write_text("1")
+    loads = []
+
+    def loader():
+        loads.append(fpath.read_text())
+        return int(fpath.read_text())
+
+    now = [1000.0]
+    monkeypatch.setattr("utils.cache.time.monotonic", lambda: now[0])
+    cache = ArtifactCache(str(fpath), loader, retry_interval=30)
+    assert cache.get() == 1
+
+    # A half-written file is tried once, the last good artifact is served
+    touch(fpath, "{")
+    for _ in range(5):
+        assert cache.get() == 1
+    assert len(loads) == 2
+
+    # Retried after the interval
+    now[0] += 31
+    assert cache.get() == 1
+    assert len(loads) == 3
+
+    # Retried as soon as the file changes again
+    touch(fpath, "3")
+    assert cache.get() == 3
+    assert len(loads) == 4
@@ -0,0 +1,155 @@
+'''
+Tests of the pipeline DAG runner
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+import pytest
+from utils.dag import Stage, order_stages, run_dag
+
+
+def make_stages(tmp_path, calls, train_when=None):
+    '''Get a three stage pipeline that counts its stage calls
+
+    Inputs:
+        tmp_path (pathlib.Path)
+            Working folder, the pipeline reads data.txt
+        calls (dict)
+            Stage name to number of calls, updated by the stages
+        train_when (callable default = None)
+            Condition of the train stage
+    Outputs:
+        list
+            Stages
+    '''
+    data = os.path.join(tmp_path, "data.txt")
+    model = os.path.join(tmp_path, "model.txt")
+
+    def ingest():
+        calls["ingest"] = calls.get("ingest", 0) + 1
+        with open(data, "r") as fp:
+            return fp.read()
+
+    def train(text):
+        calls["train"] = calls.get("train", 0) + 1
+        with open(model, "w") as fp:
+            fp.write(text.upper())
+        return len(text)
+
+    def report(text, size):
+        calls["report"] = calls.get("report", 0) + 1
+        return f"{text}:{size}"
+
+    return [
+        Stage("report", report, deps=["ingest", "train"]),
+        Stage("train", train, deps=["ingest"], outputs=lambda: [model],
+              when=train_when),
+        Stage("ingest", ingest, inputs=lambda: [data]),
+    ]
+
+
+def write(tmp_path, text):
+    '''Write the pipeline input
+
+    Inputs:
+        tmp_path (pathlib.Path)
+            Working folder
+        text (string)
+            Contents of data.txt
+    Outputs:
+        None
+    '''
+    with open(os.path.join(tmp_path, "data.txt"), "w") as fp:
+        fp.write(text)
+
+
+def test_order():
+    stages = make_stages("", {})
+    levels = [[stage.name for stage in level]
+              for level in order_stages(stages)]
+    assert levels == [["ingest"], ["train"], ["report"]]
+
+    stages.append(Stage("a", None, deps=["b"]))
+    stages.append(Stage("b", None, deps=["a"]))
+    with pytest.raises(ValueError):
+        order_stages(stages)
+
+
+def test_unchanged_stages_skipped(tmp_path):
+    write(tmp_path, "abc")
+    calls = {}
+    cache = os.path.join(tmp_path, "cache")
+    first = run_dag(make_stages(tmp_path, calls), cache)
+    second = run_dag(make_stages(tmp_path, calls), cache)
+
+    assert first == second == {"ingest": "abc", "train": 3,
+                               "report": "abc:3"}
+    assert calls == {"ingest": 1, "train": 1, "report": 1}
+
+
+def test_changed_input_reruns_dependents(tmp_path):
+    write(tmp_path, "abc")
+    calls = {}
+    cache = os.path.join(tmp_path, "cache")
+    run_dag(make_stages(tmp_path, calls), cache)
+
+    write(tmp_path, "abcd")
+    results = run_dag(make_stages(tmp_path, calls), cache)
+    assert results["report"] == "abcd:4"
+    assert calls == {"ingest": 2, "train": 2, "report": 2}
+
+    # Same size, only the modification time differs
+    write(tmp_path, "wxyz")
+    stat = os.stat(os.path.join(tmp_path, "data.txt"))
+    os.utime(os.path.join(tmp_path, "data.txt"),
+             ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    results = run_dag(make_stages(tmp_path, calls), cache)
+    assert results["report"] == "wxyz:4"
+    assert calls == {"ingest": 3, "train": 3, "report": 3}
+
+
+def test_missing_output_reruns_stage(tmp_path):
+    write(tmp_path, "abc")
+    calls = {}
+    cache = os.path.join(tmp_path, "cache")
+    run_dag(make_stages(tmp_path, calls), cache)
+
+    os.remove(os.path.join(tmp_path, "model.txt"))
+    run_dag(make_stages(tmp_path, calls), cache)
+    assert calls == {"ingest": 1, "train": 2, "report": 1}
+    assert os.path.exists(os.path.join(tmp_path, "model.txt"))
+
+
+def test_condition_disables_dependents(tmp_path):
+    write(tmp_path, "abc")
+    calls = {}
+    results = run_dag(make_stages(tmp_path, calls, lambda text: False),
+                      os.path.join(tmp_path, "cache"))
+    assert results == {"ingest": "abc", "train": None, "report": None}
+    assert calls == {"ingest": 1}
+
+
+def test_uncached_stage_keys_dependents(tmp_path):
+    calls = {}
+    value = {"x": 1}
+
+    def source():
+        return value["x"]
+
+    def double(x):
+        calls["double"] = calls.get("double", 0) + 1
+        return 2 * x
+
+    def stages():
+        return [Stage("source", source, cache=False),
+                Stage("double", double, deps=["source"])]
+
+    cache = os.path.join(tmp_path, "cache")
+    assert run_dag(stages(), cache)["double"] == 2
+    assert run_dag(stages(), cache)["double"] == 2
+    assert calls["double"] == 1
+
+    value["x"] = 5
+    assert run_dag(stages(), cache)["double"] == 10
+    assert calls["double"] == 2
@@ -0,0 +1,176 @@
+'''
+Tests of the content addressed deployment versions
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+import json
+import pytest
+from utils.io import resolve_deployment, DEPLOYMENT_MANIFEST
+from deployment import deploy_artifacts_to_prod, rollback, read_manifest, \
+                       file_sha256
+
+
+@pytest.fixture
+def paths(tmp_path):
+    '''Get model, ingested data and deployment folders with the artifacts
+    of a trained model
+
+    Inputs:
+        tmp_path (pathlib.Path)
+            Scratch directory
+    Outputs:
+        tuple
+            Model, ingested data and deployment paths (strings)
+    '''
+    model_path, data_path = tmp_path / "models", tmp_path / "ingesteddata"
+    model_path.mkdir()
+    data_path.mkdir()
+    write_model(model_path, "model 1")
+    (model_path / "latestscore.txt").write_text("0.5")
+    (model_path / "drift_baseline.json").write_text("{}")
+    (data_path / "ingestedfiles.txt").write_text("['a.csv']")
+    return str(model_path), str(data_path), str(tmp_path / "prod")
+
+
+def write_model(model_path, text):
+    '''Write a stand in for the trained model
+
+    Inputs:
+        model_path (pathlib.Path or string)
+            Path to model directory
+        text (string)
+            Model file contents
+    Outputs:
+        None
+    '''
+    with open(os.path.join(model_path, "trainedmodel.pkl"), "w") as fp:
+        fp.write(text)
+
+
+def live_file(deploy_path, fname):
+    '''Read a file of the live version
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+        fname (string)
+            File name
+    Outputs:
+        string
+            File contents
+    '''
+    with open(os.path.join(resolve_deployment(deploy_path), fname)) as fp:
+        return fp.read()
+
+
+def test_publish(paths):
+    model_path, data_path, deploy_path = paths
+    version = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+
+    manifest = read_manifest(deploy_path)
+    assert manifest["version"] == version
+    assert manifest["history"] == []
+    assert resolve_deployment(deploy_path) == \
+        os.path.join(deploy_path, "versions", version)
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 1"
+    assert sorted(manifest["files"]) == sorted([
+        "trainedmodel.pkl", "latestscore.txt", "ingestedfiles.txt",
+        "drift_baseline.json"])
+    for fname, obj in manifest["files"].items():
+        src = data_path if fname == "ingestedfiles.txt" else model_path
+        assert obj == f"objects/{file_sha256(os.path.join(src, fname))}"
+        assert os.path.exists(os.path.join(deploy_path, obj))
+
+
+def test_identical_artifacts_deduplicated(paths):
+    model_path, data_path, deploy_path = paths
+    first = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    assert deploy_artifacts_to_prod(model_path, data_path, deploy_path) \
+        == first
+    assert read_manifest(deploy_path)["history"] == []
+
+    # Only the changed file is stored again
+    write_model(model_path, "model 2")
+    second = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    assert second != first
+    assert len(os.listdir(os.path.join(deploy_path, "objects"))) == 5
+    baseline = os.path.join(deploy_path, "versions", second,
+                            "drift_baseline.json")
+    assert os.stat(baseline).st_nlink == 3
+
+
+def test_rollback(paths):
+    model_path, data_path, deploy_path = paths
+    with pytest.raises(ValueError):
+        rollback(deploy_path)
+
+    first = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    write_model(model_path, "model 2")
+    second = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 2"
+
+    assert rollback(deploy_path) == first
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 1"
+    assert read_manifest(deploy_path)["history"] == []
+    with pytest.raises(ValueError):
+        rollback(deploy_path)
+
+    assert rollback(deploy_path, second) == second
+    assert read_manifest(deploy_path)["history"] == [first]
+    with pytest.raises(ValueError):
+        rollback(deploy_path, "unknown")
+
+
+def test_legacy_deployment_kept_for_rollback(paths):
+    model_path, data_path, deploy_path = paths
+    os.makedirs(deploy_path)
+    write_model(deploy_path, "legacy model")
+
+    deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    rollback(deploy_path)
+    assert live_file(deploy_path, "trainedmodel.pkl") == "legacy model"
+
+
+def test_half_written_manifest(paths):
+    model_path, data_path, deploy_path = paths
+    first = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    manifest_path = os.path.join(deploy_path, DEPLOYMENT_MANIFEST)
+
+    # A write interrupted before the rename leaves the live version alone
+    with open(f"{manifest_path}.tmp123", "w") as fp:
+        fp.write('{"version": "')
+    assert read_manifest(deploy_path)["version"] == first
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 1"
+
+    # A truncated manifest is replaced by the next deploy
+    with open(manifest_path, "w") as fp:
+        fp.write('{"version": "')
+    assert read_manifest(deploy_path) is None
+    write_model(model_path, "model 2")
+    second = deploy_artifacts_to_prod(model_path, data_path, deploy_path)
+    with open(manifest_path) as fp:
+        assert json.load(fp)["version"] == second
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 2"
+
+
+def test_old_versions_pruned(paths):
+    model_path, data_path, deploy_path = paths
+    versions = []
+    for idx in range(5):
+        write_model(model_path, f"model {idx}")
+        versions.append(deploy_artifacts_to_prod(
+            model_path, data_path, deploy_path, keep_versions=2))
+
+    manifest = read_manifest(deploy_path)
+    assert manifest["version"] == versions[-1]
+    assert manifest["history"] == versions[-3:-1]
+    assert sorted(os.listdir(os.path.join(deploy_path, "versions"))) == \
+        sorted(versions[-3:])
+
+    # 3 model objects plus the 3 unchanged files
+    assert len(os.listdir(os.path.join(deploy_path, "objects"))) == 6
+    rollback(deploy_path)
+    rollback(deploy_path)
+    assert live_file(deploy_path, "trainedmodel.pkl") == "model 2"
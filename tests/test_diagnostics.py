@@ -0,0 +1,86 @@
+'''
+Tests of the offline outdated package check
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import json
+import subprocess
+import pytest
+import diagnostics
+
+
+@pytest.fixture
+def pip_calls(monkeypatch):
+    '''Record the pip calls, every call fails as if the index were
+    unreachable, and start with an empty memo
+
+    Inputs:
+        monkeypatch (pytest.MonkeyPatch)
+            Fixture
+    Outputs:
+        list
+            Arguments of every pip call
+    '''
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(kwargs)
+        return subprocess.CompletedProcess(args, 1, b"", b"unreachable")
+
+    monkeypatch.setattr(diagnostics.subprocess, "run", run)
+    monkeypatch.setattr(diagnostics, "_outdated_cache", {})
+    monkeypatch.setattr(diagnostics, "installed_packages",
+                        lambda: {"numpy": "1.0.0", "pandas": "2.0.0"})
+    return calls
+
+
+def test_offline_uses_snapshot(tmp_path, pip_calls):
+    snapshot = tmp_path / "package_index.json"
+    snapshot.write_text(json.dumps({"NumPy": "2.0.0", "pandas": "2.0.0"}))
+
+    response = diagnostics.outdated_packages_list(str(snapshot))
+    assert response.splitlines()[2].split() == ["numpy", "1.0.0", "2.0.0"]
+    assert len(response.splitlines()) == 3
+    assert pip_calls == []
+
+
+def test_offline_without_snapshot(tmp_path, pip_calls):
+    snapshot = str(tmp_path / "package_index.json")
+    response = diagnostics.outdated_packages_list(snapshot)
+    assert response == "Package index snapshot unavailable\n"
+    assert pip_calls == []
+
+
+def test_failed_rebuild_is_memoized(tmp_path, pip_calls):
+    snapshot = str(tmp_path / "package_index.json")
+    for _ in range(3):
+        response = diagnostics.outdated_packages_list(
+            snapshot, ttl=3600, allow_online=True, timeout=5)
+        assert response == "Package index snapshot unavailable\n"
+    assert len(pip_calls) == 1
+    assert pip_calls[0]["timeout"] == 5
+    assert not (tmp_path / "package_index.json").exists()
+
+    # Retried once the memo expires
+    diagnostics.outdated_packages_list(snapshot, ttl=0, allow_online=True)
+    assert len(pip_calls) == 2
+
+
+def test_failed_rebuild_keeps_stale_snapshot(tmp_path, pip_calls):
+    snapshot = tmp_path / "package_index.json"
+    snapshot.write_text(json.dumps({"numpy": "2.0.0"}))
+
+    response = diagnostics.outdated_packages_list(
+        str(snapshot), allow_online=True, max_age=0)
+    assert "numpy" in response
+    assert len(pip_calls) == 1
+    assert json.loads(snapshot.read_text()) == {"numpy": "2.0.0"}
+
+
+def test_pip_timeout(monkeypatch):
+    def run(args, **kwargs):
+        raise subprocess.TimeoutExpired(args, kwargs["timeout"])
+
+    monkeypatch.setattr(diagnostics.subprocess, "run", run)
+    assert diagnostics.fetch_index_snapshot(timeout=1) is None
@@ -0,0 +1,121 @@
+'''
+Tests of the feature drift statistics
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from utils.io import FEATURES
+from drift import build_baseline, update_baseline, compute_drift, is_drifted
+
+
+def make_data(seed=0, n=5000, shift=0.0):
+    '''Get random feature data
+
+    Inputs:
+        seed (int default = 0)
+            Random seed
+        n (int default = 5000)
+            Number of rows
+        shift (float default = 0.0)
+            Shift of the mean of every feature
+    Outputs:
+        pandas.DataFrame
+            Data
+    '''
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.normal(loc=shift, size=(n, len(FEATURES))),
+                        columns=FEATURES)
+
+
+def reference_drift(x, spec, eps=1e-4):
+    '''Get the PSI and KS statistic of one feature, one value at a time
+
+    Inputs:
+        x (numpy.array)
+            New values of the feature
+        spec (dict)
+            Baseline of the feature
+        eps (float default = 1e-4)
+            Floor applied to bin proportions in the PSI
+    Outputs:
+        tuple
+            PSI and KS statistic
+    '''
+    x = x[~np.isnan(x)]
+    a = np.zeros(len(spec["counts"]))
+    for value in x:
+        a[np.searchsorted(spec["edges"], value, side="right")] += 1
+    a = a / a.sum()
+    e = np.asarray(spec["counts"], dtype=float) / sum(spec["counts"])
+    af, ef = np.maximum(a, eps), np.maximum(e, eps)
+    return (np.sum((af - ef) * np.log(af / ef)),
+            np.max(np.abs(np.cumsum(a) - np.cumsum(e))))
+
+
+def test_baseline_bins():
+    df = make_data()
+    baseline = build_baseline(df)
+    assert baseline["rows"] == len(df)
+    for var in FEATURES:
+        spec = baseline["features"][var]
+        assert len(spec["edges"]) == 9
+        assert len(spec["counts"]) == 10
+        assert sum(spec["counts"]) == len(df)
+
+
+def test_same_distribution_not_drifted():
+    baseline = build_baseline(make_data(seed=0))
+    drift = compute_drift(make_data(seed=1), baseline)
+    assert set(drift) == set(FEATURES)
+    for stats in drift.values():
+        assert stats["psi"] < 0.02
+        assert stats["ks"] < 0.05
+    assert is_drifted(drift) == []
+
+
+def test_shifted_distribution_drifted():
+    baseline = build_baseline(make_data(seed=0))
+    drift = compute_drift(make_data(seed=1, shift=1.0), baseline)
+    assert is_drifted(drift) == FEATURES
+
+
+def test_matches_reference():
+    baseline = build_baseline(make_data(seed=0))
+    df = make_data(seed=1, n=500, shift=0.3)
+    df.iloc[::7, 1] = np.nan
+    drift = compute_drift(df, baseline)
+    for var in FEATURES:
+        psi, ks = reference_drift(df[var].to_numpy(),
+                                  baseline["features"][var])
+        assert drift[var]["psi"] == pytest.approx(psi)
+        assert drift[var]["ks"] == pytest.approx(ks)
+
+
+def test_no_values():
+    baseline = build_baseline(make_data())
+    df = make_data(n=10)
+    df[FEATURES[0]] = np.nan
+    drift = compute_drift(df, baseline)
+    assert np.isnan(drift[FEATURES[0]]["psi"])
+    assert np.isnan(drift[FEATURES[0]]["ks"])
+    assert not np.isnan(drift[FEATURES[1]]["psi"])
+
+    drift = compute_drift(make_data().iloc[:0], baseline)
+    assert all(np.isnan(stats["psi"]) for stats in drift.values())
+
+
+def test_update_baseline():
+    first, second = make_data(seed=0), make_data(seed=1, n=1000)
+    baseline = update_baseline(build_baseline(first), second)
+
+    expected = build_baseline(first)
+    for spec in expected["features"].values():
+        spec["counts"] = [0] * len(spec["counts"])
+    expected["rows"] = 0
+    expected = update_baseline(update_baseline(expected, first), second)
+
+    assert baseline == expected
+    assert baseline["rows"] == len(first) + len(second)
@@ -0,0 +1,65 @@
+'''
+Tests of the cold start import time budgets (import_time_budget in
+config.json) of the orchestrator and the minimal serving entry point
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+from diagnostics import import_time
+from utils.io import read_config, FEATURES
+from utils.linear import LinearScorer
+from utils.artifact import write_artifact
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS = read_config(os.path.join(ROOT, "config.json")).get(
+    "import_time_budget", {})
+
+
+@pytest.fixture
+def deployment(tmp_path, monkeypatch):
+    '''Run the imports against a scratch copy of serve.py and config.json
+    with a NumPy artifact deployment next to them, as serve.py loads the
+    production model from its own folder at import
+
+    Inputs:
+        tmp_path (pathlib.Path)
+            Scratch directory
+        monkeypatch (pytest.MonkeyPatch)
+            Sets the working directory and PYTHONPATH
+    Outputs:
+        pathlib.Path
+            Scratch directory
+    '''
+    for fname in ["serve.py", "config.json"]:
+        shutil.copyfile(os.path.join(ROOT, fname), tmp_path / fname)
+    prod_path = tmp_path / read_config(
+        os.path.join(ROOT, "config.json"))["prod_deployment_path"]
+    prod_path.mkdir()
+    write_artifact(LinearScorer([0.1, -0.2, 0.3], 0.5, FEATURES), prod_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(tmp_path), ROOT]))
+    return tmp_path
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_import_time_within_budget(deployment, module):
+    assert import_time(module) <= BUDGETS[module]
+
+
+@pytest.mark.parametrize("module", ["fullprocess", "serve"])
+def test_no_heavy_imports(deployment, module):
+    heavy = ["sklearn", "matplotlib"] + \
+        (["pandas"] if module == "fullprocess" else [])
+    result = subprocess.run(
+        [sys.executable, "-c",
+         f"import sys, {module}; "
+         f"print([m for m in {heavy} if m in sys.modules])"],
+        capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,77 @@
+'''
+Tests of the NumPy logistic regression scorer
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from utils.io import FEATURES
+from utils.linear import LinearScorer
+
+
+def synthetic_data(labels, n=200, seed=0):
+    '''Get random features labelled by a noisy linear rule
+
+    Inputs:
+        labels (tuple)
+            Negative and positive class labels
+        n (int default = 200)
+            Number of records
+        seed (int default = 0)
+            Random seed
+    Outputs:
+        tuple
+            Features (pandas.DataFrame), labels (numpy.array)
+    '''
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, len(FEATURES))), columns=FEATURES)
+    y = np.where(X.to_numpy() @ [1.0, -2.0, 0.5] +
+                 rng.normal(scale=0.5, size=n) > 0, labels[1], labels[0])
+    return X, y
+
+
+@pytest.mark.parametrize("labels", [(0, 1), (2, 5), ("stay", "exit")])
+def test_matches_sklearn(labels):
+    X, y = synthetic_data(labels)
+    lr = LogisticRegression().fit(X, y)
+    scorer = LinearScorer.from_model(lr, FEATURES)
+
+    assert np.array_equal(scorer.predict(X), lr.predict(X))
+    assert np.allclose(scorer.predict_proba(X), lr.predict_proba(X))
+    assert np.allclose(scorer.decision_function(X),
+                       lr.decision_function(X))
+
+    labels, proba = scorer.score(X)
+    assert np.array_equal(labels, lr.predict(X))
+    assert np.allclose(proba, lr.predict_proba(X)[:, 1])
+
+
+def test_tie_at_half_matches_sklearn():
+    X, y = synthetic_data(("stay", "exit"))
+    lr = LogisticRegression().fit(X, y)
+
+    # Rows exactly on the decision boundary have probability 0.5
+    lr.coef_ = np.array([[1.0, -1.0, 0.5]])
+    lr.intercept_ = np.array([-0.5])
+    X_tie = pd.DataFrame([[2.0, 2.0, 1.0], [0.0, 0.5, 2.0]],
+                         columns=FEATURES)
+    assert np.all(lr.decision_function(X_tie) == 0)
+
+    scorer = LinearScorer.from_model(lr, FEATURES)
+    assert np.array_equal(scorer.predict(X_tie), lr.predict(X_tie))
+    assert np.array_equal(scorer.predict(X_tie), [lr.classes_[0]] * 2)
+    assert np.allclose(scorer.predict_proba(X_tie), 0.5)
+
+
+def test_reorders_dataframe_columns():
+    X, y = synthetic_data((0, 1))
+    lr = LogisticRegression().fit(X, y)
+    scorer = LinearScorer.from_model(lr, FEATURES)
+
+    shuffled = X[FEATURES[::-1]]
+    assert np.array_equal(scorer.predict(shuffled), lr.predict(X))
+    assert np.allclose(scorer.predict_proba(X.to_numpy()),
+                       lr.predict_proba(X))
@@ -0,0 +1,52 @@
+'''
+Tests of the confusion count based metrics
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import confusion_matrix, f1_score
+from utils.io import FEATURES, LABEL
+from utils.linear import LinearScorer
+from utils.metrics import confusion_counts, f1_from_counts, score_chunks
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_sklearn(seed):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, size=100)
+    y_pred = rng.integers(0, 2, size=100)
+
+    cm = confusion_counts(y, y_pred)
+    assert np.array_equal(cm, confusion_matrix(y, y_pred, labels=[0, 1]))
+    assert f1_from_counts(cm) == pytest.approx(f1_score(y, y_pred))
+
+
+@pytest.mark.parametrize("y, y_pred", [
+    ([0, 0, 0], [0, 0, 0]),
+    ([1, 1], [1, 1]),
+    ([1, 0], [0, 1]),
+    ([], []),
+])
+def test_edge_cases_match_sklearn(y, y_pred):
+    cm = confusion_counts(y, y_pred)
+    assert cm.shape == (2, 2)
+    assert cm.sum() == len(y)
+    if len(y):
+        assert f1_from_counts(cm) == f1_score(y, y_pred, zero_division=0)
+    else:
+        assert f1_from_counts(cm) == 0.0
+
+
+def test_score_chunks_matches_whole():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(250, len(FEATURES))),
+                      columns=FEATURES)
+    df[LABEL] = rng.integers(0, 2, size=len(df))
+    lr = LinearScorer([1.0, -0.5, 0.25], 0.1, FEATURES)
+
+    chunks = [df.iloc[i:i + 40] for i in range(0, len(df), 40)]
+    assert np.array_equal(score_chunks(chunks, lr),
+                          confusion_counts(df[LABEL], lr.predict(df)))
@@ -0,0 +1,57 @@
+'''
+Tests of the batch prediction payload decoding
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import json
+import numpy as np
+import pytest
+from utils.io import FEATURES
+from utils.payload import decode_batch, JSON_TYPE, BINARY_TYPE
+
+
+ROWS = [[1, 2, 3], [4.5, 0, 10]]
+
+
+@pytest.mark.parametrize("data", [
+    ROWS,
+    [dict(zip(FEATURES, row)) for row in ROWS],
+    {f: [row[i] for row in ROWS] for i, f in enumerate(FEATURES)},
+])
+def test_json_layouts(data):
+    df = decode_batch(json.dumps(data).encode("utf-8"), JSON_TYPE)
+    assert list(df.columns) == FEATURES
+    assert (df.dtypes == np.float64).all()
+    assert df.to_numpy().tolist() == ROWS
+
+
+def test_binary():
+    body = np.array(ROWS, dtype="<f8").tobytes()
+    df = decode_batch(body, BINARY_TYPE + "; charset=binary")
+    assert df.to_numpy().tolist() == ROWS
+
+
+@pytest.mark.parametrize("body", [
+    b"5", b'"rows"', b"null", b"[1, 2, 3]", b"[[1, 2]]",
+    b'[[1, "a", 3]]', b"[[1, NaN, 3]]", b"[[1, Infinity, 3]]",
+    b'[{"lastmonth_activity": 1, "lastyear_activity": null,'
+    b' "number_of_employees": 3}]',
+    b'[[1, 2, 3], {"lastmonth_activity": 1}]', b"{not json",
+])
+def test_invalid_json_raises_value_error(body):
+    with pytest.raises(ValueError):
+        decode_batch(body, JSON_TYPE)
+
+
+def test_invalid_binary_raises_value_error():
+    with pytest.raises(ValueError):
+        decode_batch(b"\x00" * 20, BINARY_TYPE)
+    with pytest.raises(ValueError):
+        decode_batch(np.array([1, np.nan, 3], dtype="<f8").tobytes(),
+                     BINARY_TYPE)
+
+
+def test_unsupported_content_type():
+    with pytest.raises(ValueError, match="Unsupported content type"):
+        decode_batch(b"1,2,3", "text/csv")
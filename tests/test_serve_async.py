@@ -0,0 +1,71 @@
+'''
+Tests of the asynchronous serving entry point run without lifespan events
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import json
+import asyncio
+import serve_async
+
+
+async def call(scope, body=b""):
+    '''Call the ASGI app and collect what it sends
+
+    Inputs:
+        scope (dict)
+            ASGI connection scope
+        body (bytes default = b"")
+            Request body
+    Outputs:
+        list
+            Messages sent by the app
+    '''
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    try:
+        await serve_async.app(scope, receive, send)
+    finally:
+        await serve_async.batcher.stop()
+    return sent
+
+
+def http_scope(method="POST", path="/prediction"):
+    '''Get an HTTP connection scope
+
+    Inputs:
+        method (string default = "POST")
+            HTTP method
+        path (string default = "/prediction")
+            Request path
+    Outputs:
+        dict
+            ASGI connection scope
+    '''
+    return {"type": "http", "method": method, "path": path,
+            "headers": [(b"content-type", b"application/json")]}
+
+
+def test_prediction_without_lifespan():
+    body = json.dumps([[10, 20, 30], [1, 2, 3]]).encode("utf-8")
+    sent = asyncio.run(call(http_scope(), body))
+    assert sent[0]["status"] == 200
+    result = json.loads(sent[1]["body"])
+    assert len(result["predictions"]) == len(result["probabilities"]) == 2
+
+
+def test_bad_requests():
+    assert asyncio.run(call(http_scope("GET")))[0]["status"] == 404
+    sent = asyncio.run(call(http_scope(), b"3"))
+    assert sent[0]["status"] == 400
+
+
+def test_other_scopes_ignored():
+    assert asyncio.run(call({"type": "websocket", "path": "/prediction"})) \
+        == []
@@ -0,0 +1,117 @@
+'''
+Tests of the mergeable summary statistics
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from utils.stats import RunningMoments, TDigest, SummaryAccumulator
+
+
+def sample(seed=0, n=10000):
+    '''Get normal values with some missing
+
+    Inputs:
+        seed (int default = 0)
+            Random seed
+        n (int default = 10000)
+            Number of rows
+    Outputs:
+        numpy.array
+            2D float array with 3 columns
+    '''
+    rng = np.random.default_rng(seed)
+    X = rng.normal(loc=[0, 10, -5], scale=[1, 3, 0.5], size=(n, 3))
+    X[rng.random(X.shape) < 0.05] = np.nan
+    return X
+
+
+def test_moments_match_numpy():
+    X = sample()
+    moments = RunningMoments(3)
+    for chunk in np.array_split(X, 7):
+        moments.update(chunk)
+
+    assert np.array_equal(moments.count, (~np.isnan(X)).sum(axis=0))
+    assert np.allclose(moments.mean, np.nanmean(X, axis=0))
+    assert np.allclose(moments.variance(), np.nanvar(X, axis=0, ddof=1))
+
+
+def test_moments_merge_matches_single_update():
+    X = sample()
+    whole = RunningMoments(3)
+    whole.update(X)
+
+    merged = RunningMoments(3)
+    for chunk in np.array_split(X, 4):
+        part = RunningMoments(3)
+        part.update(chunk)
+        merged.merge(part)
+
+    assert np.allclose(merged.count, whole.count)
+    assert np.allclose(merged.mean, whole.mean)
+    assert np.allclose(merged.variance(), whole.variance())
+
+
+def test_moments_too_few_values():
+    moments = RunningMoments(2)
+    moments.update(np.array([[1.0, np.nan]]))
+    assert np.isnan(moments.variance()).all()
+    assert moments.mean[0] == 1.0
+
+
+@pytest.mark.parametrize("chunks", [1, 10])
+def test_digest_quantiles(chunks):
+    values = sample()[:, 1]
+    digest = TDigest()
+    for chunk in np.array_split(values, chunks):
+        digest.update(chunk)
+
+    q = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+    expected = np.nanquantile(values, q)
+    assert np.allclose(digest.quantile(q), expected, atol=0.05 * 3)
+    assert digest.quantile(0.0) == np.nanmin(values)
+    assert digest.quantile(1.0) == np.nanmax(values)
+    assert len(digest.means) <= 2 * digest.compression
+
+
+def test_digest_merge():
+    values = sample()[:, 0]
+    merged = TDigest()
+    for chunk in np.array_split(values, 5):
+        part = TDigest()
+        part.update(chunk)
+        merged.merge(part)
+
+    assert merged.weights.sum() == (~np.isnan(values)).sum()
+    assert (merged.min, merged.max) == (np.nanmin(values), np.nanmax(values))
+    assert np.allclose(merged.quantile([0.1, 0.5, 0.9]),
+                       np.nanquantile(values, [0.1, 0.5, 0.9]), atol=0.05)
+
+
+def test_digest_empty():
+    digest = TDigest()
+    digest.update(np.array([np.nan]))
+    digest.merge(TDigest())
+    assert np.isnan(digest.quantile(0.5))
+    assert np.isnan(digest.quantile([0.1, 0.9])).all()
+
+
+def test_accumulator_round_trip(tmp_path):
+    df = pd.DataFrame(sample(n=1000), columns=["a", "b", "c"])
+    df["name"] = "x"
+    acc = SummaryAccumulator()
+    for start in range(0, len(df), 400):
+        acc.update(df.iloc[start:start + 400])
+
+    acc.save(tmp_path / "acc.json")
+    loaded = SummaryAccumulator.load(tmp_path / "acc.json")
+
+    assert loaded.numeric == ["a", "b", "c"]
+    assert loaded.summary() == acc.summary()
+    assert loaded.missing() == acc.missing()
+    assert loaded.missing() == list(df.isnull().mean())
+    assert acc.summary()["b"]["mean"] == pytest.approx(df["b"].mean())
+    assert acc.summary()["b"]["std"] == pytest.approx(df["b"].std())
@@ -0,0 +1,53 @@
+'''
+Tests of the incremental training mode
+
+Author: Christopher Bonham
+Date: 19th February 2023
+'''
+import os
+import numpy as np
+import pandas as pd
+from utils.io import write_data, FEATURES, LABEL
+from training import train_model_incremental, INCREMENTAL_STATE
+
+
+def ingested(path, n, seed=0):
+    '''Write ingested data in the layout of ingestion.ingest_data
+
+    Inputs:
+        path (pathlib.Path)
+            Path to the ingested data
+        n (int)
+            Number of rows
+        seed (int default = 0)
+            Random seed
+    Outputs:
+        None
+    '''
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.integers(0, 1000, size=(n, len(FEATURES))),
+                      columns=FEATURES)
+    df[LABEL] = (df[FEATURES[0]] > 500).astype(int)
+    df.insert(0, "corporation", [f"c{i}" for i in range(n)])
+    path.mkdir()
+    write_data(df, str(path), "finaldata")
+
+
+def test_no_rows_and_no_state(tmp_path):
+    ingested(tmp_path / "data", 0)
+    model_path = tmp_path / "models"
+
+    assert train_model_incremental(str(tmp_path / "data"),
+                                   str(model_path)) is None
+    assert not model_path.exists()
+
+
+def test_no_new_rows_resumes(tmp_path):
+    ingested(tmp_path / "data", 200)
+    model_path = str(tmp_path / "models")
+
+    first = train_model_incremental(str(tmp_path / "data"), model_path)
+    assert os.path.exists(os.path.join(model_path, INCREMENTAL_STATE))
+    second = train_model_incremental(str(tmp_path / "data"), model_path)
+    assert np.array_equal(first.coef, second.coef)
+    assert np.array_equal(first.intercept, second.intercept)
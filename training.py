@@ -6,10 +6,23 @@ Date: 16th February 2023
 '''
 import pandas as pd
 import os
+import hashlib
+import datetime
 import logging
 import pickle
-from utils.io import read_config
-from sklearn.linear_model import LogisticRegression
+import numpy as np
+import json
+from utils.io import read_config, read_data, iter_data, FEATURES, LABEL
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, \
+                                    StratifiedKFold
+from drift import build_baseline, update_baseline, write_baseline, \
+                  load_baseline
+from ingestion import load_row_index
+from utils.linear import LinearScorer
+from utils.artifact import write_artifact
+from utils.metrics import confusion_counts, f1_from_counts
 
 
 # Create a logger
@@ -17,11 +30,19 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
-def load_training_data(in_path):
+# State of the incrementally trained model
+INCREMENTAL_STATE = "incremental_state.pkl"
+
+
+def load_training_data(in_path, data_format="csv", columns=None):
     '''Load training data to dataframe
     Inputs:
         in_path (string)
             Path to training data
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        columns (list default = None)
+            Columns to load, None loads all of them
 
     Outputs:
         pandas.dataframe
@@ -30,50 +51,330 @@ def load_training_data(in_path):
     logger.info(f"training.py: Input folder path: {in_path}")
 
     # Load training data
-    df = pd.read_csv(os.path.join(in_path, "finaldata.csv"))
+    df = read_data(in_path, "finaldata", data_format, columns)
     logger.info(f"training.py: Training data shape: {df.shape}")
 
     return df
 
 
-def train_model(df, out_path):
-    '''Train logistic regression model and pickle model file
+def data_fingerprint(df):
+    '''Get a fingerprint of the training data contents
+
+    Inputs:
+        df (pandas.dataframe)
+            Training data
+    Outputs:
+        string
+            sha256 of the row hashes of the features and label
+    '''
+    hashes = pd.util.hash_pandas_object(df[FEATURES + [LABEL]], index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+
+def build_model(params=None):
+    '''Instantiate the logistic regression model
+
+    Inputs:
+        params (dict default = None)
+            Hyperparameters overriding the defaults e.g. {"C": 0.1}
+    Outputs:
+        sklearn.linear_model._logistic.LogisticRegression
+            Unfitted model
+    '''
+    return LogisticRegression(
+        C=1.0, class_weight=None, dual=False, fit_intercept=True,
+        intercept_scaling=1, l1_ratio=None, max_iter=100,
+        multi_class='auto', n_jobs=None, penalty='l2',
+        random_state=0, solver='liblinear', tol=0.0001, verbose=0,
+        warm_start=False
+    ).set_params(**(params or {}))
+
+
+def train_model(df, out_path, params=None):
+    '''Train logistic regression model, write the checksummed model
+    artifact (checked to match the model predictions) and pickle model
+    file and write the feature drift baseline
 
     Inputs:
         df (pandas.dataframe)
             Training data
         out_path (string)
             Path to store the pickled model artifact
+        params (dict default = None)
+            Hyperparameters overriding the defaults (see build_model)
     Outputs:
-        None
+        sklearn.linear_model._logistic.LogisticRegression
+            Trained model
     '''
     # Extract labels and features
-    y = df["exited"]
-    X = df[["lastmonth_activity", "lastyear_activity", "number_of_employees"]]
+    y = df[LABEL]
+    X = df[FEATURES]
     logger.info(f"training.py: y shape: {y.shape}")
     logger.info(f"training.py: X shape: {X.shape}")
 
     # Instantiate a Logistic regression model object
-    lr = LogisticRegression(
-        C=1.0, class_weight=None, dual=False, fit_intercept=True,
-        intercept_scaling=1, l1_ratio=None, max_iter=100,
-        multi_class='auto', n_jobs=None, penalty='l2',
-        random_state=0, solver='liblinear', tol=0.0001, verbose=0,
-        warm_start=False
-    )
+    lr = build_model(params)
 
     # Fit the logistic regression to your data
     lr.fit(X, y)
 
-    # Write trained model to pkl file
+    # Export the NumPy scorer, it must give the same labels as the model
+    scorer = LinearScorer.from_model(lr, FEATURES)
+    y_pred = lr.predict(X)
+    if not np.array_equal(scorer.predict(X), y_pred):
+        raise ValueError("training.py: Exported linear model predictions "
+                         "do not match the trained model")
+
+    # Write the checksummed model artifact and the trained model pkl file
+    # NB the pkl is written last as readers watch it for changes
     # Create output directory if it doesnt exist
     if not os.path.exists(out_path):
         os.makedirs(out_path)
+    metadata = {
+        "training_data_fingerprint": data_fingerprint(df),
+        "train_f1": f1_from_counts(confusion_counts(y, y_pred)),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    fpath = write_artifact(scorer, out_path, metadata)
+    logger.info(f"training.py: Model artifact written to {fpath}")
     with open(os.path.join(out_path, "trainedmodel.pkl"), 'wb') as fp:
         pickle.dump(lr, fp)
     logger.info(f"training.py: Trained model written to "
                 f"{os.path.join(out_path, 'trainedmodel.pkl')}")
 
+    # Write the feature baseline used to monitor drift
+    write_baseline(build_baseline(X), out_path)
+
+    return lr
+
+
+def load_incremental_state(out_path):
+    '''Load the state of the incrementally trained model
+
+    Inputs:
+        out_path (string)
+            Path to model directory
+    Outputs:
+        dict
+            State or None if no incremental model has been trained
+    '''
+    fpath = os.path.join(out_path, INCREMENTAL_STATE)
+    if not os.path.exists(fpath):
+        return None
+    with open(fpath, "rb") as fp:
+        return pickle.load(fp)
+
+
+def fold_scaler(sgd, scaler):
+    '''Fold the feature standardisation into the model coefficients so
+    the model scores the raw features
+
+    Inputs:
+        sgd (sklearn.linear_model.SGDClassifier)
+            Model fitted on the standardised features
+        scaler (sklearn.preprocessing.StandardScaler)
+            Feature scaler
+    Outputs:
+        utils.linear.LinearScorer
+            Model on the raw features
+    '''
+    coef = sgd.coef_.ravel() / scaler.scale_
+    intercept = sgd.intercept_[0] - np.dot(coef, scaler.mean_)
+    return LinearScorer(coef, intercept, FEATURES, sgd.classes_)
+
+
+def train_model_incremental(in_path, out_path, data_format="csv",
+                            chunksize=100000, alpha=0.0001):
+    '''Update an SGD logistic regression model with only the rows
+    ingested since it was last trained, streamed in chunks. The feature
+    scaler is updated with each chunk and folded into the exported
+    coefficients
+
+    The rows already trained on are identified by the ingested row hash
+    index, if they are no longer a prefix of it (e.g. the data was
+    re-ingested from scratch) the model is retrained over all the rows,
+    still in chunks
+
+    Inputs:
+        in_path (string)
+            Path to the ingested data
+        out_path (string)
+            Path to model directory
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        chunksize (int default = 100000)
+            Maximum rows per chunk
+        alpha (float default = 0.0001)
+            L2 regularisation strength
+    Outputs:
+        utils.linear.LinearScorer
+            Trained model, None if there are no rows to train on
+    '''
+    row_index = load_row_index(in_path, data_format)
+
+    # Resume from the previous state if its rows are still the prefix of
+    # the ingested data
+    state = load_incremental_state(out_path)
+    if state is not None and state["rows"] <= len(row_index) and \
+            state["prefix_sha256"] == hashlib.sha256(
+                row_index[:state["rows"]].tobytes()).hexdigest():
+        sgd, scaler, start = state["model"], state["scaler"], state["rows"]
+        baseline = load_baseline(out_path)
+    else:
+        logger.info("training.py: No incremental model to resume, "
+                    "training over all rows")
+        sgd = SGDClassifier(loss="log_loss", alpha=alpha, random_state=0)
+        scaler, start, baseline = StandardScaler(), 0, None
+    logger.info(f"training.py: Rows already trained on: {start}, "
+                f"new rows: {len(row_index) - start}")
+    if start == len(row_index):
+        # NB without rows to resume from the model was never fitted
+        if start == 0:
+            logger.info("training.py: No ingested rows to train on")
+            return None
+        return fold_scaler(sgd, scaler)
+
+    # Update the scaler, model and feature baseline chunk by chunk
+    # skipping the rows already trained on
+    cm = np.zeros((2, 2), dtype=np.int64)
+    offset = 0
+    for chunk in iter_data(in_path, "finaldata", data_format, chunksize,
+                           FEATURES + [LABEL]):
+        offset += len(chunk)
+        if offset <= start:
+            continue
+        chunk = chunk.iloc[max(start - offset + len(chunk), 0):]
+        X, y = chunk[FEATURES].to_numpy(dtype=np.float64), chunk[LABEL]
+        scaler.partial_fit(X)
+        sgd.partial_fit(scaler.transform(X), y, classes=np.array([0, 1]))
+        cm += confusion_counts(y, sgd.predict(scaler.transform(X)))
+        baseline = build_baseline(chunk) if baseline is None \
+            else update_baseline(baseline, chunk)
+
+    # Write the model artifact, pkl file and feature baseline
+    scorer = fold_scaler(sgd, scaler)
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    scorer.metadata = {
+        "training_data_fingerprint": hashlib.sha256(
+            row_index.tobytes()).hexdigest(),
+        "train_f1": f1_from_counts(cm),
+        "training_rows": len(row_index),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    fpath = write_artifact(scorer, out_path, scorer.metadata)
+    logger.info(f"training.py: Model artifact written to {fpath}")
+    with open(os.path.join(out_path, INCREMENTAL_STATE), "wb") as fp:
+        pickle.dump({
+            "model": sgd,
+            "scaler": scaler,
+            "rows": len(row_index),
+            "prefix_sha256": scorer.metadata["training_data_fingerprint"],
+        }, fp)
+    with open(os.path.join(out_path, "trainedmodel.pkl"), 'wb') as fp:
+        pickle.dump(scorer, fp)
+    logger.info(f"training.py: Trained model written to "
+                f"{os.path.join(out_path, 'trainedmodel.pkl')}")
+    write_baseline(baseline, out_path)
+
+    return scorer
+
+
+def compare_with_full_refit(model, train_df, test_df, out_path=None):
+    '''Get the validation F1 of a model and of a full refit on all the
+    training data
+
+    Inputs:
+        model (utils.linear.LinearScorer)
+            Trained model
+        train_df (pandas.dataframe)
+            Training data
+        test_df (pandas.dataframe)
+            Validation data
+        out_path (string default = None)
+            Path to write training_validation.json, None does not write it
+    Outputs:
+        dict
+            Validation F1 of the model and of the full refit
+    '''
+    lr = build_model().fit(train_df[FEATURES], train_df[LABEL])
+    y = test_df[LABEL]
+    validation = {
+        "validation_f1": f1_from_counts(
+            confusion_counts(y, model.predict(test_df[FEATURES]))),
+        "full_refit_validation_f1": f1_from_counts(
+            confusion_counts(y, lr.predict(test_df[FEATURES]))),
+    }
+    logger.info(f"training.py: Validation {validation}")
+
+    if out_path is not None:
+        with open(os.path.join(out_path, "training_validation.json"),
+                  "w") as fp:
+            json.dump(validation, fp, indent=2)
+    return validation
+
+
+def search_model(df, out_path, grid, search="grid", n_iter=10, cv=5,
+                 n_jobs=-1):
+    '''Cross validate a grid (or random sample) of hyperparameter
+    candidates across a process pool, record the per candidate timings and
+    scores to search_results.csv and train the best candidate by F1
+
+    Inputs:
+        df (pandas.dataframe)
+            Training data
+        out_path (string)
+            Path to store the model artifacts and search results
+        grid (dict)
+            Candidate values of each hyperparameter e.g.
+            {"C": [0.1, 1.0], "penalty": ["l1", "l2"]}
+        search (string default = "grid")
+            "grid" tries every candidate, "random" samples n_iter of them
+        n_iter (int default = 10)
+            Number of candidates sampled by a random search
+        cv (int default = 5)
+            Number of folds, reduced to the size of the smallest class
+        n_jobs (int default = -1)
+            Number of worker processes, -1 uses every core
+    Outputs:
+        sklearn.linear_model._logistic.LogisticRegression
+            Trained model
+    '''
+    # Each class must be in every fold
+    cv = min(cv, df[LABEL].value_counts().min())
+    if cv < 2:
+        logger.info("training.py: Too few rows of each class to cross "
+                    "validate, training the default model")
+        return train_model(df, out_path)
+
+    # Cross validate the candidates
+    if search == "random":
+        searcher = RandomizedSearchCV(
+            build_model(), grid, n_iter=n_iter, scoring="f1",
+            cv=StratifiedKFold(cv), n_jobs=n_jobs, refit=False,
+            random_state=0
+        )
+    else:
+        searcher = GridSearchCV(
+            build_model(), grid, scoring="f1", cv=StratifiedKFold(cv),
+            n_jobs=n_jobs, refit=False
+        )
+    searcher.fit(df[FEATURES], df[LABEL])
+
+    # Record the timings and scores of every candidate
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    results = pd.DataFrame(searcher.cv_results_)[[
+        "params", "mean_fit_time", "std_fit_time", "mean_score_time",
+        "mean_test_score", "std_test_score", "rank_test_score"
+    ]].sort_values("rank_test_score")
+    results.to_csv(os.path.join(out_path, "search_results.csv"), index=False)
+    logger.info(f"training.py: {len(results)} candidates searched, best "
+                f"{searcher.best_params_} f1 {searcher.best_score_}")
+
+    # Refit the best candidate on all the data
+    return train_model(df, out_path, searcher.best_params_)
+
 
 def main():
     '''Main functionality call
@@ -88,11 +389,47 @@ def main():
     # config = read_config(r".\config.json", display = True)
     logger.info("training.py: Configuration file read")
 
+    # Update the model with the new rows only
+    in_path = os.path.join(os.getcwd(), config["output_folder_path"])
+    out_path = os.path.join(os.getcwd(), config["output_model_path"])
+    data_format = config.get("data_format", "csv")
+    if config.get("training_mode", "full") == "incremental":
+        model = train_model_incremental(
+            in_path, out_path, data_format,
+            config.get("training_chunksize", 100000)
+        )
+
+        # Report the validation F1 against a full refit
+        if model is not None and config.get("training_compare_full",
+                                            False):
+            compare_with_full_refit(
+                model,
+                load_training_data(in_path, data_format, FEATURES + [LABEL]),
+                read_data(os.path.join(os.getcwd(),
+                                       config["test_data_path"]),
+                          "testdata", data_format, FEATURES + [LABEL]),
+                out_path
+            )
+        return
+
     # Load the trainiing data
     df = load_training_data(
-        os.path.join(os.getcwd(), config["output_folder_path"])
+        os.path.join(os.getcwd(), config["output_folder_path"]),
+        config.get("data_format", "csv"),
+        FEATURES + [LABEL]
     )
 
+    # Train the best model from a hyperparameter search
+    if config.get("training_mode", "full") == "search":
+        search_model(
+            df, out_path, config["search_grid"],
+            config.get("search_type", "grid"),
+            config.get("search_iter", 10),
+            config.get("search_cv", 5),
+            config.get("search_workers", -1)
+        )
+        return
+
     # Train the model
     train_model(
         df,
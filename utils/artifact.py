@@ -0,0 +1,162 @@
+'''
+Safe, memory mappable model artifact format (trainedmodel.lrm)
+
+Layout
+    8 bytes     magic b"LRMODEL\x00"
+    4 bytes     header length (little endian uint32)
+    header      JSON, format version, features, classes, payload dtype,
+                size and sha256 checksum plus the model metadata
+    padding     to a 64 byte boundary
+    payload     float64 coefficients followed by the intercept
+
+The checksum covers the header (as canonical JSON without the checksum
+field) and the payload, so a corrupted feature order or class label is
+detected as well as a corrupted coefficient. Loading never unpickles
+anything, the payload is memory mapped and the checksum is verified
+before the model is used
+
+Author: Christopher Bonham
+Date: 16th February 2023
+'''
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+from utils.linear import LinearScorer
+
+
+# Artifact file name, magic bytes and format version
+ARTIFACT_NAME = "trainedmodel.lrm"
+MAGIC = b"LRMODEL\x00"
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+
+
+def _payload_offset(header_len):
+    '''Get the offset of the payload, aligned so it can be memory mapped
+
+    Inputs:
+        header_len (int)
+            Length of the JSON header in bytes
+    Outputs:
+        int
+            Payload offset in bytes
+    '''
+    end = len(MAGIC) + 4 + header_len
+    return -(-end // ALIGNMENT) * ALIGNMENT
+
+
+def artifact_digest(header, payload):
+    '''Get the checksum of an artifact
+
+    Inputs:
+        header (dict)
+            Header, its sha256 field is ignored
+        payload (bytes)
+            Payload
+    Outputs:
+        string
+            sha256 of the canonical header JSON followed by the payload
+    '''
+    fields = {k: v for k, v in header.items() if k != "sha256"}
+    sha = hashlib.sha256(json.dumps(fields, sort_keys=True,
+                                    separators=(",", ":")).encode("utf-8"))
+    sha.update(payload)
+    return sha.hexdigest()
+
+
+def write_artifact(scorer, out_path, metadata=None):
+    '''Write a linear model artifact, atomically replacing any existing one
+
+    Inputs:
+        scorer (utils.linear.LinearScorer)
+            Model to write
+        out_path (string)
+            Path to model directory
+        metadata (dict default = None)
+            Model metadata e.g. training data fingerprint, F1, created
+    Outputs:
+        string
+            Path to artifact
+    '''
+    payload = np.concatenate([scorer.coef.ravel(), scorer.intercept]) \
+        .astype("<f8").tobytes()
+    header = {
+        "format_version": FORMAT_VERSION,
+        "features": scorer.features,
+        "classes": scorer.classes.tolist(),
+        "dtype": "<f8",
+        "n_values": len(scorer.features) + 1,
+        "metadata": metadata or {},
+    }
+    header["sha256"] = artifact_digest(header, payload)
+    header = json.dumps(header).encode("utf-8")
+
+    offset = _payload_offset(len(header))
+    fpath = os.path.join(out_path, ARTIFACT_NAME)
+    tmp = f"{fpath}.tmp{os.getpid()}"
+    with open(tmp, "wb") as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack("<I", len(header)))
+        fp.write(header)
+        fp.write(b"\x00" * (offset - len(MAGIC) - 4 - len(header)))
+        fp.write(payload)
+    os.replace(tmp, fpath)
+
+    return fpath
+
+
+def read_header(fpath):
+    '''Read the header of a linear model artifact
+
+    Inputs:
+        fpath (string)
+            Path to artifact
+    Outputs:
+        tuple
+            Header (dict) and payload offset in bytes
+    '''
+    with open(fpath, "rb") as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{fpath} is not a linear model artifact")
+        (header_len,) = struct.unpack("<I", fp.read(4))
+        header = json.loads(fp.read(header_len).decode("utf-8"))
+
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version: "
+                         f"{header.get('format_version')}")
+    return header, _payload_offset(header_len)
+
+
+def read_artifact(in_path, verify=True, mmap=True):
+    '''Load a linear model artifact, memory mapping the payload
+
+    Inputs:
+        in_path (string)
+            Path to model directory
+        verify (boolean default = True)
+            Verify the checksum
+        mmap (boolean default = True)
+            Memory map the payload, otherwise it is read into memory
+    Outputs:
+        utils.linear.LinearScorer
+            Model, its metadata is set as the metadata attribute
+    '''
+    fpath = os.path.join(in_path, ARTIFACT_NAME)
+    header, offset = read_header(fpath)
+    if mmap:
+        values = np.memmap(fpath, dtype=header["dtype"], mode="r",
+                           offset=offset, shape=(header["n_values"],))
+    else:
+        values = np.fromfile(fpath, dtype=header["dtype"],
+                             count=header["n_values"], offset=offset)
+
+    if verify:
+        if artifact_digest(header, values.tobytes()) != header["sha256"]:
+            raise ValueError(f"Checksum mismatch, {fpath} is corrupt")
+
+    scorer = LinearScorer(values[:-1], values[-1], header["features"],
+                          header["classes"])
+    scorer.metadata = header["metadata"]
+    return scorer
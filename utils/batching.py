@@ -0,0 +1,157 @@
+'''
+Asyncio micro-batching of concurrent prediction requests
+
+Requests arriving within a short window (or until a maximum number of
+rows is queued) are stacked into one array, scored with a single
+vectorised model call and the results are split back to each request.
+The model call runs in the event loop's default executor so scoring (and
+any model reload it triggers) never blocks the loop from accepting and
+queueing further requests
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import asyncio
+import logging
+import numpy as np
+
+
+# Get the logger
+logger = logging.getLogger()
+
+
+class MicroBatcher:
+    '''Gather the rows of concurrent requests and score them together
+
+    A request is never split across batches, so a single request larger
+    than max_batch_size is scored as a batch of its own
+    '''
+
+    def __init__(self, score, max_batch_size=256, window=0.002):
+        '''
+        Inputs:
+            score (callable)
+                Scores a 2D float array, returns the predicted labels and
+                positive class probabilities. It is called in a worker
+                thread so must be thread safe
+            max_batch_size (int default = 256)
+                Maximum number of rows per batch
+            window (float default = 0.002)
+                Seconds to wait for more requests after the first one
+        '''
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._queue = None
+        self._task = None
+        self._pending = None
+
+    def start(self):
+        '''Start the batching task on the running event loop
+
+        Inputs:
+            None
+        Outputs:
+            None
+        '''
+        self._queue = asyncio.Queue()
+        self._pending = None
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        '''Stop the batching task
+
+        Inputs:
+            None
+        Outputs:
+            None
+        '''
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, X):
+        '''Queue rows to score and wait for their results, the batching
+        task is started first if it is not running (e.g. the server does
+        not send lifespan events)
+
+        Inputs:
+            X (numpy.array)
+                2D float array of features in model order
+        Outputs:
+            tuple
+                Predicted labels, positive class probabilities
+        '''
+        if self._task is None or self._task.done():
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((X, future))
+        return await future
+
+    async def _gather(self):
+        '''Wait for a request then gather more until the window closes or
+        the batch is full
+
+        Inputs:
+            None
+        Outputs:
+            list
+                (rows, future) of each request in the batch
+        '''
+        if self._pending is not None:
+            batch, self._pending = [self._pending], None
+        else:
+            batch = [await self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.window
+        while rows < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0 and self._queue.empty():
+                break
+            try:
+                item = self._queue.get_nowait() if timeout <= 0 else \
+                    await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+            # Requests that do not fit start the next batch
+            if rows + len(item[0]) > self.max_batch_size:
+                self._pending = item
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    async def _run(self):
+        '''Score batches until cancelled
+
+        Inputs:
+            None
+        Outputs:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._gather()
+            sizes = [len(X) for X, _ in batch]
+            try:
+                labels, proba = await loop.run_in_executor(
+                    None, self.score, np.concatenate([X for X, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Fan the results back out to the requests
+            offset = 0
+            for size, (_, future) in zip(sizes, batch):
+                if not future.done():
+                    future.set_result((labels[offset:offset + size],
+                                       proba[offset:offset + size]))
+                offset += size
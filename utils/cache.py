@@ -0,0 +1,113 @@
+'''
+Process wide cache of artifacts loaded from disk
+
+Author: Christopher Bonham
+Date: 17th February 2023
+'''
+import os
+import time
+import logging
+import threading
+
+
+# Get the logger
+logger = logging.getLogger()
+
+
+class ArtifactCache:
+    '''Keep an artifact (e.g. the production model) resident in memory and
+    reload it when the file it was loaded from changes
+
+    A change is detected from the file stat (mtime, size and inode) so
+    artifacts published with os.replace are always picked up. The loaded
+    artifact and its signature are swapped as a single reference, so a
+    caller either gets the old or the new artifact, never a mix
+
+    If a reload fails the resident artifact is kept and the failing
+    signature is recorded, the reload is only retried once the file
+    changes again or retry_interval seconds have passed
+    '''
+
+    def __init__(self, watch_path, loader, retry_interval=30):
+        '''
+        Inputs:
+            watch_path (string)
+                Path to the file whose changes trigger a reload
+            loader (callable)
+                Function with no arguments that loads the artifact
+            retry_interval (float default = 30)
+                Seconds before a failed reload of an unchanged file is
+                retried
+        '''
+        self.watch_path = watch_path
+        self.loader = loader
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._state = (None, None)
+        self._failed = (None, 0.0)
+
+    def _signature(self):
+        '''Get the stat signature of the watched file
+
+        Inputs:
+            None
+        Outputs:
+            tuple
+                (mtime ns, size, inode) or None if the file does not exist
+        '''
+        try:
+            st = os.stat(self.watch_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def get(self):
+        '''Get the artifact, (re)loading it if the watched file has changed
+
+        Inputs:
+            None
+        Outputs:
+            object
+                Loaded artifact
+        '''
+        sig = self._signature()
+        loaded_sig, value = self._state
+        if value is not None and (sig == loaded_sig or self._backing_off(sig)):
+            return value
+
+        # Only one thread reloads, the others wait and reuse its result
+        with self._lock:
+            loaded_sig, value = self._state
+            if value is not None and \
+                    (sig == loaded_sig or self._backing_off(sig)):
+                return value
+            try:
+                value = self.loader()
+            except Exception:
+                # Keep serving the resident artifact if the reload fails
+                if value is None:
+                    raise
+                self._failed = (sig, time.monotonic())
+                logger.exception(f"cache.py: Reload of {self.watch_path} "
+                                 f"failed, keeping the resident artifact")
+                return value
+            self._state = (sig, value)
+            self._failed = (None, 0.0)
+            logger.info(f"cache.py: Loaded artifact {self.watch_path}")
+
+        return value
+
+    def _backing_off(self, sig):
+        '''Check if a reload of the file with this signature failed less
+        than retry_interval seconds ago
+
+        Inputs:
+            sig (tuple)
+                Stat signature of the watched file
+        Outputs:
+            boolean
+                True if the reload should not be retried yet
+        '''
+        failed_sig, failed_at = self._failed
+        return sig == failed_sig and \
+            time.monotonic() - failed_at < self.retry_interval
@@ -0,0 +1,182 @@
+'''
+Minimal DAG runner for pipeline stages with result caching
+
+Every stage declares the stages it depends on (their results are passed
+to it in memory), the files it reads and the files it writes. A stage's
+cache key is a hash of the stats (name, size and modification time) of
+its input files and the keys of its dependencies, a stage whose key is
+unchanged and whose outputs exist is skipped and its previous result
+reused. Stages whose dependencies are complete run concurrently
+
+Author: Christopher Bonham
+Date: 18th February 2023
+'''
+import os
+import pickle
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from utils.io import file_fingerprint
+
+
+# Get the logger
+logger = logging.getLogger()
+
+
+class Stage:
+    '''A pipeline stage'''
+
+    def __init__(self, name, fn, deps=(), inputs=None, outputs=None,
+                 when=None, cache=True, load=None):
+        '''
+        Inputs:
+            name (string)
+                Stage name
+            fn (callable)
+                Stage function, called with the results of deps in order
+            deps (list default = ())
+                Names of the stages this stage depends on
+            inputs (callable default = None)
+                Called with the results of deps, returns the paths of the
+                files (or folders) the stage reads
+            outputs (callable default = None)
+                Returns the paths of the files the stage writes
+            when (callable default = None)
+                Called with the results of deps, the stage (and everything
+                depending on it) is not run if it returns False
+            cache (boolean default = True)
+                Skip the stage if its inputs are unchanged, uncached stages
+                always run and should return a small result
+            load (callable default = None)
+                Rebuilds the result of a skipped stage from its outputs,
+                otherwise the pickled previous result is used
+        '''
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.inputs = inputs or (lambda *args: [])
+        self.outputs = outputs or (lambda: [])
+        self.when = when
+        self.cache = cache
+        self.load = load
+
+
+def path_fingerprint(path):
+    '''Get a fingerprint of a file or of every file in a folder from their
+    stats, so large inputs are not read to check if they have changed
+
+    Inputs:
+        path (string)
+            Path to file or folder
+    Outputs:
+        list
+            (name, size, mtime ns) of every file, empty if it does not
+            exist
+    '''
+    if os.path.isdir(path):
+        return [(fname,) + file_fingerprint(os.path.join(path, fname))[:2]
+                for fname in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, fname))]
+    if os.path.isfile(path):
+        return [(os.path.basename(path),) + file_fingerprint(path)[:2]]
+    return []
+
+
+def order_stages(stages):
+    '''Group stages into levels, every stage only depends on stages in
+    earlier levels
+
+    Inputs:
+        stages (list of Stage)
+            Stages
+    Outputs:
+        list
+            Lists of stages that can run concurrently
+    '''
+    remaining = {stage.name: stage for stage in stages}
+    done = set()
+    levels = []
+    while remaining:
+        level = [stage for stage in remaining.values()
+                 if all(dep in done for dep in stage.deps)]
+        if not level:
+            raise ValueError(f"Stages have missing or cyclic dependencies: "
+                             f"{list(remaining)}")
+        levels.append(level)
+        for stage in level:
+            done.add(stage.name)
+            del remaining[stage.name]
+    return levels
+
+
+def run_dag(stages, cache_path, workers=4):
+    '''Run the stages
+
+    Inputs:
+        stages (list of Stage)
+            Stages
+        cache_path (string)
+            Path to store the stage cache keys and results
+        workers (int default = 4)
+            Maximum number of stages run concurrently
+    Outputs:
+        dict
+            Stage name to result, None for stages that were not run
+    '''
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+    results, keys, disabled = {}, {}, set()
+
+    def run_stage(stage):
+        # Not run if a dependency was not run or its condition is not met
+        args = [results[dep] for dep in stage.deps]
+        if any(dep in disabled for dep in stage.deps) or \
+                (stage.when is not None and not stage.when(*args)):
+            logger.info(f"dag.py: Stage {stage.name} not required")
+            return stage, None, None, False
+
+        # Cache key from the input file stats and the dependency keys
+        sha = hashlib.sha256(stage.name.encode("utf-8"))
+        for path in stage.inputs(*args):
+            sha.update(repr(path_fingerprint(path)).encode("utf-8"))
+        for dep in stage.deps:
+            sha.update(keys[dep].encode("utf-8"))
+        key = sha.hexdigest()
+
+        # Skip the stage if it has already run with these inputs
+        key_path = os.path.join(cache_path, f"{stage.name}.key")
+        result_path = os.path.join(cache_path, f"{stage.name}.pkl")
+        if stage.cache and os.path.exists(key_path) and \
+                all(os.path.exists(p) for p in stage.outputs()):
+            with open(key_path, "r") as fp:
+                if fp.read() == key:
+                    logger.info(f"dag.py: Stage {stage.name} unchanged, "
+                                f"skipped")
+                    if stage.load is not None:
+                        return stage, stage.load(), key, True
+                    with open(result_path, "rb") as rp:
+                        return stage, pickle.load(rp), key, True
+
+        logger.info(f"dag.py: Running stage {stage.name}")
+        result = stage.fn(*args)
+        if not stage.cache:
+            # Dependents are keyed on the result of an uncached stage
+            sha.update(pickle.dumps(result))
+            return stage, result, sha.hexdigest(), True
+        if stage.load is None:
+            with open(result_path, "wb") as fp:
+                pickle.dump(result, fp)
+        with open(key_path, "w") as fp:
+            fp.write(key)
+        return stage, result, key, True
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for level in order_stages(stages):
+            for stage, result, key, ran in ex.map(run_stage, level):
+                results[stage.name] = result
+                if ran:
+                    keys[stage.name] = key
+                else:
+                    disabled.add(stage.name)
+
+    return results
@@ -6,9 +6,22 @@ Date: 16th February 2023
 '''
 import json
 import os
+import shutil
+import hashlib
 import pickle
 
 
+# Model features and label
+FEATURES = ["lastmonth_activity", "lastyear_activity", "number_of_employees"]
+LABEL = "exited"
+
+# Manifest selecting the live deployment version
+DEPLOYMENT_MANIFEST = "CURRENT.json"
+
+# File extensions of the supported data formats
+DATA_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
 def read_config(pth, display=False):
     '''Read in a config file (JSON format) and return a dictionary object
 
@@ -30,16 +43,41 @@ def read_config(pth, display=False):
     return config
 
 
+def resolve_deployment(deploy_path):
+    '''Get the directory of the live deployment version. Deployments made
+    before versioning (no manifest) are read from deploy_path itself
+
+    Inputs:
+        deploy_path (string)
+            Path to deployment (prod) directory
+    Outputs:
+        string
+            Path to live deployment directory
+    '''
+    fpath = os.path.join(deploy_path, DEPLOYMENT_MANIFEST)
+    if not os.path.exists(fpath):
+        return deploy_path
+    with open(fpath, 'r') as fp:
+        manifest = json.load(fp)
+    return os.path.join(deploy_path, manifest["path"])
+
+
 def load_model(in_path):
-    '''Load model
+    '''Load model, from the checksummed model artifact (trainedmodel.lrm)
+    if it exists, otherwise by unpickling trainedmodel.pkl
     Inputs:
         in_path (string)
             Path to model directory
 
     Outputs:
+        utils.linear.LinearScorer or
         sklearn.linear_model._logistic.LogisticRegression
             Logistic regression model
     '''
+    from utils.artifact import ARTIFACT_NAME, read_artifact
+    if os.path.exists(os.path.join(in_path, ARTIFACT_NAME)):
+        return read_artifact(in_path)
+
     with open(os.path.join(in_path, "trainedmodel.pkl"), 'rb') as file:
         lr = pickle.load(file)
 
@@ -60,9 +98,302 @@ def apply_model(df, lr):
             Model scores
     '''
     # Extract features
-    X = df[["lastmonth_activity", "lastyear_activity", "number_of_employees"]]
+    X = df[FEATURES]
 
     # Get model prediction
     y_pred = lr.predict(X)
 
     return y_pred
+
+
+def data_file(in_path, stem, data_format="csv"):
+    '''Get the path of a data file in a given format
+
+    Inputs:
+        in_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. finaldata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+    Outputs:
+        string
+            Path to data file
+    '''
+    if data_format not in DATA_EXTENSIONS:
+        raise ValueError(f"Unsupported data format: {data_format}")
+    return os.path.join(in_path, stem + DATA_EXTENSIONS[data_format])
+
+
+def resolve_data_file(in_path, stem, data_format="csv"):
+    '''Get the path of an existing data file, falling back to the csv file
+    if a columnar (parquet / feather) file has not been written yet
+
+    Inputs:
+        in_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. finaldata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+    Outputs:
+        tuple
+            Path to data file and its format
+    '''
+    fpath = data_file(in_path, stem, data_format)
+    if data_format != "csv" and not os.path.exists(fpath):
+        data_format = "csv"
+        fpath = data_file(in_path, stem, data_format)
+    return fpath, data_format
+
+
+def part_files(fpath):
+    '''Get the part files of a columnar dataset in the order they were
+    written. A columnar data file is either a single file or, once rows
+    have been appended to it, a directory of part files
+
+    Inputs:
+        fpath (string)
+            Path to data file or dataset directory
+    Outputs:
+        list
+            Paths to the part files
+    '''
+    if not os.path.isdir(fpath):
+        return [fpath]
+    return [os.path.join(fpath, fname) for fname in sorted(os.listdir(fpath))
+            if fname.startswith("part-")]
+
+
+def _dataset(fpath, data_format):
+    '''Open a columnar data file or dataset directory as one dataset
+
+    Inputs:
+        fpath (string)
+            Path to data file or dataset directory
+        data_format (string)
+            One of parquet or feather
+    Outputs:
+        pyarrow.dataset.Dataset
+            Dataset over the part files in the order they were written
+    '''
+    import pyarrow.dataset as ds
+    return ds.dataset(part_files(fpath), format=data_format)
+
+
+def file_fingerprint(fpath, hash_contents=False):
+    '''Get a fingerprint of a file that changes whenever the file does.
+    The fingerprint of a dataset directory combines those of its part files
+
+    Inputs:
+        fpath (string)
+            Path to file
+        hash_contents (boolean default = False)
+            Include a sha256 of the contents, otherwise only the size and
+            modification time are used
+    Outputs:
+        tuple
+            (size, mtime ns, sha256 or None)
+    '''
+    size, mtime_ns = 0, 0
+    sha = hashlib.sha256()
+    for part in part_files(fpath):
+        st = os.stat(part)
+        size += st.st_size
+        mtime_ns = max(mtime_ns, st.st_mtime_ns)
+        if hash_contents:
+            with open(part, "rb") as fp:
+                for block in iter(lambda: fp.read(1 << 20), b""):
+                    sha.update(block)
+    return size, mtime_ns, sha.hexdigest() if hash_contents else None
+
+
+def read_columns(in_path, stem, data_format="csv"):
+    '''Get the column names of a data file without reading its rows
+
+    Inputs:
+        in_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. finaldata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+    Outputs:
+        list
+            Column names
+    '''
+    fpath, data_format = resolve_data_file(in_path, stem, data_format)
+    if data_format == "csv":
+        import pandas as pd
+        return list(pd.read_csv(fpath, nrows=0).columns)
+    return _dataset(fpath, data_format).schema.names
+
+
+def read_data(in_path, stem, data_format="csv", columns=None, dtype=None):
+    '''Read a data file to a dataframe. Columnar (parquet / feather) files
+    fall back to the csv file if they have not been written yet, dataset
+    directories are read as one dataset
+
+    Inputs:
+        in_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. finaldata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        columns (list default = None)
+            Columns to read, None reads all of them
+        dtype (dict default = None)
+            Field dtypes used when parsing csv
+    Outputs:
+        pandas.DataFrame
+            Data
+    '''
+    import pandas as pd
+    fpath, data_format = resolve_data_file(in_path, stem, data_format)
+
+    if data_format != "csv" and os.path.isdir(fpath):
+        return _dataset(fpath, data_format).to_table(columns=columns) \
+            .to_pandas()
+    if data_format == "parquet":
+        return pd.read_parquet(fpath, columns=columns)
+    if data_format == "feather":
+        return pd.read_feather(fpath, columns=columns)
+    return pd.read_csv(fpath, usecols=columns, dtype=dtype)
+
+
+def _write_file(df, fpath, data_format):
+    '''Write a dataframe to a single data file
+
+    Inputs:
+        df (pandas.DataFrame)
+            Data to write
+        fpath (string)
+            Path to data file
+        data_format (string)
+            One of csv, parquet or feather
+    Outputs:
+        None
+    '''
+    if data_format == "parquet":
+        df.to_parquet(fpath, index=False)
+    elif data_format == "feather":
+        df.reset_index(drop=True).to_feather(fpath)
+    else:
+        df.to_csv(fpath, index=False)
+
+
+def write_data(df, out_path, stem, data_format="csv", export_csv=False,
+               append=False):
+    '''Write a dataframe to a data file
+
+    Appending to csv writes the rows to the end of the file. Appending to
+    a columnar format writes the rows as a new part file of a dataset
+    directory (a single file is first moved into the directory as its
+    first part), so the existing rows are never rewritten
+
+    Inputs:
+        df (pandas.DataFrame)
+            Data to write
+        out_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. finaldata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        export_csv (boolean default = False)
+            Also write a csv copy when using a columnar format
+        append (boolean default = False)
+            Add the rows to the existing data rather than replacing it
+    Outputs:
+        string
+            Path to the written data file (or dataset directory)
+    '''
+    fpath = data_file(out_path, stem, data_format)
+    ext = DATA_EXTENSIONS[data_format]
+
+    if not append or not os.path.exists(fpath):
+        if os.path.isdir(fpath):
+            shutil.rmtree(fpath)
+        _write_file(df, fpath, data_format)
+    elif data_format == "csv":
+        df.to_csv(fpath, mode="a", header=False, index=False)
+    else:
+        if not os.path.isdir(fpath):
+            os.replace(fpath, fpath + ".tmp")
+            os.makedirs(fpath)
+            os.replace(fpath + ".tmp",
+                       os.path.join(fpath, f"part-{0:05d}{ext}"))
+        part = os.path.join(fpath, f"part-{len(part_files(fpath)):05d}{ext}")
+        _write_file(df, part + ".tmp", data_format)
+        os.replace(part + ".tmp", part)
+
+    if export_csv and data_format != "csv":
+        csv_path = data_file(out_path, stem, "csv")
+        if append and os.path.exists(csv_path):
+            df.to_csv(csv_path, mode="a", header=False, index=False)
+        else:
+            df.to_csv(csv_path, index=False)
+
+    return fpath
+
+
+def iter_data(in_path, stem, data_format="csv", chunksize=100000,
+              columns=None):
+    '''Read a data file in bounded chunks. Csv is read chunksize rows at a
+    time, parquet by record batches and feather by its stored record
+    batches. Dataset directories are read part file by part file
+
+    Inputs:
+        in_path (string)
+            Path to data directory
+        stem (string)
+            File name without extension e.g. testdata
+        data_format (string default = "csv")
+            One of csv, parquet or feather
+        chunksize (int default = 100000)
+            Maximum rows per chunk (csv and parquet)
+        columns (list default = None)
+            Columns to read, None reads all of them
+    Outputs:
+        generator of pandas.DataFrame
+            Data chunks
+    '''
+    fpath, data_format = resolve_data_file(in_path, stem, data_format)
+
+    if data_format == "parquet":
+        import pyarrow.parquet as pq
+        for part in part_files(fpath):
+            for batch in pq.ParquetFile(part).iter_batches(
+                    batch_size=chunksize, columns=columns):
+                yield batch.to_pandas()
+    elif data_format == "feather":
+        import pyarrow as pa
+        for part in part_files(fpath):
+            with pa.memory_map(part) as source:
+                reader = pa.ipc.open_file(source)
+                for idx in range(reader.num_record_batches):
+                    batch = reader.get_batch(idx)
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    yield batch.to_pandas()
+    else:
+        import pandas as pd
+        yield from pd.read_csv(fpath, usecols=columns, chunksize=chunksize)
+
+
+def apply_model_proba(df, lr):
+    '''Get the positive class probabilities of a logistic regression model
+    applied to a pandas dataframe
+
+    Inputs:
+        df (pandas.DataFrame)
+            Dataframe to apply model to
+        lr (sklearn.linear_model._logistic.LogisticRegression
+            Logistic regression model)
+
+    Outputs:
+        numpy.array
+            Positive class probabilities
+    '''
+    return lr.predict_proba(df[FEATURES])[:, 1]
@@ -0,0 +1,106 @@
+'''
+Background execution of long running jobs with a cached latest result
+
+Author: Christopher Bonham
+Date: 17th February 2023
+'''
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Get the logger
+logger = logging.getLogger()
+
+
+class BackgroundJob:
+    '''Run a job on a worker pool and keep its latest result
+
+    Only one run is in flight at a time, triggering while a run is in
+    progress is a no-op. Callers read the latest result (and its age)
+    immediately without waiting for a run to finish
+    '''
+
+    def __init__(self, fn, max_workers=1):
+        '''
+        Inputs:
+            fn (callable)
+                Job to run, called with no arguments
+            max_workers (int default = 1)
+                Size of the worker pool
+        '''
+        self.fn = fn
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._future = None
+        self._started_at = None
+        self._result = None
+        self._completed_at = None
+        self._error = None
+
+    def _run(self):
+        '''Run the job and store its result or error
+
+        Inputs:
+            None
+        Outputs:
+            None
+        '''
+        try:
+            result = self.fn()
+        except Exception as e:
+            logger.exception("jobs.py: Background job failed")
+            with self._lock:
+                self._error = repr(e)
+            return
+        with self._lock:
+            self._result = result
+            self._completed_at = time.time()
+            self._error = None
+
+    def trigger(self):
+        '''Start a run unless one is already in progress
+
+        Inputs:
+            None
+        Outputs:
+            boolean
+                True if a new run was started
+        '''
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return False
+            self._started_at = time.time()
+            self._future = self._executor.submit(self._run)
+        return True
+
+    def snapshot(self):
+        '''Get the state of the job and its latest result
+
+        Inputs:
+            None
+        Outputs:
+            dict
+                state (never_run, running or idle), result, age_seconds
+                of the result, started_at, completed_at and error of the
+                last failed run
+        '''
+        with self._lock:
+            running = self._future is not None and not self._future.done()
+            if running:
+                state = "running"
+            elif self._future is None:
+                state = "never_run"
+            else:
+                state = "idle"
+            age = None if self._completed_at is None \
+                else time.time() - self._completed_at
+            return {
+                "state": state,
+                "result": self._result,
+                "age_seconds": age,
+                "started_at": self._started_at,
+                "completed_at": self._completed_at,
+                "error": self._error,
+            }
@@ -0,0 +1,117 @@
+'''
+Pure NumPy scorer for the trained logistic regression model
+
+The coefficients, intercept and feature order are exported to a small
+versioned artifact (see utils.artifact) so serving can score without
+importing sklearn
+
+Author: Christopher Bonham
+Date: 16th February 2023
+'''
+import numpy as np
+
+
+class LinearScorer:
+    '''Logistic regression scorer computing the decision function with a
+    single NumPy dot. It has the predict / predict_proba interface of the
+    sklearn model so it can be used with utils.io.apply_model
+    '''
+
+    def __init__(self, coef, intercept, features, classes=(0, 1)):
+        '''
+        Inputs:
+            coef (array like)
+                Coefficients, one per feature
+            intercept (float)
+                Intercept
+            features (list)
+                Feature names in coefficient order
+            classes (array like default = (0, 1))
+                Negative and positive class labels
+        '''
+        self.coef = np.asarray(coef, dtype=np.float64).reshape(1, -1)
+        self.intercept = np.asarray(intercept, dtype=np.float64).reshape(1)
+        self.features = list(features)
+        self.classes = np.asarray(classes)
+        self.metadata = {}
+
+    @classmethod
+    def from_model(cls, lr, features):
+        '''Create a scorer from a fitted binary sklearn linear model
+
+        Inputs:
+            lr (sklearn.linear_model._logistic.LogisticRegression)
+                Logistic regression model
+            features (list)
+                Feature names in training order
+        Outputs:
+            LinearScorer
+                Scorer
+        '''
+        return cls(lr.coef_, lr.intercept_, features, lr.classes_)
+
+    def _as_array(self, X):
+        '''Get the features as a contiguous float array
+
+        Inputs:
+            X (pandas.DataFrame or array like)
+                Features, dataframes are reordered to the model features
+        Outputs:
+            numpy.array
+                2D float64 array
+        '''
+        if hasattr(X, "columns"):
+            X = X[self.features].to_numpy(dtype=np.float64)
+        return np.ascontiguousarray(X, dtype=np.float64)
+
+    def decision_function(self, X):
+        '''Get the decision function (log odds)
+        NB computed as in sklearn so the labels match lr.predict exactly
+
+        Inputs:
+            X (pandas.DataFrame or array like)
+                Features
+        Outputs:
+            numpy.array
+                Decision function
+        '''
+        return (self._as_array(X) @ self.coef.T + self.intercept).ravel()
+
+    def predict(self, X):
+        '''Get the predicted labels
+
+        Inputs:
+            X (pandas.DataFrame or array like)
+                Features
+        Outputs:
+            numpy.array
+                Predicted labels
+        '''
+        return self.classes[(self.decision_function(X) > 0).astype(int)]
+
+    def predict_proba(self, X):
+        '''Get the class probabilities
+
+        Inputs:
+            X (pandas.DataFrame or array like)
+                Features
+        Outputs:
+            numpy.array
+                Negative and positive class probabilities, one row per record
+        '''
+        p = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1 - p, p])
+
+    def score(self, X):
+        '''Get the predicted labels and positive class probabilities
+
+        Inputs:
+            X (pandas.DataFrame or array like)
+                Features
+        Outputs:
+            tuple
+                Predicted labels, positive class probabilities
+        '''
+        d = self.decision_function(X)
+        return (self.classes[(d > 0).astype(int)],
+                1.0 / (1.0 + np.exp(-d)))
@@ -0,0 +1,59 @@
+'''
+Model performance metrics built on running confusion matrix counts
+
+Author: Christopher Bonham
+Date: 16th February 2023
+'''
+import numpy as np
+from utils.io import apply_model, LABEL
+
+
+def confusion_counts(y, y_pred):
+    '''Get the confusion matrix counts of binary (0/1) labels and predictions
+
+    Inputs:
+        y (array like)
+            Actual labels
+        y_pred (array like)
+            Predicted labels
+    Outputs:
+        numpy.array
+            2x2 counts, rows are actual and columns are predicted
+    '''
+    idx = 2 * np.asarray(y, dtype=np.int64) + \
+        np.asarray(y_pred, dtype=np.int64)
+    return np.bincount(idx, minlength=4).reshape(2, 2)
+
+
+def score_chunks(chunks, lr):
+    '''Apply a model chunk by chunk accumulating confusion matrix counts
+
+    Inputs:
+        chunks (iterable of pandas.DataFrame)
+            Data chunks to score, must contain the label
+        lr (sklearn.linear_model._logistic.LogisticRegression)
+            Logistic regression model
+    Outputs:
+        numpy.array
+            2x2 confusion matrix counts
+    '''
+    cm = np.zeros((2, 2), dtype=np.int64)
+    for chunk in chunks:
+        cm += confusion_counts(chunk[LABEL], apply_model(chunk, lr))
+    return cm
+
+
+def f1_from_counts(cm):
+    '''Get the F1 score from confusion matrix counts
+    NB matches sklearn.metrics.f1_score returning 0 when undefined
+
+    Inputs:
+        cm (numpy.array)
+            2x2 confusion matrix counts
+    Outputs:
+        float
+            F1 score
+    '''
+    tp, fp, fn = cm[1, 1], cm[0, 1], cm[1, 0]
+    denom = 2 * tp + fp + fn
+    return float(2 * tp / denom) if denom > 0 else 0.0
@@ -0,0 +1,123 @@
+'''
+Decoding of batch prediction request payloads
+
+Author: Christopher Bonham
+Date: 17th February 2023
+'''
+import json
+import numpy as np
+import pandas as pd
+from utils.io import apply_model, apply_model_proba, FEATURES
+
+
+# Supported request content types
+JSON_TYPE = "application/json"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+BINARY_TYPE = "application/octet-stream"
+
+
+def decode_batch(body, content_type):
+    '''Decode a batch of records to score into a dataframe of features
+
+    Supported payloads
+        application/json
+            A list of records [{"lastmonth_activity": 1, ...}, ...],
+            a list of rows in feature order [[1, 2, 3], ...] or
+            columns {"lastmonth_activity": [1, ...], ...}
+        application/vnd.apache.arrow.stream
+            Arrow IPC stream with (at least) the feature columns
+        application/octet-stream
+            Packed little endian float64 array, row major, one row per
+            record with the features in model order
+
+    Every feature value must be a finite number, so a malformed payload is
+    rejected here (and answered with a 400) rather than failing in the
+    model
+
+    Inputs:
+        body (bytes)
+            Request body
+        content_type (string)
+            Request content type (any parameters are ignored)
+    Outputs:
+        pandas.DataFrame
+            Features to score (float64)
+    '''
+    content_type = (content_type or "").split(";")[0].strip().lower()
+
+    if content_type == JSON_TYPE:
+        data = json.loads(body)
+        if isinstance(data, dict):
+            df = pd.DataFrame(data)
+        elif not isinstance(data, list):
+            raise ValueError("JSON payload must be a list of records or "
+                             "rows, or an object of columns")
+        elif all(isinstance(row, list) for row in data):
+            df = pd.DataFrame(data, columns=FEATURES)
+        elif all(isinstance(row, dict) for row in data):
+            df = pd.DataFrame.from_records(data, columns=FEATURES)
+        else:
+            raise ValueError("JSON payload rows must all be records or all "
+                             "be lists of feature values")
+
+    elif content_type == ARROW_TYPE:
+        import pyarrow as pa
+        df = pa.ipc.open_stream(body).read_all().to_pandas()
+
+    elif content_type == BINARY_TYPE:
+        X = np.frombuffer(body, dtype="<f8")
+        if X.size % len(FEATURES) != 0:
+            raise ValueError(f"Binary payload of {X.size} values is not a "
+                             f"whole number of {len(FEATURES)} feature rows")
+        df = pd.DataFrame(X.reshape(-1, len(FEATURES)), columns=FEATURES)
+
+    else:
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+    missing = [f for f in FEATURES if f not in df.columns]
+    if missing:
+        raise ValueError(f"Payload is missing features: {missing}")
+
+    # Convert to float and reject missing, infinite or non-numeric values
+    try:
+        X = df[FEATURES].to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Payload features must be numeric") from None
+    invalid = np.flatnonzero(~np.isfinite(X).all(axis=1))
+    if len(invalid) > 0:
+        raise ValueError(f"Payload features must be finite numbers, "
+                         f"invalid rows: {invalid[:10].tolist()}")
+
+    return pd.DataFrame(X, columns=FEATURES)
+
+
+def predict_batch(body, content_type, get_model):
+    '''Handle a batch prediction request, shared by the batch prediction
+    endpoints of app.py and serve.py
+
+    Inputs:
+        body (bytes)
+            Request body, see decode_batch
+        content_type (string)
+            Request content type
+        get_model (callable)
+            Returns the model to score with e.g. ArtifactCache.get, only
+            called for a valid non empty batch
+    Outputs:
+        tuple
+            Response body (dict) and HTTP status code
+    '''
+    # Decode the records to score
+    try:
+        df = decode_batch(body, content_type)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if len(df) == 0:
+        return {"predictions": [], "probabilities": []}, 200
+
+    # Score the batch in a single call
+    lr = get_model()
+    return {
+        "predictions": apply_model(df, lr).tolist(),
+        "probabilities": apply_model_proba(df, lr).tolist(),
+    }, 200
@@ -0,0 +1,397 @@
+'''
+Mergeable (streaming) summary statistics
+
+The accumulators are updated chunk by chunk and can be merged, so stats
+can be built over data that does not fit in memory, over parallel
+partitions, or updated incrementally as new data is ingested
+
+Author: Christopher Bonham
+Date: 16th February 2023
+'''
+import json
+import numpy as np
+
+
+class RunningMoments:
+    '''Running count, mean and variance of the columns of a 2D array
+    (Welford / Chan et al. parallel update), missing values are skipped
+    '''
+
+    def __init__(self, n_cols):
+        '''
+        Inputs:
+            n_cols (int)
+                Number of columns
+        '''
+        self.count = np.zeros(n_cols)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+
+    def _combine(self, count, mean, m2):
+        '''Combine the moments of another batch into the running moments
+
+        Inputs:
+            count, mean, m2 (numpy.array)
+                Count, mean and sum of squared deviations of the batch
+        Outputs:
+            None
+        '''
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self.mean
+            new_mean = self.mean + delta * np.where(total > 0,
+                                                    count / total, 0)
+            new_m2 = self.m2 + m2 + delta ** 2 * np.where(
+                total > 0, self.count * count / total, 0)
+        self.mean = np.where(count > 0, new_mean, self.mean)
+        self.m2 = np.where(count > 0, new_m2, self.m2)
+        self.count = total
+
+    def update(self, X):
+        '''Update with a batch of rows
+
+        Inputs:
+            X (numpy.array)
+                2D float array, one column per statistic
+        Outputs:
+            None
+        '''
+        valid = ~np.isnan(X)
+        count = valid.sum(axis=0).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(valid, X, 0).sum(axis=0) / count
+            m2 = np.where(valid, (X - mean) ** 2, 0).sum(axis=0)
+        self._combine(count, np.nan_to_num(mean), m2)
+
+    def merge(self, other):
+        '''Merge another accumulator into this one
+
+        Inputs:
+            other (RunningMoments)
+                Accumulator over the same columns
+        Outputs:
+            None
+        '''
+        self._combine(other.count, other.mean, other.m2)
+
+    def variance(self, ddof=1):
+        '''Get the variance of each column
+
+        Inputs:
+            ddof (int default = 1)
+                Delta degrees of freedom
+        Outputs:
+            numpy.array
+                Variances, NaN where there are too few values
+        '''
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > ddof,
+                            self.m2 / (self.count - ddof), np.nan)
+
+
+class TDigest:
+    '''Merging t-digest quantile sketch (Dunning) of a single column
+
+    Values are held as weighted centroids, compressed with the k1 scale
+    function so the sketch stays small (about compression centroids) and
+    is most accurate in the tails. Min and max are tracked exactly
+    '''
+
+    def __init__(self, compression=100):
+        '''
+        Inputs:
+            compression (int default = 100)
+                Size / accuracy trade off of the sketch
+        '''
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _compress(self, means, weights):
+        '''Sort the centroids and merge neighbours that fall in the same
+        unit of the k1 scale function
+
+        Inputs:
+            means, weights (numpy.array)
+                Centroids to compress
+        Outputs:
+            None
+        '''
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        if total == 0:
+            return
+
+        # Scale function at the centre of each centroid
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        group = np.floor(k - k[0]).astype(np.int64)
+
+        # Weighted mean of the centroids in each group
+        group_weights = np.bincount(group, weights)
+        keep = group_weights > 0
+        self.means = (np.bincount(group, weights * means)[keep] /
+                      group_weights[keep])
+        self.weights = group_weights[keep]
+
+    def update(self, values):
+        '''Update with a batch of values, missing values are skipped
+
+        Inputs:
+            values (numpy.array)
+                1D float array
+        Outputs:
+            None
+        '''
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other):
+        '''Merge another sketch into this one
+
+        Inputs:
+            other (TDigest)
+                Sketch to merge
+        Outputs:
+            None
+        '''
+        if len(other.means) == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]),
+                       np.concatenate([self.weights, other.weights]))
+
+    def quantile(self, q):
+        '''Get approximate quantiles
+
+        Inputs:
+            q (float or array like)
+                Quantiles in [0, 1]
+        Outputs:
+            float or numpy.array
+                Quantile estimates, NaN if the sketch is empty
+        '''
+        if len(self.means) == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+        # Interpolate between the centroid centres, pinned to min and max
+        total = self.weights.sum()
+        centres = (np.cumsum(self.weights) - self.weights / 2) / total
+        xp = np.concatenate([[0.0], centres, [1.0]])
+        fp = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(q, xp, fp)
+
+
+class SummaryAccumulator:
+    '''Mergeable summary of a dataframe: row count, null counts of every
+    field plus running mean / variance and a t-digest of every numeric
+    field. The numeric fields are fixed by the first chunk seen
+    '''
+
+    def __init__(self, compression=100):
+        '''
+        Inputs:
+            compression (int default = 100)
+                Compression of the quantile sketches
+        '''
+        self.compression = compression
+        self.rows = 0
+        self.columns = None
+        self.nulls = None
+        self.numeric = None
+        self.moments = None
+        self.digests = None
+
+    def _init_columns(self, columns, numeric):
+        '''Set up the per field accumulators
+
+        Inputs:
+            columns (list)
+                All field names
+            numeric (list)
+                Numeric field names
+        Outputs:
+            None
+        '''
+        self.columns = list(columns)
+        self.nulls = np.zeros(len(self.columns), dtype=np.int64)
+        self.numeric = list(numeric)
+        self.moments = RunningMoments(len(self.numeric))
+        self.digests = [TDigest(self.compression) for _ in self.numeric]
+
+    def update(self, df):
+        '''Update with a chunk of data
+
+        Inputs:
+            df (pandas.DataFrame)
+                Data chunk
+        Outputs:
+            None
+        '''
+        if self.columns is None:
+            self._init_columns(
+                df.columns, df.select_dtypes(include='number').columns
+            )
+        self.rows += len(df)
+        self.nulls += df[self.columns].isnull().sum().values
+        X = df[self.numeric].to_numpy(dtype=float)
+        self.moments.update(X)
+        for idx, digest in enumerate(self.digests):
+            digest.update(X[:, idx])
+
+    def merge(self, other):
+        '''Merge another accumulator (e.g. from a parallel partition)
+
+        Inputs:
+            other (SummaryAccumulator)
+                Accumulator over the same fields
+        Outputs:
+            None
+        '''
+        if other.columns is None:
+            return
+        if self.columns is None:
+            self._init_columns(other.columns, other.numeric)
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.moments.merge(other.moments)
+        for digest, other_digest in zip(self.digests, other.digests):
+            digest.merge(other_digest)
+
+    def summary(self):
+        '''Get the summary stats, in the format of
+        diagnostics.dataframe_summary (median is approximate)
+
+        Inputs:
+            None
+        Outputs:
+            dict
+                {field: {"mean": .., "median": .., "std": ..}}
+        '''
+        if self.columns is None:
+            return {}
+        std = np.sqrt(self.moments.variance())
+        return {
+            var: {
+                "mean": float(self.moments.mean[idx])
+                if self.moments.count[idx] > 0 else float("nan"),
+                "median": float(self.digests[idx].quantile(0.5)),
+                "std": float(std[idx]),
+            }
+            for idx, var in enumerate(self.numeric)
+        }
+
+    def quantiles(self, q):
+        '''Get approximate quantiles of every numeric field
+
+        Inputs:
+            q (list)
+                Quantiles in [0, 1]
+        Outputs:
+            dict
+                {field: [quantile estimates]}
+        '''
+        if self.columns is None:
+            return {}
+        return {var: list(map(float, digest.quantile(q)))
+                for var, digest in zip(self.numeric, self.digests)}
+
+    def missing(self):
+        '''Get the fraction of missing values of every field, in the format
+        of diagnostics.missing_data
+
+        Inputs:
+            None
+        Outputs:
+            list
+                Fraction of missing values
+        '''
+        if self.columns is None or self.rows == 0:
+            return []
+        return list(map(float, self.nulls / self.rows))
+
+    def to_dict(self):
+        '''Serialise to a JSON compatible dict
+
+        Inputs:
+            None
+        Outputs:
+            dict
+                Accumulator state
+        '''
+        state = {"compression": self.compression, "rows": self.rows,
+                 "columns": self.columns}
+        if self.columns is not None:
+            state.update({
+                "nulls": self.nulls.tolist(),
+                "numeric": self.numeric,
+                "count": self.moments.count.tolist(),
+                "mean": self.moments.mean.tolist(),
+                "m2": self.moments.m2.tolist(),
+                "digests": [{"means": d.means.tolist(),
+                             "weights": d.weights.tolist(),
+                             "min": float(d.min), "max": float(d.max)}
+                            for d in self.digests],
+            })
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        '''Deserialise from a dict created by to_dict
+
+        Inputs:
+            state (dict)
+                Accumulator state
+        Outputs:
+            SummaryAccumulator
+                Accumulator
+        '''
+        acc = cls(state["compression"])
+        acc.rows = state["rows"]
+        if state["columns"] is None:
+            return acc
+        acc._init_columns(state["columns"], state["numeric"])
+        acc.nulls = np.array(state["nulls"], dtype=np.int64)
+        acc.moments.count = np.array(state["count"], dtype=float)
+        acc.moments.mean = np.array(state["mean"], dtype=float)
+        acc.moments.m2 = np.array(state["m2"], dtype=float)
+        for digest, d in zip(acc.digests, state["digests"]):
+            digest.means = np.array(d["means"], dtype=float)
+            digest.weights = np.array(d["weights"], dtype=float)
+            digest.min, digest.max = d["min"], d["max"]
+        return acc
+
+    def save(self, fpath):
+        '''Write the accumulator to a JSON file
+
+        Inputs:
+            fpath (string)
+                Path to JSON file
+        Outputs:
+            None
+        '''
+        with open(fpath, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+    @classmethod
+    def load(cls, fpath):
+        '''Read an accumulator from a JSON file
+
+        Inputs:
+            fpath (string)
+                Path to JSON file
+        Outputs:
+            SummaryAccumulator
+                Accumulator
+        '''
+        with open(fpath, "r") as fp:
+            return cls.from_dict(json.load(fp))